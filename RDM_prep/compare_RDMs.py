@@ -0,0 +1,89 @@
+"""
+compare_RDMs.py
+script to compare the landmark RDM (create_landmark_RDM.py) with the fastText RDM (get_fasttext_vectors.py)
+for the FL_BILINGUAL stimuli
+
+- loads landmark_RDM_binned.hdf5 and ft_300_cosine_dissimilarities.npy (+ ft_word_vector_descriptors.csv for the
+stimulus_id of its rows), or both RDMs from the study store (rdm_source = 'store', see study_store.py), and matches
+their conditions by stimulus_id (via video_title in the stimulus list)
+- for each comparison method ('corr', 'rho-a', 'spearman'; as in rsatoolbox.rdm.compare):
+    - p-value of a permutation test over the condition labels (n_permutations)
+    - bootstrap confidence interval over conditions (n_bootstraps)
+  both computed in batches, optionally across n_workers processes (see rdm_comparison.py)
+- prints the results and saves them to landmark_ft_RDM_comparison.csv
+
+required conda environment: RDM_prep (on Linux office workstation)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import rsatoolbox
+
+from rdm_comparison import condensed_vector, permutation_test, bootstrap
+from study_store import StudyStore, store_path
+
+### SETTINGS
+# where to load the RDMs from: 'files' (landmark_RDM_binned.hdf5, ft_300_cosine_dissimilarities.npy) or
+# 'store' (FL_BILINGUAL_study.h5, written by study_store.py)
+rdm_source = 'files'
+comparison_methods = ['corr', 'rho-a', 'spearman']
+n_permutations = 10000
+n_bootstraps = 1000
+confidence = 0.95
+n_workers = 1  # number of worker processes for the permutations/bootstrap resamples
+seed = 0
+
+# get location of this script:
+script_path = os.path.abspath(__file__)
+script_dir = os.path.abspath(os.path.dirname(script_path))
+out_dir = script_dir
+stimlist_relative = '../sample_stimuli/FL_BILINGUAL_stimuli_alphabeticalID.csv'
+stimlist_path = os.path.normpath(os.path.join(script_dir, stimlist_relative))
+
+
+def load_matched_rdms():
+    # videos and condensed landmark and fastText RDM vectors, with the conditions in the same order (that of the landmark RDM)
+    if rdm_source == 'store':
+        with StudyStore(store_path) as store:
+            landmark_rdm = store.rdm('landmark_RDM_binned')
+            ft_rdm = store.rdm('ft_300_cosine')
+        ft_dissimilarities = ft_rdm.get_matrices()[0]
+        ft_ids = list(ft_rdm.pattern_descriptors['stimulus_id'])
+    elif rdm_source == 'files':
+        landmark_rdm = rsatoolbox.rdm.load_rdm(os.path.join(out_dir, 'landmark_RDM_binned.hdf5'))
+        ft_dissimilarities = np.load(os.path.join(out_dir, 'ft_300_cosine_dissimilarities.npy'))
+        ft_ids = pd.read_csv(os.path.join(out_dir, 'ft_word_vector_descriptors.csv'))['stimulus_id'].tolist()
+    else:
+        raise ValueError(f"unknown rdm_source {rdm_source!r}, use 'files' or 'store'")
+    stimuli = pd.read_csv(stimlist_path)
+    video_ids = dict(zip(stimuli['video_title'], stimuli['stimulus_id']))
+
+    videos = list(landmark_rdm.pattern_descriptors['conds'])
+    missing = [video for video in videos if video_ids.get(video) not in ft_ids]
+    if missing:
+        raise ValueError(f'no fastText vectors for the videos {missing}')
+    order = [ft_ids.index(video_ids[video]) for video in videos]
+    ft_dissimilarities = ft_dissimilarities[np.ix_(order, order)]
+    return videos, condensed_vector(landmark_rdm), condensed_vector(ft_dissimilarities)
+
+
+def main():
+    videos, landmark_vector, ft_vector = load_matched_rdms()
+    print(f'comparing landmark & fastText RDMs over {len(videos)} conditions')
+
+    results = []
+    for method in comparison_methods:
+        observed, p_value, _ = permutation_test(landmark_vector, ft_vector, method, n_permutations, seed, n_workers)
+        (ci_low, ci_high), _ = bootstrap(landmark_vector, ft_vector, method, n_bootstraps, seed, n_workers, confidence)
+        results.append({'method': method, 'similarity': observed, 'p_permutation': p_value,
+                        'ci_low': ci_low, 'ci_high': ci_high, 'confidence': confidence,
+                        'n_permutations': n_permutations, 'n_bootstraps': n_bootstraps, 'n_conditions': len(videos)})
+        print(f'{method:<9} {observed: .4f}  p = {p_value:.4f}  {confidence:.0%} CI [{ci_low: .4f}, {ci_high: .4f}]')
+    pd.DataFrame(results).to_csv(os.path.join(out_dir, 'landmark_ft_RDM_comparison.csv'), index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+cosine_rdm.py
+blockwise cosine-dissimilarity engine for large sets of word vectors (e.g. tens of thousands of candidate words)
+
+- the vectors are normalized once (float32 by default), then the dissimilarities (1 - cosine similarity) are computed
+  for blocks of block_rows rows at a time, against all later rows only (upper triangle), spread across n_threads
+  threads (numpy releases the GIL in the matrix products)
+- condensed_cosine_rdm writes them into a condensed vector (upper triangle, row by row, as RDMs.get_vectors() in
+  rsatoolbox and scipy's squareform), optionally a memory-mapped .npy file (open_condensed), so the N x N matrix never
+  exists in memory; memory per block: block_rows x N
+- top_k gives the k nearest (or farthest) words of each word, also block by block, without the full matrix
+- condensed_index / square_index convert between (row, column) and condensed positions
+
+used by: get_fasttext_vectors.py (lexicon-scale RDM, see lexicon_path there)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import concurrent.futures
+import numpy as np
+
+default_block_rows = 1024
+
+
+def normalized_rows(vectors, dtype=np.float32):
+    # rows scaled to unit length (rows of zeros stay zero, as cosine_similarity in sklearn)
+    vectors = np.asarray(vectors, dtype=dtype)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1).astype(dtype)
+
+
+def condensed_length(n):
+    return n * (n - 1) // 2
+
+
+def row_offset(row, n):
+    # position of (row, row + 1) in the condensed vector
+    return row * n - row * (row + 1) // 2
+
+
+def condensed_index(row, col, n):
+    # condensed position of the pair (row, col), row != col
+    row, col = np.minimum(row, col), np.maximum(row, col)
+    return row_offset(row, n) + col - row - 1
+
+
+def square_index(index, n):
+    # (row, column) of condensed positions (inverse of condensed_index)
+    index = np.asarray(index, dtype=np.int64)
+    row = (n - 2 - np.floor(np.sqrt(-8 * index + 4 * n * (n - 1) - 7) / 2 - 0.5)).astype(np.int64)
+    return row, index + row + 1 - row_offset(row, n)
+
+
+def open_condensed(path, n, dtype=np.float32):
+    # memory-mapped condensed RDM of n conditions (.npy), e.g. as out of condensed_cosine_rdm
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(condensed_length(n),))
+
+
+def _row_blocks(n, block_rows):
+    return [(start, min(start + block_rows, n)) for start in range(0, n, block_rows)]
+
+
+def _map_blocks(function, blocks, n_threads):
+    if n_threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(n_threads) as pool:
+            return list(pool.map(function, blocks))
+    return [function(block) for block in blocks]
+
+
+def condensed_cosine_rdm(vectors, out=None, block_rows=default_block_rows, n_threads=1, dtype=np.float32):
+    # condensed cosine-dissimilarity RDM of the rows of vectors; written into out (allocated if not given)
+    normalized = normalized_rows(vectors, dtype)
+    n = len(normalized)
+    if out is None:
+        out = np.empty(condensed_length(n), dtype=dtype)
+    elif out.shape != (condensed_length(n),):
+        raise ValueError(f'out has shape {out.shape}, expected ({condensed_length(n)},)')
+
+    def fill(block):
+        # the rows of this block against themselves and all later rows; each row's part of the upper triangle is
+        # one contiguous stretch of the condensed vector
+        start, stop = block
+        dissimilarities = 1 - normalized[start:stop] @ normalized[start:].T
+        for row in range(start, stop):
+            out[row_offset(row, n):row_offset(row + 1, n)] = dissimilarities[row - start, row - start + 1:]
+
+    _map_blocks(fill, _row_blocks(n, block_rows), n_threads)
+    return out
+
+
+def top_k(vectors, k, nearest=True, block_rows=default_block_rows, n_threads=1, dtype=np.float32):
+    # the k nearest (nearest=True: lowest dissimilarity) or farthest words of each word (excluding itself);
+    # returns indices and dissimilarities, both (words, k), sorted from nearest (farthest) on
+    normalized = normalized_rows(vectors, dtype)
+    n = len(normalized)
+    k = min(k, n - 1)
+    indices = np.empty((n, k), dtype=np.int64)
+    dissimilarities = np.empty((n, k), dtype=dtype)
+
+    def fill(block):
+        start, stop = block
+        # rank by similarity (negated for the farthest words), the word itself last
+        scores = normalized[start:stop] @ normalized.T
+        if not nearest:
+            scores = -scores
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k > 0 else np.empty((stop - start, 0), dtype=np.int64)
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+        indices[start:stop] = np.take_along_axis(best, order, axis=1)
+        similarities = np.take_along_axis(scores, indices[start:stop], axis=1)
+        dissimilarities[start:stop] = 1 - (similarities if nearest else -similarities)
+
+    _map_blocks(fill, _row_blocks(n, block_rows), n_threads)
+    return indices, dissimilarities
@@ -3,13 +3,20 @@ create_landmark_RDM.py
 script to create a RDM from the pose & hand landmark vectors as obtained
 for the gesture videos in the FL_BILINGUAL study.
 
-- takes pose landmark, left handmark, right handmark arrays (as created in estimate_pose_hands.py)
-- combines them into one array (landmarks_3d) and makes each dimension of the coordinate system (x, y, z)
-its own value
-- creates channel names and timing vector (both hard-coded)
-- creates an rsatoolbox.data.TemporalDataset from landmarks_3d
+- takes pose landmark, left handmark, right handmark arrays (as created in estimate_pose_hands.py), either from the
+npy arrays, from the ragged landmark store or from its compact (quantized) copy (see landmark_source below)
+- selects the landmarks given in channel_spec and combines them into one (video, coordinate, frame) array, making each
+dimension of the coordinate system (x, y, z) its own value; the npy arrays are memory-mapped and the result is written in
+one pass into landmarks_by_word_and_frame.npy (memory-mapped as well), see landmark_channels.py
+- creates channel names (from channel_spec) and timing vector (hard-coded fps)
+- creates an rsatoolbox.data.TemporalDataset from the measurements
 - bins it over time (i.e. makes it non-temporal by instead creating one condition per condition x timepoint)
-- calculates an RDM from this dataset (using cross-validation)
+- calculates an RDM from this dataset (using cross-validation); by default via the equivalent, much faster
+blockwise engine in crossnobis.py (see rdm_engine below)
+- optionally (rdm_movie = True) also calculates a time-resolved RDM movie: one cross-validated RDM per sliding window
+of frames (movie_window, movie_stride), spread across movie_n_workers processes, saved to landmark_RDM_movie.hdf5
+- the steps are also available as functions (load_landmarks, assemble_landmarks, make_channel_names, calc_landmark_rdm),
+e.g. for the benchmarks in ../benchmarks
 
 required conda environment: RDM_prep (on Linux office workstation)
 current version: 2024-01-17
@@ -21,8 +28,41 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import rsatoolbox
 import os
+import sys
 
 from rsatoolbox.rdm import calc_rdm_movie
+from crossnobis import calc_binned_crossnobis_rdm, calc_crossnobis_rdm_movie
+from landmark_channels import channel_names as spec_channel_names, open_npy_landmarks, open_measurements, \
+    assemble_measurements
+
+### SETTINGS
+# where to load the landmarks from:
+# 'npy'   - pose_landmarks.npy, lh_landmarks.npy, rh_landmarks.npy & landmark_inputs.csv (all videos cut to the shortest one)
+# 'store' - the ragged landmark store written by estimate_pose_hands.py (landmark_store/), which keeps all frames
+# 'compact' - the compact copy of the landmark store (landmarks_compact.npz, see landmark_codec.py), decoded on loading;
+#             coordinates within the error bound stored in the file (int16: ~1e-5), see ../benchmarks/check_compact_landmarks.py
+landmark_source = 'npy'
+# only for landmark_source = 'store' / 'compact': how to bring videos of different length to the same number of frames
+# 'truncate' (cut to the shortest video), 'pad' (pad to the longest video with NaN, i.e. missing data), or a number of frames
+frame_alignment = 'truncate'
+# how to compute the crossnobis RDM:
+# 'blockwise'  - vectorized engine for the (conditions, channels, times) layout (see crossnobis.py); same result as
+#                'rsatoolbox', but much faster and with far less memory for many/long videos
+# 'rsatoolbox' - bin the TemporalDataset over time and use rsatoolbox.rdm.calc_rdm_unbalanced
+rdm_engine = 'blockwise'
+rdm_dtype = np.float64  # precision of the 'blockwise' engine; np.float32 halves memory (at ~1e-6 relative precision)
+# which landmarks to use as channels (x, y, z of each), in this order (see landmark_channels.py; landmarks by index or name):
+# everything from the left and right hand arrays;
+# everything from the pose array, EXCEPT the hands (15-22) and the legs/feet (25-32)
+channel_spec = [{'stream': 'pose', 'landmarks': list(range(0, 15)) + [23, 24], 'prefix': ''},  # face, shoulders, elbows; hips
+                {'stream': 'lh', 'landmarks': 'all', 'prefix': 'left_'},
+                {'stream': 'rh', 'landmarks': 'all', 'prefix': 'right_'}]
+# time-resolved RDM movie (in addition to the binned RDM): one crossnobis RDM per sliding window of frames, each window
+# cross-validated like the binned RDM (see crossnobis.py); saved to landmark_RDM_movie.hdf5
+rdm_movie = False
+movie_window = 25  # frames per window (at least 2, for the cross-validation); 25 frames = 0.5 s at 50 fps
+movie_stride = 5  # frames between the starts of consecutive windows; 1 gives one RDM per frame
+movie_n_workers = 1  # number of worker processes for the windows
 
 
 # directory with gesture landmark data:
@@ -35,148 +75,116 @@ input_dir = os.path.normpath(os.path.join(script_dir, relative_path))
 out_dir = script_dir
 fps = 50 # hard-coded fps of videos for timing vector
 
-# load landmark arrays
-pose_landmarks = np.load(os.path.join(input_dir, 'pose_landmarks.npy'))
-lh_landmarks = np.load(os.path.join(input_dir, 'lh_landmarks.npy'))
-rh_landmarks = np.load(os.path.join(input_dir, 'rh_landmarks.npy'))
-
-# reduce the pose landmark array:
-# what to use: everything from the left and right hand arrays;
-# what to use: everything from the pose array, EXCEPT the hands (15-22) and the legs/feet (25-32)
-pose_idx = np.arange(0,15) # face, shoulders, elbows
-pose_idx = np.append(pose_idx, [23, 24]) # hips
-pose_landmarks = pose_landmarks[:, :, pose_idx, :]
-# combine the 3 landmark ndarrays:
-landmarks = np.append(pose_landmarks, lh_landmarks, 2)
-landmarks = np.append(landmarks, rh_landmarks, 2)
-
-# transform 4-dimensional landmarks array (video/condition, frame/time, landmark/channel, coordinate/'sub-channel')
-# into 3-dimensional rsatoolbox-compatible array (conditions, channels, times)
-landmarks_3d = landmarks.reshape((landmarks.shape[0], landmarks.shape[1], landmarks.shape[2] * landmarks.shape[3])) # landmarks_3d is of shape (video, frame, coordinate)
-# the coordinates are ordered as: landmark1.x, landmark1.y, landmark1.z, landmark2.x, landmark2.y, ...
-landmarks_3d = np.transpose(landmarks_3d, (0, 2, 1)) # swap dimensions to achieve rsatoolbox-compatible (video, coordinate, frame)
-
-# create DESCRIPTORS for RDM data object
-# load landmark video labels
-cond_names = pd.read_csv(os.path.join(input_dir, 'landmark_inputs.csv'), header=None)
-cond_names = cond_names.T.squeeze().tolist()
-# make cond_idx ; very simple here: each video only has one datapoint (i.e. 'trial') and their order is the same as that of cond_names
-cond_idx = np.arange(1, len(cond_names) + 1)
-# make times vector of length = max. frame# in landmarks_3d; timing is hard-coded here at 50fps
-times = np.arange(0, landmarks_3d.shape[2]/fps, 1/fps)
-# make channel names
-raw_text_pose = """
-0 - nose
-1 - left eye (inner)
-2 - left eye
-3 - left eye (outer)
-4 - right eye (inner)
-5 - right eye
-6 - right eye (outer)
-7 - left ear
-8 - right ear
-9 - mouth (left)
-10 - mouth (right)
-11 - left shoulder
-12 - right shoulder
-13 - left elbow
-14 - right elbow
-15 - left wrist
-16 - right wrist
-17 - left pinky
-18 - right pinky
-19 - left index
-20 - right index
-21 - left thumb
-22 - right thumb
-23 - left hip
-24 - right hip
-25 - left knee
-26 - right knee
-27 - left ankle
-28 - right ankle
-29 - left heel
-30 - right heel
-31 - left foot index
-32 - right foot index
-"""
-
-raw_text_hand = """
-0 - wrist
-1 - thumb_cmc
-2 - thumb_mcp
-3 - thumb ip
-4 - thumb tip
-5 - index finger mcp
-6 - index finger pip
-7 - index finger dip
-8 - index finger tip
-9 - middle finger mcp
-10 - middle finger pip
-11 - middle finger dip
-12 - middle finger tip
-13 - ring finger mcp
-14 - ring finger pip
-15 - ring finger dip
-16 - ring finger tip
-17 - pinky mcp
-18 - pinky pip
-19 - pinky dip
-20 - pinky tip
-"""
-
-
-def listify_newline(raw_text):
-    # Split the text into lines and extract the relevant information
-    lines = raw_text.strip().split('\n')
-    lines = [line.split('-') for line in lines]
-    # Create the Python list including the first letter of each row
-    text_list = [item[1].strip() for item in lines]
-    # Substitute each space character with an underscore
-    text_list = [text.replace(' ', '_') for text in text_list]
-    return text_list
-
-
-pose_list = listify_newline(raw_text_pose)
-pose_list = [pose_list[i] for i in pose_idx] # remove hands from pose_list
-hand_list = listify_newline(raw_text_hand)
-lh_list = ['left_' + string for string in hand_list]
-rh_list = ['right_' + string for string in hand_list]
-channel_names = pose_list + lh_list + rh_list
-channel_names = [f'{item}_{suffix}' for item in channel_names for suffix in ['x', 'y', 'z']]  # repeat 3 times and
-# append coordinate markers
-
-measurements = landmarks_3d  # for ease of use, rename to 'measurements' to stay in line with rsatoolbox nomenclature
-
-np.save(os.path.join(out_dir, 'landmarks_by_word_and_frame.npy'), measurements)  # saving a copy of the data going into the RSA Dataset (to
-# use for PCA and anticluster in R later)
-
-### SETTING UP THE RSA TOOLBOX DATASET ###
-des = {'modality': 'mediapipe_landmarks'}
-obs_des = {'conds': cond_names}
-chn_des = {'channels': channel_names}
-tim_des = {'time': times}
-
-data = rsatoolbox.data.TemporalDataset(measurements,
-                                       descriptors=des,
-                                       obs_descriptors=obs_des,
-                                       channel_descriptors=chn_des,
-                                       time_descriptors=tim_des)
-data.sort_by('conds')
-
-
-## bin data across time - all observations *of each timepoint* get marked as separate observations (of the same conditions)
-# so I get one giant vector over conditions (that really are conditions x timepoints) and therefore reduce this to a 'non-temporal' datset
-data_binned = data.time_as_observations('time')
-# calculate RDM for *unbalanced* data (unfortunately not currently possible for RDM movie; NOTE: apparently possible with rsatoolbox v0.1.5), this deals with missing data by weighting!
-cv_desc = np.repeat(np.arange(0, len(cond_names)), len(times))  # make cross-validation descriptor (labeling each frame of the videos as their own session here)
-data_binned.obs_descriptors['cv_desc'] = cv_desc
-landmark_rdm_binned = rsatoolbox.rdm.calc_rdm_unbalanced(data_binned, method='crossnobis',
-                                   descriptor='conds', cv_descriptor='cv_desc')  # use CV (crossnobis distance) to avoid bias due to unbalanced dataset
-
-rsatoolbox.vis.show_rdm(landmark_rdm_binned,
-                        pattern_descriptor='conds')
-print(landmark_rdm_binned)
-# save landmark RDM to disk; once RDM is finalized, change to overwrite=False
-landmark_rdm_binned.save(os.path.join(out_dir, 'landmark_RDM_binned.hdf5'), file_type='hdf5', overwrite=True)  # save landmark RDM to disk
-
+def load_landmarks():
+    # open the landmark arrays (video, frame, landmark, coordinate) per stream, memory-mapped (nothing is loaded yet),
+    # and the video labels; returns streams, cond_names, fps, n_frames (frames per video in the measurements)
+    if landmark_source in ('store', 'compact'):
+        # landmark_store.py & landmark_codec.py live next to estimate_pose_hands.py
+        sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+        if landmark_source == 'store':
+            from landmark_store import LandmarkStore
+            store = LandmarkStore(os.path.join(input_dir, 'landmark_store'))
+        else:
+            from landmark_codec import decode_landmarks
+            store = decode_landmarks(os.path.join(input_dir, 'landmarks_compact.npz'))
+        if len(np.unique(store.fps)) > 1:
+            raise ValueError(f'videos in the landmark store differ in fps ({np.unique(store.fps)}), cannot build one timing vector')
+        streams = {stream: store.stream_videos(stream) for stream in ('pose', 'lh', 'rh')}
+        return streams, list(store.names), store.fps[0], store.aligned_length(frame_alignment)
+    elif landmark_source == 'npy':
+        streams = open_npy_landmarks(input_dir)
+        # load landmark video labels
+        cond_names = pd.read_csv(os.path.join(input_dir, 'landmark_inputs.csv'), header=None)
+        cond_names = cond_names.T.squeeze().tolist()
+        return streams, cond_names, fps, min(landmarks.shape[1] for landmarks in streams.values())
+    else:
+        raise ValueError(f"unknown landmark_source {landmark_source!r}, use 'npy', 'store' or 'compact'")
+
+
+def assemble_landmarks(pose_landmarks, lh_landmarks, rh_landmarks, out=None):
+    # select the channels of channel_spec and combine the 3 landmark arrays (video/condition, frame/time,
+    # landmark/channel, coordinate/'sub-channel') into the 3-dimensional rsatoolbox-compatible array
+    # (conditions, channels, times), in one pass into out (allocated if not given)
+    # the coordinates are ordered as: landmark1.x, landmark1.y, landmark1.z, landmark2.x, landmark2.y, ...
+    streams = {'pose': pose_landmarks, 'lh': lh_landmarks, 'rh': rh_landmarks}
+    return assemble_measurements(streams, channel_spec, out=out)
+
+
+def make_channel_names():
+    return spec_channel_names(channel_spec)
+
+
+def calc_landmark_rdm(measurements, cond_names, channel_names, times):
+    des = {'modality': 'mediapipe_landmarks'}
+    if rdm_engine == 'blockwise':
+        # same RDM as below (incl. the cross-validation folds), computed directly on the (conditions, channels, times) array
+        return calc_binned_crossnobis_rdm(measurements, cond_names, descriptors=des, dtype=rdm_dtype)
+    elif rdm_engine != 'rsatoolbox':
+        raise ValueError(f"unknown rdm_engine {rdm_engine!r}, use 'blockwise' or 'rsatoolbox'")
+
+    ### SETTING UP THE RSA TOOLBOX DATASET ###
+    obs_des = {'conds': cond_names}
+    chn_des = {'channels': channel_names}
+    tim_des = {'time': times}
+
+    data = rsatoolbox.data.TemporalDataset(measurements,
+                                           descriptors=des,
+                                           obs_descriptors=obs_des,
+                                           channel_descriptors=chn_des,
+                                           time_descriptors=tim_des)
+    data.sort_by('conds')
+
+
+    ## bin data across time - all observations *of each timepoint* get marked as separate observations (of the same conditions)
+    # so I get one giant vector over conditions (that really are conditions x timepoints) and therefore reduce this to a 'non-temporal' datset
+    data_binned = data.time_as_observations('time')
+    # calculate RDM for *unbalanced* data (unfortunately not currently possible for RDM movie; NOTE: apparently possible with rsatoolbox v0.1.5), this deals with missing data by weighting!
+    cv_desc = np.repeat(np.arange(0, len(cond_names)), len(times))  # make cross-validation descriptor (labeling each frame of the videos as their own session here)
+    data_binned.obs_descriptors['cv_desc'] = cv_desc
+    landmark_rdm_binned = rsatoolbox.rdm.calc_rdm_unbalanced(data_binned, method='crossnobis',
+                                       descriptor='conds', cv_descriptor='cv_desc')  # use CV (crossnobis distance) to avoid bias due to unbalanced dataset
+    return landmark_rdm_binned
+
+
+def calc_landmark_rdm_movie(measurements, cond_names, times):
+    # one RDM per window of movie_window frames (every movie_stride frames), stacked into one RDMs object with the
+    # rdm_descriptors 'time' (window centre), 'time_start' and 'time_end'
+    des = {'modality': 'mediapipe_landmarks'}
+    return calc_crossnobis_rdm_movie(measurements, cond_names, times, movie_window, movie_stride, descriptors=des,
+                                     n_workers=movie_n_workers)
+
+
+def main():
+    streams, cond_names, fps, n_frames = load_landmarks()
+    channel_names = make_channel_names()
+
+    # the measurements are written straight into landmarks_by_word_and_frame.npy (memory-mapped), which keeps a copy of
+    # the data going into the RSA Dataset (to use for PCA and anticluster in R later)
+    measurements = open_measurements(os.path.join(out_dir, 'landmarks_by_word_and_frame.npy'),
+                                     (len(cond_names), len(channel_names), n_frames))
+    assemble_measurements(streams, channel_spec, n_frames, out=measurements)  # (video, coordinate, frame); 'measurements'
+    # to stay in line with rsatoolbox nomenclature
+    measurements.flush()
+
+    # create DESCRIPTORS for RDM data object
+    # make cond_idx ; very simple here: each video only has one datapoint (i.e. 'trial') and their order is the same as that of cond_names
+    cond_idx = np.arange(1, len(cond_names) + 1)
+    # make times vector of length = max. frame# in measurements; timing is hard-coded here at 50fps (or taken from the landmark store)
+    times = np.arange(0, measurements.shape[2]/fps, 1/fps)
+
+    landmark_rdm_binned = calc_landmark_rdm(measurements, cond_names, channel_names, times)
+
+    rsatoolbox.vis.show_rdm(landmark_rdm_binned,
+                            pattern_descriptor='conds')
+    print(landmark_rdm_binned)
+    # save landmark RDM to disk; once RDM is finalized, change to overwrite=False
+    landmark_rdm_binned.save(os.path.join(out_dir, 'landmark_RDM_binned.hdf5'), file_type='hdf5', overwrite=True)  # save landmark RDM to disk
+
+    if rdm_movie:
+        landmark_rdm_movie = calc_landmark_rdm_movie(measurements, cond_names, times)
+        print(f'RDM movie: {landmark_rdm_movie.n_rdm} windows of {movie_window} frames')
+        landmark_rdm_movie.save(os.path.join(out_dir, 'landmark_RDM_movie.hdf5'), file_type='hdf5', overwrite=True)
+
+
+if __name__ == '__main__':
+    main()
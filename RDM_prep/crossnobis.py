@@ -0,0 +1,260 @@
+"""
+crossnobis.py
+fast crossnobis RDM for landmark data of shape (conditions, channels, times), as in create_landmark_RDM.py
+
+computes the same RDM as binning the data over time (TemporalDataset.time_as_observations) followed by
+rsatoolbox.rdm.calc_rdm_unbalanced(..., method='crossnobis', cv_descriptor=...) with the default settings
+(no noise precision matrix, weighting='number'), but without building the (conditions x times, channels)
+observation table and without looping over all pairs of observations:
+
+- rsatoolbox averages the dot products x_i . x_j over all pairs of observations of conditions a and b that are in
+  different cross-validation folds, each weighted by its number of valid (non-NaN) channels:
+      S_ab = sum_pairs (x_i . x_j) / sum_pairs (number of channels valid in both)
+  and returns d_ab = S_aa + S_bb - 2 * S_ab
+- with NaNs set to 0, the sum over all pairs in different folds is the sum over ALL pairs minus the pairs within the
+  same fold: sum_pairs (x_i . x_j) = T_a . T_b - sum_f G_af . G_bf, where T_a is the sum of all observations of
+  condition a and G_af the sum of its observations in fold f. the weights follow the same way from the NaN masks
+- so the whole RDM takes two matrix products of the (conditions, channels) sums and, per block of folds, one matrix
+  product of the (conditions, folds x channels) fold sums; blocks are sized to stay below block_bytes of memory
+- dtype selects the precision of the dot products (float32: half the memory and faster BLAS, at ~1e-6 relative
+  precision of the sums, which can matter for very small distances); the weights (counts of valid channels) are
+  always computed exactly in float64
+
+time-resolved RDM movies (crossnobis_movie, calc_crossnobis_rdm_movie): one such RDM per sliding window of frames
+(width, stride), each window cross-validated as create_landmark_RDM.py does for the whole video (binned_cv_folds of
+the window), i.e. a window covering all frames gives the binned RDM:
+
+- for each condition, these folds are contiguous runs of frames, so all totals and fold sums of a window are
+  differences of cumulative sums over time, which are computed once and shared by all (overlapping) windows;
+  the frames of a window are never summed up again
+- windows are processed in batches (batched matrix products), optionally spread across a pool of worker processes
+
+used by: create_landmark_RDM.py (rdm_engine = 'blockwise', rdm_movie = True)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import multiprocessing
+import numpy as np
+import rsatoolbox
+
+default_block_bytes = 256 * 2 ** 20  # memory for the fold sums of one block of folds
+
+
+def condensed_index(n):
+    # row and column of each entry of a condensed RDM (upper triangle, row by row, as in rsatoolbox)
+    return np.triu_indices(n, k=1)
+
+
+def binned_cv_folds(n_conds, n_times):
+    # the cross-validation folds that create_landmark_RDM.py assigns to the observations of the binned dataset:
+    # cv_desc = np.repeat(np.arange(n_conds), n_times) over the observations, which time_as_observations orders time
+    # by time (all conditions of time 0, then all of time 1, ...). returns the fold of each (condition, time)
+    cv_desc = np.repeat(np.arange(n_conds), n_times)
+    return cv_desc.reshape(n_times, n_conds).T
+
+
+def crossnobis_sums(measurements, folds, dtype=np.float64, block_bytes=default_block_bytes):
+    # cross-fold sums of dot products (values) and of valid channel counts (weights) for all pairs of conditions
+    # measurements: (conditions, channels, times), NaN for missing values; folds: (conditions, times) fold labels
+    # returns values, weights: (conditions, conditions)
+    n_conds, n_channels, n_times = measurements.shape
+    folds = np.asarray(folds)
+    if folds.shape != (n_conds, n_times):
+        raise ValueError(f'folds has shape {folds.shape}, expected (conditions, times) = {(n_conds, n_times)}')
+    _, fold_idx = np.unique(folds, return_inverse=True)
+    fold_idx = fold_idx.reshape(n_conds, n_times)
+    n_folds = fold_idx.max() + 1 if fold_idx.size else 0
+
+    # one row per observation (condition, time): NaN-free values and validity masks
+    observations = np.ascontiguousarray(np.transpose(measurements, (0, 2, 1)), dtype=dtype).reshape(-1, n_channels)
+    valid = ~np.isnan(observations)
+    observations[~valid] = 0
+    valid = valid.astype(np.float64)
+
+    # all pairs of observations
+    totals = observations.reshape(n_conds, n_times, n_channels).sum(axis=1)
+    valid_totals = valid.reshape(n_conds, n_times, n_channels).sum(axis=1)
+    values = (totals @ totals.T).astype(np.float64)
+    weights = valid_totals @ valid_totals.T
+
+    # minus the pairs within the same fold, for blocks of folds: sort the observations by (fold, condition), so that
+    # the fold sums of each block are sums over contiguous runs of observations
+    keys = (fold_idx * n_conds + np.arange(n_conds)[:, np.newaxis]).ravel()
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    bytes_per_fold = n_conds * n_channels * (np.dtype(dtype).itemsize + 8)
+    folds_per_block = max(1, int(block_bytes // bytes_per_fold))
+    for first in range(0, n_folds, folds_per_block):
+        last = min(first + folds_per_block, n_folds)
+        start, stop = np.searchsorted(keys, [first * n_conds, last * n_conds])
+        if start == stop:
+            continue
+        block_keys, starts = np.unique(keys[start:stop], return_index=True)
+        block_order = order[start:stop]
+        fold_sums = np.zeros(((last - first) * n_conds, n_channels), dtype=dtype)
+        valid_sums = np.zeros(((last - first) * n_conds, n_channels))
+        fold_sums[block_keys - first * n_conds] = np.add.reduceat(observations[block_order], starts, axis=0)
+        valid_sums[block_keys - first * n_conds] = np.add.reduceat(valid[block_order], starts, axis=0)
+        # (fold, condition, channel) -> (condition, fold x channel), so that one matrix product sums over the folds
+        fold_sums = fold_sums.reshape(last - first, n_conds, n_channels).transpose(1, 0, 2).reshape(n_conds, -1)
+        valid_sums = valid_sums.reshape(last - first, n_conds, n_channels).transpose(1, 0, 2).reshape(n_conds, -1)
+        values -= fold_sums @ fold_sums.T
+        weights -= valid_sums @ valid_sums.T
+    return values, weights
+
+
+def crossnobis_rdm(measurements, folds, dtype=np.float64, block_bytes=default_block_bytes):
+    # crossnobis RDM of the conditions (in the given order), as condensed vector (NaN where no pairs are available)
+    values, weights = crossnobis_sums(measurements, folds, dtype, block_bytes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarities = np.where(weights > 0, values / weights, np.nan)
+    rows, cols = condensed_index(len(similarities))
+    self_similarities = np.diag(similarities)
+    return self_similarities[rows] + self_similarities[cols] - 2 * similarities[rows, cols]
+
+
+def calc_binned_crossnobis_rdm(measurements, cond_names, folds=None, descriptors=None, dtype=np.float64,
+                               block_bytes=default_block_bytes):
+    # drop-in for time_as_observations + calc_rdm_unbalanced(method='crossnobis') as used in create_landmark_RDM.py,
+    # returning the same rsatoolbox RDMs object (conditions sorted by name)
+    # folds: (conditions, times) cross-validation folds, given for the conditions sorted by name;
+    # default: those of create_landmark_RDM.py (see binned_cv_folds)
+    order = np.argsort(cond_names, kind='stable')
+    measurements = measurements[order]
+    cond_names = np.asarray(cond_names)[order]
+    n_conds, _, n_times = measurements.shape
+    if folds is None:
+        folds = binned_cv_folds(n_conds, n_times)
+    unique_names = np.unique(cond_names)
+    if len(unique_names) != n_conds:
+        raise ValueError('condition names have to be unique (one row of measurements per condition)')
+    dissimilarities = crossnobis_rdm(measurements, folds, dtype, block_bytes)
+    rdms = rsatoolbox.rdm.RDMs(dissimilarities=dissimilarities[np.newaxis],
+                               dissimilarity_measure='crossnobis',
+                               rdm_descriptors=dict(descriptors or {}),
+                               pattern_descriptors={'conds': unique_names})
+    # rsatoolbox stores the integer cross-validation label of each binned observation (ordered time by time)
+    _, cv_desc_int = np.unique(np.asarray(folds).T.ravel(), return_inverse=True)
+    rdms.descriptors['cv_descriptor'] = cv_desc_int
+    return rdms
+
+
+def window_fold_bounds(n_conds, width):
+    # binned_cv_folds(n_conds, width) assigns the frames of each condition to its folds in contiguous, ordered runs:
+    # fold f of condition c covers the window frames bounds[c, f] to bounds[c, f + 1]; returns bounds (conditions, folds + 1)
+    folds = binned_cv_folds(n_conds, width)
+    return np.stack([np.searchsorted(row, np.arange(n_conds + 1)) for row in folds])
+
+
+def _cumulative_sums(measurements):
+    # cumulative sums over time of the NaN-free values and of the validity masks, starting with 0:
+    # (conditions, times + 1, columns), so that frames s..e-1 sum to sums[:, e] - sums[:, s]
+    # channels with identical NaN patterns (e.g. all coordinates of one landmark model, which is missing as a whole)
+    # share one validity column; valid_counts holds the number of channels per column
+    observations = np.transpose(measurements, (0, 2, 1))
+    valid = ~np.isnan(observations)
+    valid_columns, valid_counts = np.unique(valid.reshape(-1, valid.shape[2]), axis=1, return_counts=True)
+    sums = []
+    for values in (np.where(valid, observations, 0), valid_columns.reshape(*valid.shape[:2], -1)):
+        cumulative = np.zeros((values.shape[0], values.shape[1] + 1, values.shape[2]))
+        np.cumsum(values, axis=1, out=cumulative[:, 1:])
+        sums.append(cumulative)
+    return sums[0], sums[1], valid_counts.astype(np.float64)
+
+
+def _window_rdms(cumulative_values, cumulative_valid, valid_counts, bounds, starts):
+    # condensed crossnobis RDMs (window, pairs) of the windows starting at the frames starts
+    n_conds = bounds.shape[0]
+    # cumulative sums at the fold boundaries of each window: (window, condition, folds + 1, columns)
+    idx = starts[:, np.newaxis, np.newaxis] + bounds[np.newaxis]
+    conds = np.arange(n_conds)[np.newaxis, :, np.newaxis]
+    results = []
+    for cumulative, counts in ((cumulative_values, None), (cumulative_valid, valid_counts)):
+        fold_sums = np.diff(cumulative[conds, idx], axis=2)
+        totals = fold_sums.sum(axis=2)
+        # each validity column stands for counts channels
+        weighted_sums, weighted_totals = (fold_sums, totals) if counts is None else (fold_sums * counts, totals * counts)
+        # all pairs of observations minus the pairs within the same fold, for all windows at once
+        within = weighted_sums.reshape(len(starts), n_conds, -1) @ fold_sums.reshape(len(starts), n_conds, -1).transpose(0, 2, 1)
+        results.append(weighted_totals @ totals.transpose(0, 2, 1) - within)
+    values, weights = results
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarities = np.where(weights > 0, values / weights, np.nan)
+    rows, cols = condensed_index(n_conds)
+    self_similarities = np.diagonal(similarities, axis1=1, axis2=2)
+    return self_similarities[:, rows] + self_similarities[:, cols] - 2 * similarities[:, rows, cols]
+
+
+# state of the worker processes of crossnobis_movie (set by _init_movie_worker)
+_movie_state = None
+
+
+def _init_movie_worker(cumulative_values, cumulative_valid, valid_counts, bounds):
+    global _movie_state
+    _movie_state = (cumulative_values, cumulative_valid, valid_counts, bounds)
+
+
+def _movie_batch(starts):
+    return _window_rdms(*_movie_state, starts)
+
+
+def window_starts(n_times, width, stride=1):
+    # first frame of each sliding window (only complete windows)
+    if width < 2:
+        raise ValueError(f'window width has to be at least 2 frames for the cross-validation, got {width}')
+    if stride < 1:
+        raise ValueError(f'stride has to be at least 1 frame, got {stride}')
+    return np.arange(0, n_times - width + 1, stride)
+
+
+def crossnobis_movie(measurements, width, stride=1, n_workers=1, block_bytes=default_block_bytes):
+    # crossnobis RDMs of the conditions (in the given order) in sliding windows of width frames, stride frames apart
+    # measurements: (conditions, channels, times), NaN for missing values
+    # returns starts (window,) and the condensed RDMs (window, pairs), NaN where no pairs are available
+    n_conds, n_channels, n_times = measurements.shape
+    starts = window_starts(n_times, width, stride)
+    bounds = window_fold_bounds(n_conds, width)
+    cumulative_values, cumulative_valid, valid_counts = _cumulative_sums(measurements)
+    # batches of windows, sized to keep the gathered fold sums below block_bytes
+    bytes_per_window = 2 * n_conds * (n_conds + 1) * (n_channels + len(valid_counts)) * 8
+    windows_per_batch = max(1, int(block_bytes // bytes_per_window))
+    if n_workers > 1:
+        # several batches per worker, so that the work is spread evenly
+        windows_per_batch = max(1, min(windows_per_batch, -(-len(starts) // (4 * n_workers))))
+    batches = [starts[i:i + windows_per_batch] for i in range(0, len(starts), windows_per_batch)]
+    workers = min(n_workers, len(batches))
+    if workers > 1:
+        # each worker gets the cumulative sums once (initializer), then only the window starts of its batches
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=_init_movie_worker,
+                                                       initargs=(cumulative_values, cumulative_valid, valid_counts,
+                                                                 bounds)) as pool:
+            rdms = pool.map(_movie_batch, batches)
+    else:
+        rdms = [_window_rdms(cumulative_values, cumulative_valid, valid_counts, bounds, batch) for batch in batches]
+    rdms = np.concatenate(rdms) if rdms else np.empty((0, n_conds * (n_conds - 1) // 2))
+    return starts, rdms
+
+
+def calc_crossnobis_rdm_movie(measurements, cond_names, times, width, stride=1, descriptors=None, n_workers=1,
+                              block_bytes=default_block_bytes):
+    # RDM movie as rsatoolbox RDMs object: one crossnobis RDM per window (conditions sorted by name), with the
+    # rdm_descriptors 'time' (mean time of the window's frames, as rsatoolbox's bin_time), 'time_start', 'time_end'
+    order = np.argsort(cond_names, kind='stable')
+    measurements = measurements[order]
+    unique_names = np.unique(np.asarray(cond_names)[order])
+    if len(unique_names) != measurements.shape[0]:
+        raise ValueError('condition names have to be unique (one row of measurements per condition)')
+    times = np.asarray(times)[:measurements.shape[2]]
+    starts, dissimilarities = crossnobis_movie(measurements, width, stride, n_workers, block_bytes)
+    window_times = times[starts[:, np.newaxis] + np.arange(width)]
+    # as in calc_binned_crossnobis_rdm, the descriptors are repeated for each RDM
+    rdm_descriptors = {key: [value] * len(starts) for key, value in (descriptors or {}).items()}
+    rdm_descriptors.update({'time': window_times.mean(axis=1),
+                            'time_start': window_times[:, 0],
+                            'time_end': window_times[:, -1]})
+    return rsatoolbox.rdm.RDMs(dissimilarities=dissimilarities,
+                               dissimilarity_measure='crossnobis',
+                               descriptors={'window_width': width, 'window_stride': stride},
+                               rdm_descriptors=rdm_descriptors,
+                               pattern_descriptors={'conds': unique_names})
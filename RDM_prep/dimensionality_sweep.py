@@ -0,0 +1,104 @@
+"""
+dimensionality_sweep.py
+cosine RDMs of fastText word vectors for many reduced dimensionalities, from ONE decomposition of the model
+
+- fasttext.util.reduce_model projects the model's input matrix onto the first eigenvectors of its covariance (PCA over
+  its first 100000 rows); a word vector (the mean of input-matrix rows of the word and its subwords) is projected the
+  same way, so the word vector of the model reduced to k dimensions = full word vector @ eigenvectors[:, :k]
+- so instead of reloading and reducing the model for every dimensionality:
+    - the input matrix is memory-mapped straight from the model's .bin file (input_matrix; the model is not loaded)
+    - its covariance is accumulated over chunks of rows (streamed_covariance; memory bounded by chunk_rows, and all
+      rows of the ~4M x 300 matrix can be used, not only the first 100000)
+    - one eigendecomposition gives the axes of all dimensionalities (principal_axes): in the order of
+      np.linalg.eig as in reduce_model (order = 'fasttext', mostly but not strictly by decreasing variance) or
+      strictly by decreasing variance (order = 'variance')
+    - the cosine RDMs of all dimensionalities follow from cumulative sums over the components of the projected word
+      vectors (one batched pass, sweep_rdms); compare them to the 300-D RDM with rdm_comparison.compare_vectors
+
+used by: get_fasttext_vectors.py (compare_dimensionalities = True)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import struct
+import numpy as np
+
+fasttext_magic = 793712314
+default_chunk_rows = 65536  # rows of the input matrix per chunk (65536 x 300 float64: ~160 MB)
+fasttext_mapping_rows = 100000  # rows used by fasttext.util.reduce_model for the PCA
+orders = ('fasttext', 'variance')
+
+
+def _skip_dictionary(file, n_entries, block_size=1 << 24):
+    # skip the n_entries word entries (word, '\0', int64 count, int8 type) of a fastText dictionary; returns the number
+    # of bytes read beyond the dictionary (left in the buffer)
+    buffer, pos = b'', 0
+    for _ in range(n_entries):
+        end = buffer.find(b'\0', pos)
+        while end < 0 or end + 10 > len(buffer):
+            block = file.read(block_size)
+            if not block:
+                raise ValueError('unexpected end of the fastText model file')
+            buffer, pos = buffer[pos:] + block, 0
+            end = buffer.find(b'\0', pos)
+        pos = end + 10
+    return len(buffer) - pos
+
+
+def input_matrix(model_path):
+    # the input matrix (words & subword buckets, dimensions) of a fastText .bin model, memory-mapped as float32
+    # (fastText's binary format: magic & version, 12 int32 args + double, dictionary, quantization flag, matrix)
+    with open(model_path, 'rb') as file:
+        magic, _ = struct.unpack('<ii', file.read(8))
+        if magic != fasttext_magic:
+            raise ValueError(f'{model_path} is no fastText .bin model')
+        file.read(12 * 4 + 8)  # args
+        n_entries, _, _, _, prune_size = struct.unpack('<iiiqq', file.read(4 * 3 + 8 * 2))
+        left_over = _skip_dictionary(file, n_entries)
+        file.seek(file.tell() - left_over + max(prune_size, 0) * 8)
+        if struct.unpack('<?', file.read(1))[0]:
+            raise ValueError(f'{model_path} is quantized (.ftz), use the full .bin model')
+        n_rows, n_dims = struct.unpack('<qq', file.read(16))
+        offset = file.tell()
+    return np.memmap(model_path, dtype='<f4', mode='r', offset=offset, shape=(n_rows, n_dims))
+
+
+def streamed_covariance(matrix, n_rows=fasttext_mapping_rows, chunk_rows=default_chunk_rows):
+    # covariance of the first n_rows rows (None: all) of matrix, accumulated over chunks of chunk_rows rows in float64
+    n_rows = len(matrix) if n_rows is None else min(n_rows, len(matrix))
+    total = np.zeros(matrix.shape[1])
+    products = np.zeros((matrix.shape[1], matrix.shape[1]))
+    for start in range(0, n_rows, chunk_rows):
+        chunk = np.asarray(matrix[start:min(start + chunk_rows, n_rows)], dtype=np.float64)
+        total += chunk.sum(axis=0)
+        products += chunk.T @ chunk
+    mean = total / n_rows
+    return (products - n_rows * np.outer(mean, mean)) / (n_rows - 1)
+
+
+def principal_axes(covariance, order='fasttext'):
+    # eigenvectors of covariance as columns: in np.linalg.eig's order (as fasttext.util.reduce_model) or sorted by
+    # decreasing eigenvalue
+    if order == 'fasttext':
+        _, axes = np.linalg.eig(covariance.astype(np.float32))
+        return np.real(axes).astype(np.float32)
+    elif order == 'variance':
+        values, axes = np.linalg.eigh(covariance)
+        return axes[:, np.argsort(values)[::-1]].astype(np.float32)
+    raise ValueError(f'unknown order {order!r}, use one of {orders}')
+
+
+def reduced_vectors(vectors, axes, dim):
+    # word vectors as given by the model reduced to dim dimensions
+    return np.asarray(vectors, dtype=np.float32) @ axes[:, :dim]
+
+
+def sweep_rdms(vectors, axes, dims):
+    # condensed cosine RDMs (dims, word pairs) of the word vectors reduced to each of dims, in one batched pass:
+    # the dot products of the first k components are cumulative sums over the components of the projected vectors
+    projected = reduced_vectors(vectors, axes, max(dims)).astype(np.float64)
+    rows, cols = np.triu_indices(len(projected), k=1)
+    # (component, pair) products and (component, word) squared norms, summed up to each dimensionality
+    dots = np.cumsum((projected[rows] * projected[cols]).T, axis=0)[np.asarray(dims) - 1]
+    norms = np.sqrt(np.cumsum((projected ** 2).T, axis=0)[np.asarray(dims) - 1])
+    return 1 - dots / (norms[:, rows] * norms[:, cols])
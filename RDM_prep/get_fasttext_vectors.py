@@ -10,6 +10,20 @@
 # 3) reduces fasttext model to 5 dimensions
 # 4) repeats steps 1 & 2 using reduced model, additionally saves resulting vectors as csv for use in R
 #
+# the reduced dimensionalities (steps 3 & 4, compare_dimensionalities) all come from ONE decomposition of the model's
+# input matrix, streamed in chunks from the memory-mapped model file, instead of reloading & reducing the model for each
+# dimensionality (see dimensionality_sweep.py); the cosine RDMs & comparisons of all dimensionalities are one batched pass
+#
+# the cosine dissimilarity step is also available as a function (cosine_dissimilarities), e.g. for the benchmarks
+# in ../benchmarks; fasttext is only imported when a model is actually loaded
+#
+# for lexicon-scale sets of words (e.g. tens of thousands of candidate words for stimulus selection, lexicon_path), the
+# vectors go straight into a memory-mapped float32 matrix and their RDM is computed blockwise into a condensed,
+# memory-mapped vector, together with the top-k nearest & farthest words of each word (see cosine_rdm.py)
+#
+# word vectors are served from a persistent cache (word_vector_cache/, see word_vector_cache.py; use_vector_cache),
+# keyed by word, model file and dimensionality: the model is only loaded for words that were never looked up before
+#
 # current version: 20240118
 # written by: Jonathan Wehnert
 
@@ -18,106 +32,164 @@
 # where fasttext is installed
 """
 
-import fasttext.util
-import rsatoolbox.rdm
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import pandas as pd
-from rsatoolbox import rdm
 import matplotlib.pyplot as plt
 import os
 
+from rdm_comparison import condensed_vector, compare_vectors
+from word_vector_cache import WordVectorCache, load_fasttext_model
+from dimensionality_sweep import input_matrix, streamed_covariance, principal_axes, reduced_vectors, sweep_rdms
+from cosine_rdm import condensed_cosine_rdm, open_condensed, top_k
+
 ### SETTINGS
 compare_dimensionalities = False
-
-
-def extract_ft_vectors(ft_model, words):
-    # create empty list to store the fastText word vectors
-    ft_vectors = []
-    # extract word vector for each entry in 'word' series
-    for i in word:
-        tmp_vector = ft_model.get_word_vector(i)
-        ft_vectors.append(tmp_vector)
-    ft_vectors = pd.DataFrame(ft_vectors)
-    return ft_vectors
-
+use_vector_cache = True  # False: always load the model and look up all words in it
+model_filename = 'cc.de.300.bin'  # downloaded to the current working directory
+# dimensionality sweep (see dimensionality_sweep.py): dimensionalities to compare with the full 300-D RDM
+sweep_dims = np.arange(5, 301, 5)
+sweep_rows = 100000  # rows of the model's input matrix for the PCA (100000 as fasttext.util.reduce_model; None: all)
+sweep_chunk_rows = 65536  # rows per chunk when streaming the input matrix (bounds the memory use)
+sweep_order = 'fasttext'  # order of the components: 'fasttext' (as reduce_model) or 'variance' (decreasing variance)
+# lexicon-scale RDM (see cosine_rdm.py): text file with one word per line, relative to this script; None: skip
+lexicon_path = None
+lexicon_top_k = 10  # number of nearest & farthest words listed per word
+lexicon_block_rows = 1024  # rows per block (memory per block: lexicon_block_rows x number of words x 4 bytes)
+lexicon_n_threads = 1  # threads computing blocks in parallel
 
 # get location of this script:
 script_path = os.path.abspath(__file__)
 script_dir = os.path.abspath(os.path.dirname(script_path))
 out_dir = script_dir
-
-# load list of words
 stimlist_relative = '../sample_stimuli/FL_BILINGUAL_stimuli_alphabeticalID.csv'
 stimlist_path = os.path.normpath(os.path.join(script_dir, stimlist_relative))
-df = pd.read_csv(stimlist_path)
-# create pandas Series of the words and stimulus_ids
-stimulus_id = df['stimulus_id']
-word = df['german_umlaut']
-# concatenate necessary information into one df
-word_vector_descriptors = pd.DataFrame({'stimulus_id': stimulus_id, 'word': word})
-word_vector_descriptors.to_csv(os.path.join(out_dir, 'ft_word_vector_descriptors.csv'), index=False)
-
-# first, obtain fasttext vectors and cosine dissimilarity for full model (300 dimensions)
-# download German ('de') model to project folder and load as ft
-fasttext.util.download_model('de', if_exists='ignore')  # German
-ft = fasttext.load_model('cc.de.300.bin')
-
-# extract vectors for our words, full model
-ft_vectors_300 = extract_ft_vectors(ft, word)
-ft_vectors_300.to_csv(os.path.join(out_dir, 'ft_word_vectors_300.csv'), index=False)  # save as csv for use in R
-# transform into ndarray
-ft_vectors_300 = ft_vectors_300.to_numpy()
-
-
-# Calculate & save pairwise cosine dissimilarity
-ft_300_cosine_dissimilarities = 1 - cosine_similarity(ft_vectors_300)
-print(ft_300_cosine_dissimilarities)
-np.save(os.path.join(out_dir, 'ft_300_cosine_dissimilarities.npy'), ft_300_cosine_dissimilarities)
-print(ft.get_dimension())
-
-
-### EVERYTHING BELOW - NOT - NEEDED, when all you want to do is create the RDM from the fasttext vectors
-### compare correlation between full 300-dimensional-based dissimilarities and those based on fewer dimensions
-# ONLY IF compare_dimensionalities is set to True (manually at beginning of script!)
-if compare_dimensionalities:
-    dims = np.arange(5, 101, 5)  # compare in steps of 5 (going above 100 dimensions leads to memory overload)
-
-
-    def compare_dimensionalities(dims, ft_300_dis, word):
-        r_corr = []
-        r_rhoa = []
-        ft_300_dis = ft_300_dis[np.newaxis, :, :]  # rsatoolbox.rdm.RDMs requires nparray of dissimilarities in shape (n_rdm x n_cond x n_con)
-        ft_300_rdm = rsatoolbox.rdm.RDMs(ft_300_dis)
-
-        for i, dim in enumerate(dims):
-            # reload ft model (as it became reduced in previous iteration)
-            ft = fasttext.load_model('cc.de.300.bin')
-            print(ft.get_dimension())
-            # reduce model dimensions
-            fasttext.util.reduce_model(ft, dim)
-            print(ft.get_dimension())
-            # extract vectors for our words
-            ft_vectors = extract_ft_vectors(ft, word)
-            # transform into ndarray
-            ft_vectors = ft_vectors.to_numpy()
-            # Calculate pairwise cosine dissimilarity
-            ft_cosine_dissimilarities = 1 - cosine_similarity(ft_vectors)
-            ft_cosine_dissimilarities = ft_cosine_dissimilarities[np.newaxis, :, :]  # rsatoolbox.rdm.RDMs requires nparray of dissimilarities in shape (n_rdm x n_cond x n_con)
-            ft_cosine_RDM = rsatoolbox.rdm.RDMs(ft_cosine_dissimilarities)
-
-            # compare to full 300-dimensional-based dissimilarities
-            r_corr.append(rdm.compare(ft_300_rdm, ft_cosine_RDM, method='corr')[0][0])
-            print(
-                f'similarity (corr) between 300-D & {dims[i]}-D based RDMs for fasttext vectors: {r_corr[i]}')
-            r_rhoa.append(rdm.compare(ft_300_rdm, ft_cosine_RDM, method='rho-a')[0][0])
-            print(
-                f'similarity (rho-a) between 300-D & {dims[i]}-D based RDMs for fasttext vectors: {r_rhoa[i]}')
-
-        return r_corr, r_rhoa
-
-
-    r_corr, r_rhoa = compare_dimensionalities(dims, ft_300_cosine_dissimilarities, word)
+vector_cache_dir = os.path.join(script_dir, 'word_vector_cache')
+
+
+def extract_ft_matrix(ft_model, words, out=None):
+    # fastText word vectors (words x dimensions), written row by row into out (a preallocated float32 matrix,
+    # allocated if not given)
+    words = list(words)
+    if out is None:
+        out = np.empty((len(words), ft_model.get_dimension()), dtype=np.float32)
+    for row, word in enumerate(words):
+        out[row] = ft_model.get_word_vector(word)
+    return out
+
+
+def extract_ft_vectors(ft_model, words):
+    # fastText word vectors as DataFrame (one row per word)
+    return pd.DataFrame(extract_ft_matrix(ft_model, words))
+
+
+def get_ft_matrix(words, dim=300, out=None):
+    # fastText vectors of words (float32, words x dimensions, written into out if given) from the model reduced to dim
+    # dimensions (300: full model), via the word vector cache (the model is only loaded if a word is not cached yet)
+    if use_vector_cache:
+        return WordVectorCache(vector_cache_dir, model_filename, dim).get_vectors(words, out)
+    return extract_ft_matrix(load_fasttext_model(model_filename, dim), words, out)
+
+
+def get_ft_vectors(words, dim=300):
+    # as get_ft_matrix, as DataFrame (one row per word)
+    return pd.DataFrame(get_ft_matrix(words, dim))
+
+
+def cosine_dissimilarities(vectors):
+    # pairwise cosine dissimilarity between the rows of vectors (words x dimensions)
+    return 1 - cosine_similarity(vectors)
+
+
+def lexicon_rdm(words):
+    # vectors, condensed cosine RDM (both memory-mapped .npy) and top-k nearest & farthest words of a large set of words
+    words = list(dict.fromkeys(words))
+    pd.DataFrame({'word': words}).to_csv(os.path.join(out_dir, 'ft_lexicon_words.csv'), index=False)
+    vectors = np.lib.format.open_memmap(os.path.join(out_dir, 'ft_lexicon_vectors_300.npy'), mode='w+',
+                                        dtype=np.float32, shape=(len(words), 300))
+    get_ft_matrix(words, 300, out=vectors)
+    condensed = open_condensed(os.path.join(out_dir, 'ft_lexicon_300_cosine_condensed.npy'), len(words))
+    condensed_cosine_rdm(vectors, condensed, lexicon_block_rows, lexicon_n_threads)
+    condensed.flush()
+
+    neighbours = []
+    for label, nearest in (('nearest', True), ('farthest', False)):
+        indices, dissimilarities = top_k(vectors, lexicon_top_k, nearest, lexicon_block_rows, lexicon_n_threads)
+        neighbours.append(pd.DataFrame({'word': np.repeat(words, indices.shape[1]),
+                                        'rank': np.tile(np.arange(1, indices.shape[1] + 1), len(words)),
+                                        'kind': label,
+                                        'neighbour': np.array(words, dtype=object)[indices.ravel()],
+                                        'dissimilarity': dissimilarities.ravel()}))
+    pd.concat(neighbours).to_csv(os.path.join(out_dir, f'ft_lexicon_top_{lexicon_top_k}.csv'), index=False)
+    print(f'lexicon RDM of {len(words)} words saved (condensed, {condensed.nbytes / 1e6:.1f} MB)')
+
+
+def reduction_axes():
+    # projection of the full word vectors onto the reduced dimensionalities (columns: components), from one PCA of
+    # the model's input matrix, streamed from the model file (the model itself is not loaded)
+    covariance = streamed_covariance(input_matrix(model_filename), sweep_rows, sweep_chunk_rows)
+    return principal_axes(covariance, sweep_order)
+
+
+def compare_reduced_dimensionalities(dims, ft_300_dis, ft_vectors_300, axes):
+    # cosine RDMs of the word vectors reduced to each of dims (all from the same decomposition, axes), in one pass
+    reduced_rdms = sweep_rdms(ft_vectors_300, axes, dims)
+
+    # compare all reduced-dimensionality RDMs to the full 300-dimensional-based dissimilarities at once
+    # (same values as rdm.compare, see rdm_comparison.py)
+    r_corr = compare_vectors(condensed_vector(ft_300_dis), reduced_rdms, method='corr')
+    r_rhoa = compare_vectors(condensed_vector(ft_300_dis), reduced_rdms, method='rho-a')
+    for i, dim in enumerate(dims):
+        print(f'similarity (corr) between 300-D & {dim}-D based RDMs for fasttext vectors: {r_corr[i]}')
+        print(f'similarity (rho-a) between 300-D & {dim}-D based RDMs for fasttext vectors: {r_rhoa[i]}')
+
+    return r_corr, r_rhoa
+
+
+def main():
+    import fasttext.util
+
+    # load list of words
+    df = pd.read_csv(stimlist_path)
+    # create pandas Series of the words and stimulus_ids
+    stimulus_id = df['stimulus_id']
+    word = df['german_umlaut']
+    # concatenate necessary information into one df
+    word_vector_descriptors = pd.DataFrame({'stimulus_id': stimulus_id, 'word': word})
+    word_vector_descriptors.to_csv(os.path.join(out_dir, 'ft_word_vector_descriptors.csv'), index=False)
+
+    # first, obtain fasttext vectors and cosine dissimilarity for full model (300 dimensions)
+    # download German ('de') model to project folder (if not there yet); it is only loaded for words not cached yet
+    fasttext.util.download_model('de', if_exists='ignore')  # German
+
+    # extract vectors for our words, full model
+    ft_vectors_300 = get_ft_vectors(word, 300)
+    ft_vectors_300.to_csv(os.path.join(out_dir, 'ft_word_vectors_300.csv'), index=False)  # save as csv for use in R
+    # transform into ndarray
+    ft_vectors_300 = ft_vectors_300.to_numpy()
+
+
+    # Calculate & save pairwise cosine dissimilarity
+    ft_300_cosine_dissimilarities = cosine_dissimilarities(ft_vectors_300)
+    print(ft_300_cosine_dissimilarities)
+    np.save(os.path.join(out_dir, 'ft_300_cosine_dissimilarities.npy'), ft_300_cosine_dissimilarities)
+    print(ft_vectors_300.shape[1])
+
+    # lexicon-scale RDM (only if lexicon_path is set)
+    if lexicon_path is not None:
+        with open(os.path.join(script_dir, lexicon_path), encoding='utf-8') as file:
+            lexicon_rdm([line.strip() for line in file if line.strip()])
+
+
+    ### EVERYTHING BELOW - NOT - NEEDED, when all you want to do is create the RDM from the fasttext vectors
+    ### compare correlation between full 300-dimensional-based dissimilarities and those based on fewer dimensions
+    # ONLY IF compare_dimensionalities is set to True (manually at beginning of script!)
+    if not compare_dimensionalities:
+        return
+    dims = sweep_dims  # in steps of 5, up to the full 300 dimensions (one decomposition for all of them)
+    axes = reduction_axes()
+
+    r_corr, r_rhoa = compare_reduced_dimensionalities(dims, ft_300_cosine_dissimilarities, ft_vectors_300, axes)
 
     # plot r_corr and r_rhoa over dims
     plt.figure()
@@ -128,7 +200,7 @@ if compare_dimensionalities:
     plt.xlabel('fastText dimensionality')
     plt.ylabel('correlation')
     legend = plt.legend()
-    plt.xticks(dims[1::2])
+    plt.xticks(dims[3::4])
     legend.set_title('comparison method:')
 
     plt.savefig(os.path.join(out_dir, 'ft_300-ft_xxx_correlation.png'))
@@ -138,17 +210,18 @@ if compare_dimensionalities:
     # reduce model dimensions to a specific, hardcoded level (target_dim), for later use with anticluster in R
     target_dim = [10, 35]
     for dims in target_dim:
-        ft = fasttext.load_model('cc.de.300.bin')
-        fasttext.util.reduce_model(ft, dims)
-        print(ft.get_dimension())
-
-        # extract vectors for our words
-        ft_vectors_005 = extract_ft_vectors(ft, word)
+        # extract vectors for our words (projected onto the first dims components of the decomposition above)
+        ft_vectors_005 = pd.DataFrame(reduced_vectors(ft_vectors_300, axes, dims))
+        print(ft_vectors_005.shape[1])
         ft_vectors_005.to_csv(os.path.join(out_dir, f'ft_word_vectors_{dims:03}.csv'), index=False)  # save as csv for use in R
 
         # transform into ndarray
         ft_vectors_005 = ft_vectors_005.to_numpy()
         # Calculate & save pairwise cosine dissimilarity
-        ft_005_cosine_dissimilarities = 1 - cosine_similarity(ft_vectors_005)
+        ft_005_cosine_dissimilarities = cosine_dissimilarities(ft_vectors_005)
         print(ft_005_cosine_dissimilarities)
         np.save(os.path.join(out_dir, f'ft_{dims:03}_cosine_dissimilarities.npy'), ft_005_cosine_dissimilarities)
+
+
+if __name__ == '__main__':
+    main()
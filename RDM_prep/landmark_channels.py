@@ -0,0 +1,181 @@
+"""
+landmark_channels.py
+declarative channel selection and one-pass assembly of the landmark measurements for create_landmark_RDM.py
+
+- a channel spec is a list of entries {'stream': ..., 'landmarks': ..., 'prefix': ...}, one per landmark model:
+    - stream:    'pose', 'lh' or 'rh' (the landmark arrays written by estimate_pose_hands.py)
+    - landmarks: 'all', or a list of landmark indices and/or names (as in landmark_names, e.g. 'left_hip')
+    - prefix:    prepended to the landmark names in the channel names (e.g. 'left_' for the left hand)
+  the channels are the x, y, z coordinates of the selected landmarks, in the order of the spec
+- open_npy_landmarks memory-maps pose_landmarks.npy, lh_landmarks.npy and rh_landmarks.npy instead of loading them
+- assemble_measurements writes the selected channels of all videos directly into one preallocated
+  (video, coordinate, frame) array (optionally a memory-mapped .npy file, see open_measurements), one video and
+  stream at a time: no concatenated intermediate copies, so peak memory stays at about the size of the output
+  (or of one video, if the output is memory-mapped as well)
+
+used by: create_landmark_RDM.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import os
+import numpy as np
+
+# landmark names of the MediaPipe models
+raw_text_pose = """
+0 - nose
+1 - left eye (inner)
+2 - left eye
+3 - left eye (outer)
+4 - right eye (inner)
+5 - right eye
+6 - right eye (outer)
+7 - left ear
+8 - right ear
+9 - mouth (left)
+10 - mouth (right)
+11 - left shoulder
+12 - right shoulder
+13 - left elbow
+14 - right elbow
+15 - left wrist
+16 - right wrist
+17 - left pinky
+18 - right pinky
+19 - left index
+20 - right index
+21 - left thumb
+22 - right thumb
+23 - left hip
+24 - right hip
+25 - left knee
+26 - right knee
+27 - left ankle
+28 - right ankle
+29 - left heel
+30 - right heel
+31 - left foot index
+32 - right foot index
+"""
+
+raw_text_hand = """
+0 - wrist
+1 - thumb_cmc
+2 - thumb_mcp
+3 - thumb ip
+4 - thumb tip
+5 - index finger mcp
+6 - index finger pip
+7 - index finger dip
+8 - index finger tip
+9 - middle finger mcp
+10 - middle finger pip
+11 - middle finger dip
+12 - middle finger tip
+13 - ring finger mcp
+14 - ring finger pip
+15 - ring finger dip
+16 - ring finger tip
+17 - pinky mcp
+18 - pinky pip
+19 - pinky dip
+20 - pinky tip
+"""
+
+coordinates = ['x', 'y', 'z']
+landmark_files = {'pose': 'pose_landmarks.npy', 'lh': 'lh_landmarks.npy', 'rh': 'rh_landmarks.npy'}
+
+
+def listify_newline(raw_text):
+    # Split the text into lines and extract the relevant information
+    lines = raw_text.strip().split('\n')
+    lines = [line.split('-') for line in lines]
+    # Create the Python list including the first letter of each row
+    text_list = [item[1].strip() for item in lines]
+    # Substitute each space character with an underscore
+    text_list = [text.replace(' ', '_') for text in text_list]
+    return text_list
+
+
+landmark_names = {'pose': listify_newline(raw_text_pose),
+                  'lh': listify_newline(raw_text_hand),
+                  'rh': listify_newline(raw_text_hand)}
+
+
+def resolve_spec(channel_spec):
+    # validate the spec and turn it into a list of (stream, landmark indices, landmark names) with the prefixes applied
+    resolved = []
+    for entry in channel_spec:
+        stream = entry['stream']
+        if stream not in landmark_names:
+            raise ValueError(f'unknown stream {stream!r} in channel spec, use one of {list(landmark_names)}')
+        names = landmark_names[stream]
+        landmarks = entry.get('landmarks', 'all')
+        if isinstance(landmarks, str) and landmarks == 'all':
+            idx = list(range(len(names)))
+        else:
+            idx = []
+            for landmark in landmarks:
+                if isinstance(landmark, str):
+                    if landmark not in names:
+                        raise ValueError(f'unknown landmark {landmark!r} of stream {stream!r}')
+                    idx.append(names.index(landmark))
+                elif 0 <= landmark < len(names):
+                    idx.append(int(landmark))
+                else:
+                    raise ValueError(f'landmark index {landmark} out of range for stream {stream!r} ({len(names)} landmarks)')
+        prefix = entry.get('prefix', '')
+        resolved.append((stream, np.array(idx, dtype=np.intp), [prefix + names[i] for i in idx]))
+    return resolved
+
+
+def channel_names(channel_spec):
+    # one channel per coordinate of each selected landmark: <prefix><landmark>_x, _y, _z
+    return [f'{name}_{suffix}' for _, _, names in resolve_spec(channel_spec)
+            for name in names for suffix in coordinates]
+
+
+def open_npy_landmarks(input_dir, streams=('pose', 'lh', 'rh')):
+    # memory-mapped (video, frame, landmark, coordinate) arrays; nothing is read until the data is accessed
+    return {stream: np.load(os.path.join(input_dir, landmark_files[stream]), mmap_mode='r') for stream in streams}
+
+
+def open_measurements(path, shape, dtype=np.float64):
+    # preallocated output, as memory-mapped .npy file (readable with np.load like any other .npy)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def assemble_measurements(streams, channel_spec, n_frames=None, out=None, dtype=np.float64):
+    # streams: per stream, a sequence of (frame, landmark, coordinate) arrays, one per video, e.g. a
+    #          (video, frame, landmark, coordinate) array (memory-mapped or not) or a list of per-video arrays
+    #          from the landmark store; all streams need the same number of videos
+    # n_frames: frames per video in the output; longer videos are cut, shorter ones padded with NaN
+    #           (default: the shortest video)
+    # out: optional preallocated (video, coordinate, frame) output (see open_measurements)
+    # returns the (video, coordinate, frame) array, coordinates ordered as landmark1.x, landmark1.y, landmark1.z, ...
+    resolved = resolve_spec(channel_spec)
+    n_videos = {len(streams[stream]) for stream, _, _ in resolved}
+    if len(n_videos) != 1:
+        raise ValueError(f'the landmark streams differ in their number of videos: {n_videos}')
+    n_videos = n_videos.pop()
+    if n_frames is None:
+        n_frames = min((len(streams[stream][video]) for stream, _, _ in resolved for video in range(n_videos)),
+                       default=0)
+    n_channels = sum(len(idx) for _, idx, _ in resolved) * len(coordinates)
+    shape = (n_videos, n_channels, n_frames)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f'out has shape {out.shape}, expected {shape}')
+
+    for video in range(n_videos):
+        first = 0
+        for stream, idx, _ in resolved:
+            frames = streams[stream][video]
+            n = min(len(frames), n_frames)
+            last = first + len(idx) * len(coordinates)
+            # (frame, landmark, coordinate) -> (landmark x coordinate, frame), written straight into the output
+            out[video, first:last, :n] = frames[:n, idx, :len(coordinates)].reshape(n, -1).T
+            out[video, first:last, n:] = np.nan
+            first = last
+    return out
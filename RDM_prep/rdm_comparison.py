@@ -0,0 +1,174 @@
+"""
+rdm_comparison.py
+vectorized comparison of two RDMs with permutation tests and bootstrap confidence intervals
+
+- works on condensed RDM vectors (upper triangle, row by row, as RDMs.get_vectors() in rsatoolbox)
+- comparison methods as in rsatoolbox.rdm.compare: 'corr' (Pearson), 'rho-a' (Spearman without tie correction) and
+  'spearman' (Pearson correlation of the ranks); compare_vectors gives the same values as rdm.compare
+- permutation_test: null distribution by permuting the condition labels of one RDM. permuting conditions only
+  reorders the entries of the condensed vector (and thus of its ranks), so each permuted comparison is one dot product
+  of the fixed, centred (rank) vector with gathered entries of the other; a batch of permutations is one index gather
+  and one matrix-vector product
+- bootstrap: resamples conditions with replacement (as rsatoolbox's bootstrap_sample_pattern); pairs of the same
+  condition are left out (as RDMs.subsample_pattern does), so each resample has its own set of valid entries and is
+  evaluated as a masked comparison; ranks are recomputed per resample, by counting (no sorting per resample)
+- batches of permutations/resamples are spread across a pool of worker processes (n_workers); every batch has its
+  own seed (derived from seed), so the results do not depend on the number of workers
+
+used by: compare_RDMs.py, get_fasttext_vectors.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import multiprocessing
+import numpy as np
+import scipy.stats
+
+methods = ('corr', 'rho-a', 'spearman')
+default_batch_size = 1000
+
+
+def condensed_vector(rdm):
+    # condensed vector of a single RDM, given as rsatoolbox RDMs object, square matrix or condensed vector
+    if hasattr(rdm, 'get_vectors'):
+        vectors = rdm.get_vectors()
+        if len(vectors) != 1:
+            raise ValueError(f'expected a single RDM, got {len(vectors)}')
+        return vectors[0]
+    rdm = np.asarray(rdm, dtype=np.float64)
+    if rdm.ndim == 2 and rdm.shape[0] == rdm.shape[1]:
+        return rdm[np.triu_indices(rdm.shape[0], k=1)]
+    return rdm.ravel()
+
+
+def n_conditions(n_pairs):
+    n = int(round((1 + np.sqrt(1 + 8 * n_pairs)) / 2))
+    if n * (n - 1) // 2 != n_pairs:
+        raise ValueError(f'{n_pairs} entries are no condensed RDM')
+    return n
+
+
+def _pair_lookup(n_conds):
+    # (conditions, conditions) position of each pair in the condensed vector; the diagonal points to entry 0
+    lookup = np.zeros((n_conds, n_conds), dtype=np.intp)
+    rows, cols = np.triu_indices(n_conds, k=1)
+    lookup[rows, cols] = lookup[cols, rows] = np.arange(len(rows))
+    return lookup, rows, cols
+
+
+def _prepare(vectors, method):
+    # values entering the comparison, centred along the last axis: the values ('corr') or their ranks
+    if method not in methods:
+        raise ValueError(f'unknown comparison method {method!r}, use one of {methods}')
+    if method != 'corr':
+        vectors = scipy.stats.rankdata(vectors, axis=-1)
+    return vectors - vectors.mean(axis=-1, keepdims=True)
+
+
+def _similarity(dot, sum_sq1, sum_sq2, n, method):
+    # comparison value from the dot product and sums of squares of the centred values, n: number of entries
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'rho-a':
+            return dot * 12 / (n ** 3 - n)
+        return dot / np.sqrt(sum_sq1 * sum_sq2)
+
+
+def compare_vectors(vector1, vectors2, method='corr'):
+    # compare one condensed RDM with one or more (rows of vectors2); returns one value per row
+    vector1 = np.asarray(vector1, dtype=np.float64)
+    vectors2 = np.atleast_2d(np.asarray(vectors2, dtype=np.float64))
+    if np.isnan(vector1).any() or np.isnan(vectors2).any():
+        raise ValueError('the RDMs must not contain NaN')
+    a = _prepare(vector1, method)
+    b = _prepare(vectors2, method)
+    return _similarity(b @ a, a @ a, (b * b).sum(axis=1), len(a), method)
+
+
+def _permutation_batch(a, b, method, seed, size):
+    # comparison values of size random permutations of the conditions of b
+    lookup, rows, cols = _pair_lookup(n_conditions(len(b)))
+    rng = np.random.default_rng(seed)
+    perms = np.argsort(rng.random((size, lookup.shape[0])), axis=1)
+    # entries of the permuted RDMs: (permutation, pair); sums of squares are unchanged by permuting
+    dots = b[lookup[perms[:, rows], perms[:, cols]]] @ a
+    return _similarity(dots, a @ a, b @ b, len(a), method)
+
+
+def _resample_ranks(levels, n_levels, valid):
+    # ranks (ties averaged, as scipy.stats.rankdata) of the valid entries of each row, for resamples of a fixed set of
+    # values: levels are the dense ranks (0 .. n_levels - 1) of the resampled entries. counting the entries per level
+    # replaces sorting each row: rank = (number of entries at lower levels) + (number of entries at the level + 1) / 2
+    flat = (levels + np.arange(len(levels))[:, np.newaxis] * n_levels).ravel()  # (row, level) in the flat counts
+    counts = np.bincount(flat, weights=valid.ravel(), minlength=len(levels) * n_levels).reshape(-1, n_levels)
+    below = np.cumsum(counts, axis=1) - counts
+    return (below.ravel()[flat] + (counts.ravel()[flat] + 1) / 2).reshape(levels.shape)
+
+
+def _bootstrap_batch(x, y, method, seed, size):
+    # comparison values of size bootstrap resamples of the conditions
+    lookup, rows, cols = _pair_lookup(n_conditions(len(x)))
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, lookup.shape[0], size=(size, lookup.shape[0]))
+    first, second = samples[:, rows], samples[:, cols]
+    idx = lookup[first, second]
+    valid = first != second  # pairs of a condition with itself are left out
+    n = valid.sum(axis=1)
+    centred = []
+    for vector in (x, y):
+        if method == 'corr':
+            values = vector[idx]
+        else:
+            _, levels = np.unique(vector, return_inverse=True)
+            values = _resample_ranks(levels[idx], levels.max() + 1, valid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0).sum(axis=1) / n
+        centred.append(np.where(valid, values - mean[:, np.newaxis], 0))
+    a, b = centred
+    return _similarity((a * b).sum(axis=1), (a * a).sum(axis=1), (b * b).sum(axis=1), n, method)
+
+
+def _run_batches(function, args, n, seed, n_workers, batch_size):
+    # run function(*args, batch_seed, batch_size) for batches adding up to n, in n_workers processes
+    sizes = [min(batch_size, n - start) for start in range(0, n, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(*args, batch_seed, size) for batch_seed, size in zip(seeds, sizes)]
+    workers = min(n_workers, len(tasks))
+    if workers > 1:
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            results = pool.starmap(function, tasks)
+    else:
+        results = [function(*task) for task in tasks]
+    return np.concatenate(results) if results else np.empty(0)
+
+
+def permutation_test(vector1, vector2, method='corr', n_permutations=10000, seed=0, n_workers=1,
+                     batch_size=default_batch_size):
+    # one-sided permutation test (is the similarity larger than under randomly permuted condition labels?)
+    # returns the observed value, the p-value ((1 + number of permutations >= observed) / (1 + n_permutations))
+    # and the null distribution
+    observed = compare_vectors(vector1, vector2, method)[0]
+    a = _prepare(np.asarray(vector1, dtype=np.float64), method)
+    b = _prepare(np.asarray(vector2, dtype=np.float64), method)
+    null = _run_batches(_permutation_batch, (a, b, method), n_permutations, seed, n_workers, batch_size)
+    # (with a small tolerance, so that permutations reproducing the observed value count despite rounding)
+    p_value = (1 + np.sum(null >= observed - 1e-12)) / (1 + len(null))
+    return observed, p_value, null
+
+
+def bootstrap(vector1, vector2, method='corr', n_bootstraps=1000, seed=0, n_workers=1, confidence=0.95,
+              batch_size=default_batch_size):
+    # bootstrap distribution over conditions; returns the percentile confidence interval (low, high) and the
+    # distribution (NaN for resamples with too few distinct conditions; these are ignored for the interval)
+    x = np.asarray(vector1, dtype=np.float64)
+    y = np.asarray(vector2, dtype=np.float64)
+    if len(x) != len(y):
+        raise ValueError('the RDMs must have the same number of conditions')
+    if np.isnan(x).any() or np.isnan(y).any():
+        raise ValueError('the RDMs must not contain NaN')
+    if method not in methods:
+        raise ValueError(f'unknown comparison method {method!r}, use one of {methods}')
+    distribution = _run_batches(_bootstrap_batch, (x, y, method), n_bootstraps, seed, n_workers, batch_size)
+    alpha = (1 - confidence) / 2
+    finite = distribution[np.isfinite(distribution)]
+    interval = tuple(np.quantile(finite, [alpha, 1 - alpha])) if len(finite) else (np.nan, np.nan)
+    return interval, distribution
@@ -0,0 +1,314 @@
+"""
+study_store.py
+one chunked, compressed HDF5 file for the FL_BILINGUAL landmark & word-vector artifacts, with lazy slicing
+
+replaces reading the scattered artifacts (pose/lh/rh_landmarks.npy, landmark_inputs.csv, landmark_desc.txt,
+landmarks_by_word_and_frame.npy, ft_word_vectors_300.csv, ft_word_vector_descriptors.csv, *.hdf5 RDMs) one by one:
+
+- layout (all names are HDF5 paths in the file):
+    /                         attrs: layout_version, description (the text of landmark_desc.txt)
+    /conditions/names         video names, in the order of all per-video arrays
+    /landmarks/pose, lh, rh   (video, frame, landmark, coordinate), NaN beyond each video's number of frames
+    /landmarks/n_frames       number of frames of each video
+    /landmarks/measurements   (video, channel, frame) as used for the landmark RDM (see create_landmark_RDM.py)
+    /landmarks/channel_names  names of the measurement channels (see landmark_channels.py)
+    /landmarks/times          timing vector of the frames (s); attrs: fps
+    /word_vectors/vectors     (word, dimension) fastText vectors
+    /word_vectors/words, /word_vectors/stimulus_id
+    /rdms/<name>              rsatoolbox RDMs (same content as RDMs.save): 'landmark_RDM_binned', 'ft_300_cosine', ...
+- the landmark arrays are chunked per video and block of frames (frame_chunk) and gzip-compressed, so reading one
+  video, a frame range or a few channels only decompresses the chunks involved
+- StudyStoreWriter writes the parts one after another (each part is optional); StudyStore reads them lazily:
+  store.measurements(videos=..., channels=..., frames=...) and store.landmarks(stream, videos=..., landmarks=...,
+  frames=...) read only the selected part (videos and channels by index or name, frames as slice)
+- running this script consolidates the existing artifacts of create_landmark_RDM.py and get_fasttext_vectors.py
+  into FL_BILINGUAL_study.h5 (parts whose files are missing are skipped)
+
+used by: compare_RDMs.py (rdm_source = 'store')
+required conda environment: RDM_prep (h5py is installed with rsatoolbox)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import os
+import h5py
+import numpy as np
+import pandas as pd
+import rsatoolbox
+
+layout_version = 1
+default_frame_chunk = 64  # frames per chunk of the landmark arrays
+
+# get location of this script:
+script_path = os.path.abspath(__file__)
+script_dir = os.path.abspath(os.path.dirname(script_path))
+landmark_dir = os.path.normpath(os.path.join(script_dir, '../sample_stimuli/gestures_pose'))
+store_path = os.path.join(script_dir, 'FL_BILINGUAL_study.h5')
+
+
+def _strings(values):
+    return np.array([str(value) for value in values], dtype=h5py.string_dtype())
+
+
+def _decode(values):
+    return [value.decode() if isinstance(value, bytes) else str(value) for value in values]
+
+
+def _write_dict(group, dictionary):
+    # nested dict of strings & arrays (as RDMs.to_dict()) into a group; strings become attributes
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            _write_dict(group.create_group(key), value)
+        elif isinstance(value, str):
+            group.attrs[key] = value
+        elif value is None:
+            group[key] = h5py.Empty('f')
+        else:
+            value = np.asarray(value)
+            group[key] = _strings(value) if value.dtype.kind in 'UO' else value
+
+
+def _read_dict(group):
+    dictionary = {}
+    for key, value in group.items():
+        if isinstance(value, h5py.Group):
+            dictionary[key] = _read_dict(value)
+        elif value.shape is None:
+            dictionary[key] = None
+        elif value.dtype.kind == 'O':
+            dictionary[key] = np.array(_decode(value[()]))
+        else:
+            dictionary[key] = value[()]
+    dictionary.update(group.attrs)
+    return dictionary
+
+
+def _selection(key, names):
+    # indices for key (None: all; int/name or list of ints/names)
+    if key is None:
+        return np.arange(len(names))
+    single = isinstance(key, (str, int, np.integer))
+    keys = [key] if single else list(key)
+    idx = np.array([names.index(k) if isinstance(k, str) else int(k) for k in keys], dtype=np.intp)
+    if len(idx) and (idx.min() < 0 or idx.max() >= len(names)):
+        raise IndexError(f'selection {key!r} out of range ({len(names)} entries)')
+    return idx
+
+
+def _read_rows(dataset, videos, columns, frames, frame_axis):
+    # dataset[videos][..columns..][frames] for a per-video dataset; h5py accepts one (increasing) index list per
+    # read, so each video is read separately with the sorted columns, then put in the requested order
+    order = np.argsort(columns, kind='stable')
+    sorted_columns = columns[order]
+    unique_columns, inverse = np.unique(sorted_columns, return_inverse=True)
+    rows = []
+    for video in videos:
+        if frame_axis == 1:  # (video, frame, landmark, coordinate)
+            block = dataset[video, frames, unique_columns]
+            block = block[:, inverse][:, np.argsort(order)]
+        else:  # (video, channel, frame)
+            block = dataset[video, unique_columns, frames]
+            block = block[inverse][np.argsort(order)]
+        rows.append(block)
+    if not rows:
+        shape = list(dataset.shape[1:])
+        shape[frame_axis - 1] = len(range(*frames.indices(dataset.shape[frame_axis])))
+        shape[2 - frame_axis] = len(columns)
+        return np.empty((0, *shape))
+    return np.stack(rows)
+
+
+class StudyStoreWriter:
+    """writes the parts of a study store; an existing file at path is replaced
+
+    usage:
+        with StudyStoreWriter(path, cond_names) as store:
+            store.add_landmarks(pose=..., lh=..., rh=..., n_frames=...)
+            store.add_measurements(measurements, channel_names, times, fps)
+            store.add_word_vectors(vectors, words, stimulus_ids)
+            store.add_rdm('landmark_RDM_binned', rdms)
+    """
+
+    def __init__(self, path, cond_names, description=None, frame_chunk=default_frame_chunk, compression='gzip'):
+        self.file = h5py.File(path, 'w')
+        self.file.attrs['layout_version'] = layout_version
+        if description is not None:
+            self.file.attrs['description'] = description
+        self.file.create_group('conditions')['names'] = _strings(cond_names)
+        self.n_videos = len(cond_names)
+        self.frame_chunk = frame_chunk
+        self.compression = compression
+
+    def _create(self, group, name, shape, frame_axis):
+        # dataset chunked per video and block of frames
+        chunks = list(shape)
+        chunks[0] = 1
+        chunks[frame_axis] = max(1, min(self.frame_chunk, shape[frame_axis]))
+        return self.file.require_group(group).create_dataset(name, shape=shape, dtype=np.float64, chunks=tuple(chunks),
+                                                             compression=self.compression, fillvalue=np.nan)
+
+    def add_landmarks(self, n_frames=None, **streams):
+        # streams: per stream (pose, lh, rh), a sequence of (frame, landmark, coordinate) arrays, one per video
+        # (e.g. a memory-mapped (video, frame, landmark, coordinate) npy array); written one video at a time
+        for name, videos in streams.items():
+            if len(videos) != self.n_videos:
+                raise ValueError(f'stream {name} has {len(videos)} videos, expected {self.n_videos}')
+            lengths = [len(video) for video in videos]
+            dataset = self._create('landmarks', name, (self.n_videos, max(lengths, default=0), *videos[0].shape[1:]), 1)
+            for i, video in enumerate(videos):
+                dataset[i, :len(video)] = video
+            if n_frames is None:
+                n_frames = lengths
+        self.file['landmarks']['n_frames'] = np.asarray(n_frames, dtype=np.int64)
+
+    def add_measurements(self, measurements, channel_names, times, fps):
+        # measurements: (video, channel, frame), e.g. memory-mapped
+        if measurements.shape[:2] != (self.n_videos, len(channel_names)):
+            raise ValueError(f'measurements have shape {measurements.shape}, expected ({self.n_videos}, '
+                             f'{len(channel_names)}, frames)')
+        dataset = self._create('landmarks', 'measurements', measurements.shape, 2)
+        for i in range(self.n_videos):
+            dataset[i] = measurements[i]
+        group = self.file['landmarks']
+        group['channel_names'] = _strings(channel_names)
+        group['times'] = np.asarray(times, dtype=np.float64)
+        group['times'].attrs['fps'] = fps
+
+    def add_word_vectors(self, vectors, words, stimulus_ids=None):
+        group = self.file.create_group('word_vectors')
+        group.create_dataset('vectors', data=np.asarray(vectors), chunks=True, compression=self.compression)
+        group['words'] = _strings(words)
+        if stimulus_ids is not None:
+            group['stimulus_id'] = np.asarray(stimulus_ids)
+
+    def add_rdm(self, name, rdms):
+        _write_dict(self.file.require_group('rdms').create_group(name), rdms.to_dict())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StudyStore:
+    """lazy read access to a study store; nothing but the names is read when opening
+
+    store.condition_names, store.channel_names, store.words, store.rdm_names
+    store.measurements(videos=None, channels=None, frames=None): (video, channel, frame) array of the selection
+    store.landmarks(stream, videos=None, landmarks=None, frames=None): (video, frame, landmark, coordinate) array
+    store.n_frames, store.times, store.fps, store.word_vectors(words=None), store.rdm(name), store.description
+    """
+
+    def __init__(self, path):
+        self.file = h5py.File(path, 'r')
+        if self.file.attrs.get('layout_version') != layout_version:
+            raise ValueError(f'{path} has layout version {self.file.attrs.get("layout_version")}, expected {layout_version}')
+        self.condition_names = _decode(self.file['conditions/names'][()])
+        self.description = self.file.attrs.get('description')
+        self.channel_names = _decode(self.file['landmarks/channel_names'][()]) \
+            if 'landmarks/channel_names' in self.file else []
+        self.words = _decode(self.file['word_vectors/words'][()]) if 'word_vectors' in self.file else []
+        self.rdm_names = list(self.file['rdms']) if 'rdms' in self.file else []
+
+    @property
+    def n_frames(self):
+        return self.file['landmarks/n_frames'][()]
+
+    @property
+    def times(self):
+        return self.file['landmarks/times'][()]
+
+    @property
+    def fps(self):
+        return self.file['landmarks/times'].attrs['fps']
+
+    def measurements(self, videos=None, channels=None, frames=None):
+        # videos/channels: index, name or list of them (None: all); frames: slice (None: all)
+        dataset = self.file['landmarks/measurements']
+        return _read_rows(dataset, _selection(videos, self.condition_names), _selection(channels, self.channel_names),
+                          slice(None) if frames is None else frames, 2)
+
+    def landmarks(self, stream, videos=None, landmarks=None, frames=None):
+        # stream: 'pose', 'lh' or 'rh'; landmarks: index or list of indices (None: all)
+        dataset = self.file['landmarks'][stream]
+        return _read_rows(dataset, _selection(videos, self.condition_names),
+                          _selection(landmarks, list(range(dataset.shape[2]))),
+                          slice(None) if frames is None else frames, 1)
+
+    def word_vectors(self, words=None):
+        # (word, dimension) vectors of the selected words (by index or word; None: all)
+        dataset = self.file['word_vectors/vectors']
+        if words is None:
+            return dataset[()]
+        idx = _selection(words, self.words)
+        unique, inverse = np.unique(idx, return_inverse=True)
+        return dataset[unique][inverse]
+
+    def stimulus_ids(self):
+        return self.file['word_vectors/stimulus_id'][()]
+
+    def rdm(self, name):
+        return rsatoolbox.rdm.rdms_from_dict(_read_dict(self.file['rdms'][name]))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    # consolidate the existing artifacts into store_path
+    cond_names = pd.read_csv(os.path.join(landmark_dir, 'landmark_inputs.csv'), header=None).T.squeeze(axis=1).tolist()
+    description_path = os.path.join(landmark_dir, 'landmark_desc.txt')
+    description = open(description_path).read() if os.path.exists(description_path) else None
+
+    with StudyStoreWriter(store_path, cond_names, description) as store:
+        streams = {stream: np.load(os.path.join(landmark_dir, f'{stream}_landmarks.npy'), mmap_mode='r')
+                   for stream in ('pose', 'lh', 'rh')}
+        store.add_landmarks(**streams)
+        print(f'landmarks: {len(cond_names)} videos')
+
+        measurements_path = os.path.join(script_dir, 'landmarks_by_word_and_frame.npy')
+        if os.path.exists(measurements_path):
+            # channel names & timing as in create_landmark_RDM.py
+            import create_landmark_RDM
+            measurements = np.load(measurements_path, mmap_mode='r')
+            times = np.arange(measurements.shape[2]) / create_landmark_RDM.fps
+            store.add_measurements(measurements, create_landmark_RDM.make_channel_names(), times, create_landmark_RDM.fps)
+            print(f'measurements: {measurements.shape}')
+
+        vectors_path = os.path.join(script_dir, 'ft_word_vectors_300.csv')
+        descriptors_path = os.path.join(script_dir, 'ft_word_vector_descriptors.csv')
+        if os.path.exists(vectors_path) and os.path.exists(descriptors_path):
+            descriptors = pd.read_csv(descriptors_path)
+            vectors = pd.read_csv(vectors_path).to_numpy()
+            store.add_word_vectors(vectors, descriptors['word'], descriptors['stimulus_id'])
+            print(f'word vectors: {vectors.shape}')
+
+        ft_rdm_path = os.path.join(script_dir, 'ft_300_cosine_dissimilarities.npy')
+        if os.path.exists(ft_rdm_path) and os.path.exists(descriptors_path):
+            descriptors = pd.read_csv(descriptors_path)
+            ft_rdm = rsatoolbox.rdm.RDMs(np.load(ft_rdm_path)[np.newaxis], dissimilarity_measure='cosine',
+                                         pattern_descriptors={'word': descriptors['word'].tolist(),
+                                                              'stimulus_id': descriptors['stimulus_id'].tolist()})
+            store.add_rdm('ft_300_cosine', ft_rdm)
+            print('RDM: ft_300_cosine')
+
+        for name in ('landmark_RDM_binned', 'landmark_RDM_movie'):
+            rdm_path = os.path.join(script_dir, f'{name}.hdf5')
+            if os.path.exists(rdm_path):
+                store.add_rdm(name, rsatoolbox.rdm.load_rdm(rdm_path))
+                print(f'RDM: {name}')
+    print(f'saved to {store_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+word_vector_cache.py
+persistent cache of fastText word vectors, so that the model (cc.de.300.bin, ~7 GB in memory) is only loaded for words
+that were never looked up before
+
+- one table per model file and dimensionality: a float32 (word, dimension) matrix, memory-mapped (<table>.npy), and
+  the list of its words in row order (<table>.words.json)
+- the key of a table is the sha256 of the model file's CONTENT and the dimensionality (vectors of a model reduced with
+  fasttext.util.reduce_model are cached separately from the full ones)
+- model hashes are remembered per file (path, size, modification time), so the model file is only hashed once
+- the model is loaded lazily (via load_model, default: fasttext.load_model + reduce_model), only when a requested word
+  is not in the table yet; new words are appended to the table (written to a temporary file first, so that an
+  interrupted run never leaves a broken table)
+- manifest.json lists the model hashes and all tables (model file, dimensionality, number of words, creation & last use)
+- fastText's vectors are float32 already, so the cached vectors equal those of get_word_vector exactly
+
+directory layout:
+    word_vector_cache/manifest.json
+    word_vector_cache/<model sha256>_<dim>.npy
+    word_vector_cache/<model sha256>_<dim>.words.json
+
+usage:
+    cache = WordVectorCache(cache_dir, 'cc.de.300.bin')         # or dim=10 for the model reduced to 10 dimensions
+    vectors = cache.get_vectors(['anschnallen', 'anstreichen'])  # (word, dimension) float32
+
+command line (in the RDM_prep conda environment), to inspect/clear the cache:
+    python word_vector_cache.py list
+    python word_vector_cache.py clear
+
+used by: get_fasttext_vectors.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+manifest_filename = 'manifest.json'
+_hash_chunk_size = 1 << 20  # read the model in 1 MiB chunks for hashing
+full_dim = 300  # dimensionality of the pre-trained fastText models
+
+# get location of this script:
+script_path = os.path.abspath(__file__)
+script_dir = os.path.abspath(os.path.dirname(script_path))
+default_cache_dir = os.path.join(script_dir, 'word_vector_cache')
+
+
+def load_fasttext_model(model_path, dim):
+    # the fastText model, reduced to dim dimensions if dim is below its dimensionality
+    import fasttext.util
+
+    model = fasttext.load_model(model_path)
+    if dim < model.get_dimension():
+        fasttext.util.reduce_model(model, dim)
+    return model
+
+
+class WordVectorCache:
+
+    def __init__(self, cache_dir, model_path, dim=full_dim, load_model=load_fasttext_model):
+        self.cache_dir = cache_dir
+        self.model_path = model_path
+        self.dim = int(dim)
+        self.load_model = load_model
+        self.model = None  # loaded on the first word missing from the table
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest_path = os.path.join(cache_dir, manifest_filename)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {'tables': {}, 'files': {}}
+        self.key = f'{self.model_hash()}_{self.dim}'
+        self.words, self.vectors = self._read_table()
+        self.index = {word: row for row, word in enumerate(self.words)}
+
+    def model_hash(self):
+        # sha256 of the model file, re-used as long as path, size and modification time are unchanged
+        stat = os.stat(self.model_path)
+        path = os.path.abspath(self.model_path)
+        known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        digest = hashlib.sha256()
+        with open(self.model_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_hash_chunk_size), b''):
+                digest.update(chunk)
+        self.manifest['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        self.save_manifest()
+        return digest.hexdigest()
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __len__(self):
+        return len(self.words)
+
+    def get_vectors(self, words, out=None, block_rows=65536):
+        # (word, dimension) float32 vectors of words, in the given order, written into out (allocated if not given;
+        # e.g. memory-mapped for large vocabularies); only words missing from the table are looked up in the model
+        # (which is loaded for that, once)
+        words = list(words)
+        if out is None:
+            out = np.empty((len(words), self.dim), dtype=np.float32)
+        elif out.shape != (len(words), self.dim):
+            raise ValueError(f'out has shape {out.shape}, expected {(len(words), self.dim)}')
+        missing = list(dict.fromkeys(word for word in words if word not in self.index))
+        if missing:
+            if self.model is None:
+                print(f'{len(missing)} words not in the word vector cache, loading {self.model_path} ({self.dim} dimensions)')
+                self.model = self.load_model(self.model_path, self.dim)
+            new_vectors = np.empty((len(missing), self.dim), dtype=np.float32)
+            for row, word in enumerate(missing):
+                new_vectors[row] = self.model.get_word_vector(word)
+            self._append(missing, new_vectors)
+        table = self.manifest['tables'].get(self.key)
+        if table is not None:
+            table['last_used'] = time.time()
+            self.save_manifest()
+        rows = np.array([self.index[word] for word in words], dtype=np.int64)
+        for start in range(0, len(words), block_rows):
+            out[start:start + block_rows] = self.vectors[rows[start:start + block_rows]]
+        return out
+
+    def _append(self, words, vectors):
+        # rewrite the table with the new rows (to a temporary file, then replaced), then its word list
+        n_old = len(self.words)
+        tmp_path = self._table_path() + '.tmp.npy'
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(n_old + len(words), self.dim))
+        table[:n_old] = self.vectors
+        table[n_old:] = vectors
+        table.flush()
+        del table
+        self.vectors = None  # release the memory map of the old table before replacing it
+        os.replace(tmp_path, self._table_path())
+        self.words = self.words + words
+        with open(self._words_path() + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.words, file, ensure_ascii=False)
+        os.replace(self._words_path() + '.tmp', self._words_path())
+        self.index = {word: row for row, word in enumerate(self.words)}
+        self.vectors = np.load(self._table_path(), mmap_mode='r')
+
+        now = time.time()
+        created = self.manifest['tables'].get(self.key, {}).get('created', now)
+        self.manifest['tables'][self.key] = {'model': os.path.basename(self.model_path), 'dim': self.dim,
+                                             'n_words': len(self.words), 'bytes': os.path.getsize(self._table_path()),
+                                             'created': created, 'last_used': now}
+        self.save_manifest()
+
+    def _read_table(self):
+        # words and memory-mapped vectors of this model & dimensionality (rows beyond the word list, left by an
+        # interrupted update, are ignored)
+        if not (os.path.exists(self._table_path()) and os.path.exists(self._words_path())):
+            return [], np.empty((0, self.dim), dtype=np.float32)
+        with open(self._words_path(), encoding='utf-8') as file:
+            words = json.load(file)
+        vectors = np.load(self._table_path(), mmap_mode='r')
+        if vectors.shape[1] != self.dim or len(vectors) < len(words):
+            raise ValueError(f'word vector cache table {self._table_path()} does not match its word list')
+        return words, vectors[:len(words)]
+
+    def save_manifest(self):
+        manifest_path = os.path.join(self.cache_dir, manifest_filename)
+        with open(manifest_path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def _table_path(self):
+        return os.path.join(self.cache_dir, f'{self.key}.npy')
+
+    def _words_path(self):
+        return os.path.join(self.cache_dir, f'{self.key}.words.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='inspect and clear the word vector cache')
+    parser.add_argument('command', choices=('list', 'clear'))
+    parser.add_argument('--cache-dir', default=default_cache_dir)
+    args = parser.parse_args()
+
+    manifest_path = os.path.join(args.cache_dir, manifest_filename)
+    if not os.path.exists(manifest_path):
+        print(f'no word vector cache in {args.cache_dir}')
+        return
+    with open(manifest_path) as file:
+        tables = json.load(file)['tables']
+    if args.command == 'list':
+        for key, table in sorted(tables.items(), key=lambda item: (item[1]['model'], item[1]['dim'])):
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(table['last_used']))
+            print(f"{key[:12]}  {table['model']:<20} {table['dim']:>4} dims  {table['n_words']:>7} words  "
+                  f"{table['bytes'] / 1e6:8.2f} MB  last used {last_used}")
+        print(f'{len(tables)} tables')
+        return
+    for key in tables:
+        for suffix in ('.npy', '.words.json'):
+            path = os.path.join(args.cache_dir, key + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    os.remove(manifest_path)
+    print(f'{len(tables)} tables removed')
+
+
+if __name__ == '__main__':
+    main()
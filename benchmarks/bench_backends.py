@@ -0,0 +1,105 @@
+"""
+bench_backends.py
+throughput comparison of the inference backends of estimate_pose_hands.py on the sample gestures
+
+- decodes all frames of the videos in sample_stimuli/gestures into memory first, so only inference is timed
+- runs each backend (see backends.py) over every video with the model settings of estimate_pose_hands.py:
+    - solutions:          legacy mp.solutions Pose & Hands (the default)
+    - tasks (video):      MediaPipe Tasks landmarkers, one blocking detect_for_video call per frame
+    - tasks (live_stream): MediaPipe Tasks landmarkers, detect_async with result callbacks
+  the Tasks backends are skipped if their *.task model files are missing (see mediapipe_estimate_pose_hands/README.md)
+- prints frames/second, the share of frames with a pose / both hands, frames dropped in live_stream mode, and the
+  mean pose landmark difference to the solutions backend (normalized image coordinates)
+
+usage (in the mediapipe conda environment):
+    python bench_backends.py
+    python bench_backends.py --max-frames 50
+
+required conda environment: mediapipe (see mediapipe_estimate_pose_hands/environment.yml)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+# make the helpers in mediapipe_estimate_pose_hands importable
+script_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+from backends import SolutionsBackend, TasksBackend, timestamp_ms
+from estimate_pose_hands import pose_settings, hands_settings, task_model_dir, mediapipe_indir
+
+configurations = {'solutions': lambda: SolutionsBackend(pose_settings, hands_settings),
+                  'tasks (video)': lambda: TasksBackend(pose_settings, hands_settings, task_model_dir, 'video'),
+                  'tasks (live_stream)': lambda: TasksBackend(pose_settings, hands_settings, task_model_dir, 'live_stream')}
+
+
+def read_video(video_path, max_frames=None):
+    # all frames of one video as RGB images, and its fps
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = []
+    while cap.isOpened() and (not max_frames or len(frames) < max_frames):
+        success, image = cap.read()
+        if not success:
+            break
+        frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames, fps
+
+
+def run_backend(backend, videos):
+    # landmarks of all frames of all videos, and the time spent in the backend
+    results = []
+    seconds = 0
+    for frames, fps in videos:
+        height, width = frames[0].shape[:2]
+        backend.reset(width, height)
+        start = time.perf_counter()
+        finished = []
+        for frame, image in enumerate(frames):
+            finished += backend.submit(image, timestamp_ms(frame, fps))
+        finished += backend.flush()
+        seconds += time.perf_counter() - start
+        results.append((finished, backend.report()))
+    return results, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='throughput comparison of the inference backends')
+    parser.add_argument('--max-frames', type=int, default=0, help='only use the first frames of each video (0: all)')
+    args = parser.parse_args()
+
+    video_names = sorted(f for f in os.listdir(mediapipe_indir) if f.endswith('.mp4'))
+    videos = [read_video(os.path.join(mediapipe_indir, f), args.max_frames) for f in video_names]
+    n_frames = sum(len(frames) for frames, _ in videos)
+    print(f'{len(videos)} videos, {n_frames} frames, pose model_complexity={pose_settings["model_complexity"]}\n')
+
+    reference = None
+    print(f'{"backend":<22}{"frames/s":>10}{"pose":>8}{"2 hands":>9}{"dropped":>9}{"pose diff":>11}')
+    for name, create in configurations.items():
+        try:
+            backend = create()
+        except FileNotFoundError as error:
+            print(f'{name:<22}skipped: {error}')
+            continue
+        results, seconds = run_backend(backend, videos)
+        pose = np.concatenate([[frame.pose for frame in finished] for finished, _ in results])
+        lh = np.concatenate([[frame.lh for frame in finished] for finished, _ in results])
+        rh = np.concatenate([[frame.rh for frame in finished] for finished, _ in results])
+        has_pose = ~np.isnan(pose).all(axis=(1, 2))
+        has_hands = ~np.isnan(lh).all(axis=(1, 2)) & ~np.isnan(rh).all(axis=(1, 2))
+        dropped = sum(max(report.get('dropped_frames', {'': 0}).values()) for _, report in results)
+        if reference is None:
+            reference = pose
+        both = has_pose & ~np.isnan(reference).all(axis=(1, 2))
+        diff = np.linalg.norm(pose[both] - reference[both], axis=2).mean() if both.any() else np.nan
+        print(f'{name:<22}{n_frames / seconds:10.1f}{has_pose.mean():8.0%}{has_hands.mean():9.0%}{dropped:9d}{diff:11.4f}')
+
+
+if __name__ == '__main__':
+    main()
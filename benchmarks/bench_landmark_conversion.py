@@ -0,0 +1,90 @@
+"""
+bench_landmark_conversion.py
+micro-benchmark of the per-frame landmark copy in estimate_pose_hands.py
+
+- builds synthetic pose (33 landmarks) and hand (2 x 21 landmarks) results as MediaPipe protobuf messages
+- times the former per-landmark loop (one fancy-indexed numpy write per coordinate, via protobuf's private _values)
+  against landmark_arrays.landmarks_to_array (one slice assignment per result)
+- prints the per-frame overhead in microseconds for both
+
+required conda environment: mediapipe (see mediapipe_estimate_pose_hands/environment.yml)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import os
+import sys
+import timeit
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+# make the helpers in mediapipe_estimate_pose_hands importable
+script_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+from landmark_arrays import landmarks_to_array
+
+n_frames = 200
+n_repeats = 5
+
+
+def synthetic_landmark_list(n_landmarks, rng):
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for _ in range(n_landmarks):
+        landmark_list.landmark.add(x=rng.random(), y=rng.random(), z=rng.random(), visibility=rng.random())
+    return landmark_list
+
+
+def copy_loop(landmarks, lh_marks, rh_marks, frame, pose_result, lh_result, rh_result):
+    # the former implementation: one numpy write per landmark coordinate
+    for lm in range(len(pose_result.landmark._values)):
+        landmarks[frame, lm, 0] = pose_result.landmark._values[lm].x
+        landmarks[frame, lm, 1] = pose_result.landmark._values[lm].y
+        landmarks[frame, lm, 2] = pose_result.landmark._values[lm].z
+    for lm in range(len(lh_result.landmark._values)):
+        lh_marks[frame, lm, 0] = lh_result.landmark._values[lm].x
+        lh_marks[frame, lm, 1] = lh_result.landmark._values[lm].y
+        lh_marks[frame, lm, 2] = lh_result.landmark._values[lm].z
+    for lm in range(len(rh_result.landmark._values)):
+        rh_marks[frame, lm, 0] = rh_result.landmark._values[lm].x
+        rh_marks[frame, lm, 1] = rh_result.landmark._values[lm].y
+        rh_marks[frame, lm, 2] = rh_result.landmark._values[lm].z
+
+
+def copy_bulk(landmarks, lh_marks, rh_marks, frame, pose_result, lh_result, rh_result):
+    # the current implementation: one slice assignment per result
+    landmarks[frame] = landmarks_to_array(pose_result)
+    lh_marks[frame] = landmarks_to_array(lh_result)
+    rh_marks[frame] = landmarks_to_array(rh_result)
+
+
+def time_per_frame(copy_function, results):
+    landmarks = np.full((n_frames, 33, 3), np.nan)
+    lh_marks = np.full((n_frames, 21, 3), np.nan)
+    rh_marks = np.full((n_frames, 21, 3), np.nan)
+
+    def run():
+        for frame, (pose_result, lh_result, rh_result) in enumerate(results):
+            copy_function(landmarks, lh_marks, rh_marks, frame, pose_result, lh_result, rh_result)
+
+    run()  # warm-up, also used for the equality check below
+    best = min(timeit.repeat(run, number=1, repeat=n_repeats))
+    return best / n_frames, (landmarks, lh_marks, rh_marks)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    results = [(synthetic_landmark_list(33, rng), synthetic_landmark_list(21, rng), synthetic_landmark_list(21, rng))
+               for _ in range(n_frames)]
+
+    t_loop, out_loop = time_per_frame(copy_loop, results)
+    t_bulk, out_bulk = time_per_frame(copy_bulk, results)
+    for a, b in zip(out_loop, out_bulk):
+        assert np.array_equal(a, b), 'bulk conversion does not reproduce the per-landmark loop'
+
+    print(f'per-landmark loop: {t_loop * 1e6:8.1f} us/frame')
+    print(f'bulk conversion:   {t_bulk * 1e6:8.1f} us/frame')
+    print(f'speed-up:          {t_loop / t_bulk:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
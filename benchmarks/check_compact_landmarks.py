@@ -0,0 +1,136 @@
+"""
+check_compact_landmarks.py
+round-trip check of the compact landmark format (landmark_codec.py) and its effect on the landmark RDM
+
+- encodes pose/lh/rh landmarks (and pose visibility) with landmark_codec.encode_landmarks and decodes them again:
+    - the sample landmark arrays (sample_stimuli/gestures_pose, --source sample; the landmark store if present,
+      otherwise the npy arrays) or synthetic ragged landmarks (--source synthetic, see synthetic_data.py)
+- checks that
+    - the missing-data mask reproduces the NaN pattern (missing frames/hands and padding) exactly
+    - the coordinate error stays within the error bound stored in the file
+    - the crossnobis RDM of create_landmark_RDM.py (blockwise engine, all videos truncated to the shortest one) of the
+      decoded landmarks matches the RDM of the original ones within --rtol (relative to the largest dissimilarity)
+- prints file sizes (compact vs. float64 arrays), errors and RDM deviation; exits with 1 if a check fails
+
+usage:
+    python check_compact_landmarks.py --source sample
+    python check_compact_landmarks.py --source synthetic --videos 40 --frames 300 --encoding float16
+
+required conda environment: RDM_prep (on Linux office workstation)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+from synthetic_data import synthetic_landmarks
+
+script_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../RDM_prep')))
+from landmark_codec import encode_landmarks, decode_landmarks, encodings
+from landmark_channels import assemble_measurements
+from crossnobis import crossnobis_rdm, binned_cv_folds
+import create_landmark_RDM
+
+sample_dir = os.path.normpath(os.path.join(script_dir, '../sample_stimuli/gestures_pose'))
+streams = ('pose', 'lh', 'rh')
+scientific = {'float_kind': '{:.2e}'.format}  # errors of float16 are far below 0.01
+
+
+def sample_landmarks():
+    # names, fps, lengths, padded streams and visibility (None for the npy arrays) of the sample videos
+    store_dir = os.path.join(sample_dir, 'landmark_store')
+    if os.path.isdir(store_dir):
+        from landmark_store import LandmarkStore
+        store = LandmarkStore(store_dir)
+        arrays = {stream: store.padded(stream, 'pad') for stream in streams}
+        return store.names, store.fps, store.lengths, arrays, store.padded('pose_visibility', 'pad')
+    arrays = {stream: np.load(os.path.join(sample_dir, f'{stream}_landmarks.npy')) for stream in streams}
+    names = pd.read_csv(os.path.join(sample_dir, 'landmark_inputs.csv'), header=None).T.squeeze().tolist()
+    n_videos, n_frames = arrays['pose'].shape[:2]
+    return names, np.full(n_videos, create_landmark_RDM.fps), np.full(n_videos, n_frames), arrays, None
+
+
+def ragged_synthetic_landmarks(n_videos, n_frames, nan_rate, seed):
+    # synthetic landmarks with videos of different length (between half and all of n_frames; NaN padding)
+    rng = np.random.default_rng(seed)
+    arrays = dict(zip(streams, synthetic_landmarks(n_videos, n_frames, nan_rate, seed)))
+    lengths = rng.integers(n_frames // 2, n_frames + 1, size=n_videos)
+    lengths[0] = n_frames  # the longest video sets the padded length
+    for frames in arrays.values():
+        for video, length in enumerate(lengths):
+            frames[video, length:] = np.nan
+    visibility = np.where(np.isnan(arrays['pose'][..., 0]), np.nan, rng.random(arrays['pose'].shape[:3]))
+    names = [f'{video + 1:02d}_synthetic.mp4' for video in range(n_videos)]
+    return names, np.full(n_videos, 50.0), lengths, arrays, visibility
+
+
+def landmark_rdm(arrays, n_frames):
+    # crossnobis RDM (condensed) as in create_landmark_RDM.py, all videos truncated to n_frames
+    measurements = assemble_measurements(arrays, create_landmark_RDM.channel_spec, n_frames=n_frames)
+    return crossnobis_rdm(measurements, binned_cv_folds(len(measurements), n_frames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--source', choices=('sample', 'synthetic'), default='sample')
+    parser.add_argument('--encoding', choices=encodings, default='int16')
+    parser.add_argument('--videos', type=int, default=40)
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--nan-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rtol', type=float, default=1e-3, help='tolerated RDM deviation, relative to its largest value')
+    args = parser.parse_args()
+
+    if args.source == 'sample':
+        names, fps, lengths, arrays, visibility = sample_landmarks()
+    else:
+        names, fps, lengths, arrays, visibility = ragged_synthetic_landmarks(args.videos, args.frames, args.nan_rate,
+                                                                             args.seed)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'landmarks_compact.npz')
+        encode_landmarks(path, names, fps, lengths, arrays, visibility, args.encoding)
+        raw_bytes = sum(frames.nbytes for frames in arrays.values()) + (0 if visibility is None else visibility.nbytes)
+        print(f'{len(names)} videos, {int(lengths.max())} frames: float64 {raw_bytes / 1e6:.2f} MB, '
+              f'compact ({args.encoding}) {os.path.getsize(path) / 1e6:.2f} MB '
+              f'({raw_bytes / os.path.getsize(path):.1f}x smaller)')
+        landmarks = decode_landmarks(path)
+
+    decoded = {stream: landmarks.padded(stream, 'pad') for stream in streams}
+    for stream in streams:
+        original_nan, decoded_nan = np.isnan(arrays[stream]), np.isnan(decoded[stream])
+        mask_ok = np.array_equal(original_nan, decoded_nan)
+        present = ~original_nan
+        error = np.abs(decoded[stream] - arrays[stream])
+        max_error = np.array([error[..., c][present[..., c]].max(initial=0) for c in range(error.shape[-1])])
+        bound = landmarks.error_bound(stream)
+        bound_ok = bool((max_error <= bound * (1 + 1e-6) + 1e-12).all())
+        ok &= mask_ok and bound_ok
+        print(f'{stream:<5} missing mask {"ok" if mask_ok else "DIFFERENT"}, max. error (x, y, z) '
+              f'{np.array2string(max_error, formatter=scientific)} <= bound {np.array2string(bound, formatter=scientific)}: '
+              f'{"ok" if bound_ok else "EXCEEDED"}')
+    if visibility is not None:
+        error = np.nanmax(np.abs(landmarks.padded('pose_visibility', 'pad') - visibility), initial=0)
+        print(f'visibility max. error {error:.2g} <= {1 / 510:.2g}: {"ok" if error <= 1 / 510 + 1e-12 else "EXCEEDED"}')
+        ok &= error <= 1 / 510 + 1e-12
+
+    n_frames = int(lengths.min())
+    original_rdm = landmark_rdm(arrays, n_frames)
+    decoded_rdm = landmark_rdm(decoded, n_frames)
+    deviation = np.nanmax(np.abs(decoded_rdm - original_rdm)) / np.nanmax(np.abs(original_rdm))
+    rdm_ok = bool(np.array_equal(np.isnan(original_rdm), np.isnan(decoded_rdm)) and deviation <= args.rtol)
+    ok &= rdm_ok
+    print(f'crossnobis RDM ({n_frames} frames): max. deviation {deviation:.2g} of the largest dissimilarity '
+          f'(tolerance {args.rtol:g}): {"ok" if rdm_ok else "EXCEEDED"}')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
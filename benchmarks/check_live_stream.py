@@ -0,0 +1,78 @@
+"""
+check_live_stream.py
+check of the live-stream mode of estimate_pose_hands.py (live_stream.py), with a recorded video standing in for a camera
+
+- replays a sample gesture video at real-time pace (--speed 1; ReplaySource) through LiveStream with the model
+  settings of estimate_pose_hands.py, appending the landmarks to a temporary landmark store
+- checks that
+    - the stream emits its frames in order of capture, and every frame is either processed or dropped
+    - the store holds one frame per captured frame: the landmarks of the processed frames, NaN for the dropped ones
+- prints the end-to-end latency percentiles (capture to emission), the share of frames within the latency budget, the
+  dropped frames (queue full / over budget) and the time per stage
+
+usage (in the mediapipe conda environment):
+    python check_live_stream.py
+    python check_live_stream.py --video 02_anstreichen.mp4 --budget-ms 60 --max-pending 1 --model-complexity 0
+
+required conda environment: mediapipe (see mediapipe_estimate_pose_hands/environment.yml)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+# make the helpers in mediapipe_estimate_pose_hands importable
+script_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+from backends import SolutionsBackend
+from landmark_store import LandmarkStoreWriter, LandmarkStore
+from live_stream import LiveStream, ReplaySource
+from estimate_pose_hands import pose_settings, hands_settings, mediapipe_indir, live_latency_budget_ms, live_max_pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description='live-stream mode on a video replayed at real-time pace')
+    parser.add_argument('--video', default='01_anschnallen.mp4', help='video in sample_stimuli/gestures')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (1: real time)')
+    parser.add_argument('--budget-ms', type=float, default=live_latency_budget_ms, help='latency budget in ms')
+    parser.add_argument('--max-pending', type=int, default=live_max_pending, help='frames waiting for inference')
+    parser.add_argument('--model-complexity', type=int, choices=(0, 1, 2), default=pose_settings['model_complexity'])
+    args = parser.parse_args()
+
+    backend = SolutionsBackend(dict(pose_settings, model_complexity=args.model_complexity), hands_settings)
+    source = ReplaySource(os.path.join(mediapipe_indir, args.video), args.speed)
+    with tempfile.TemporaryDirectory() as store_dir:
+        with LandmarkStoreWriter(store_dir) as store:
+            stream = LiveStream(source, backend, args.budget_ms, args.max_pending, store, args.video)
+            frames = list(stream.frames())
+        report = stream.report()
+        stored = LandmarkStore(store_dir).video(0)
+
+        indices = [frame.index for frame in frames]
+        assert indices == sorted(set(indices)), 'frames not emitted in order of capture'
+        n_dropped = sum(report['dropped_frames'].values())
+        assert len(frames) + n_dropped == report['n_captured'], 'frames neither processed nor dropped'
+        assert len(stored['pose']) == report['n_captured'], 'store does not hold one frame per captured frame'
+        processed = np.zeros(report['n_captured'], dtype=bool)
+        processed[indices] = True
+        for stream_name in ('pose', 'lh', 'rh', 'pose_visibility'):
+            emitted = np.array([getattr(frame, stream_name) for frame in frames])
+            assert np.array_equal(stored[stream_name][processed], emitted, equal_nan=True), f'{stream_name} differs'
+            assert np.isnan(stored[stream_name][~processed]).all(), f'dropped frames of {stream_name} not empty'
+
+    print(f'{args.video} replayed at {args.speed:g}x ({report["fps"]:.0f} fps), pose model_complexity={args.model_complexity}')
+    print(f'{report["n_captured"]} frames captured, {report["n_processed"]} processed, dropped: {report["dropped_frames"]}')
+    if report['latency_ms']:
+        print('end-to-end latency (ms): ' + ', '.join(f'{key} {value:.1f}' for key, value in report['latency_ms'].items()))
+        print(f'{report["within_budget"]:.0%} of the processed frames within the budget of {args.budget_ms:g} ms')
+    print('ms per processed frame: ' + ', '.join(f'{stage} {timing["ms_per_frame"]:.1f}'
+                                                for stage, timing in report['stages'].items()))
+    print('store matches the emitted frames: OK')
+
+
+if __name__ == '__main__':
+    main()
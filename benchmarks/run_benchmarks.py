@@ -0,0 +1,278 @@
+"""
+run_benchmarks.py
+offline benchmark suite for the pipeline, on synthetic videos / landmark arrays (see synthetic_data.py)
+
+- times the following steps (select with --only):
+    - extraction:  MediaPipe pose & hand landmarking in estimate_pose_hands.py (process_video), on synthetic mp4s
+    - assembly:    combining pose/lh/rh into the (video, channel, frame) array in create_landmark_RDM.py
+    - crossnobis:  the cross-validated (crossnobis) RDM of create_landmark_RDM.py (blockwise engine, crossnobis.py);
+      crossnobis_float32 with rdm_dtype = np.float32, crossnobis_rsatoolbox with rdm_engine = 'rsatoolbox'
+    - rdm_movie:   the time-resolved RDM movie of create_landmark_RDM.py (sliding windows, see --window/--stride/--workers)
+    - cosine_rdm:  the pairwise cosine dissimilarities of get_fasttext_vectors.py
+    - cosine_rdm_condensed: the same for a large vocabulary (--words), blockwise into a condensed float32 RDM, plus the
+      top-10 nearest words of each word (cosine_rdm.py; see --workers for the number of threads)
+    - rdm_comparison: permutation test & bootstrap of compare_RDMs.py (rdm_comparison.py) between the cosine RDMs of two
+      sets of word vectors, for all comparison methods (see --permutations/--workers)
+    - dimensionality_sweep: the reduced-dimensionality comparison of get_fasttext_vectors.py (dimensionality_sweep.py):
+      streamed PCA of a synthetic input matrix (--matrix-rows x --dims) and cosine RDMs & comparisons of the word
+      vectors for all dimensionalities in steps of 5
+- sizes are set via the command line (number of videos, frames, resolution, NaN rate, words)
+- each step is run --repeats times; the best and median times are reported
+- results (parameters, host, git commit, timings) are saved as JSON to benchmarks/results/<date>_<time>.json,
+  so that runs can be compared over time (--compare an earlier results file prints the speed-up per step)
+- extraction needs the mediapipe conda environment, all others the RDM_prep environment; steps whose
+  environment is not active are skipped (and marked as such in the results)
+
+usage:
+    python run_benchmarks.py --only extraction --videos 2 --frames 50 --width 640 --height 360
+    python run_benchmarks.py --only assembly,crossnobis,cosine_rdm --videos 40 --frames 150 --nan-rate 0.1
+    python run_benchmarks.py --only rdm_movie --videos 40 --frames 300 --window 25 --stride 1 --workers 4
+    python run_benchmarks.py --only crossnobis --compare results/20240301_101500.json
+
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from synthetic_data import write_synthetic_videos, synthetic_landmarks, synthetic_word_vectors
+
+script_dir = os.path.abspath(os.path.dirname(__file__))
+results_dir = os.path.join(script_dir, 'results')
+# make the pipeline scripts importable
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../mediapipe_estimate_pose_hands')))
+sys.path.insert(0, os.path.normpath(os.path.join(script_dir, '../RDM_prep')))
+
+
+def time_repeats(function, repeats):
+    # run function repeats times; returns the result of the last run and the timings in seconds
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return result, {'best_seconds': min(seconds), 'median_seconds': float(np.median(seconds)), 'seconds': seconds}
+
+
+def bench_extraction(args):
+    import estimate_pose_hands as ep
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_paths = write_synthetic_videos(os.path.join(tmp_dir, 'gestures'), args.videos, args.frames,
+                                             args.width, args.height, args.fps, args.seed)
+        # point the script's input/output directories to the synthetic videos
+        ep.mediapipe_indir = os.path.join(tmp_dir, 'gestures')
+        ep.mediapipe_outdir = os.path.join(tmp_dir, 'gestures_pose')
+        os.makedirs(ep.mediapipe_outdir)
+        ep.write_overlay_videos = args.overlays
+        if args.model_complexity is not None:
+            ep.pose_settings = dict(ep.pose_settings, model_complexity=args.model_complexity)
+        ep.init_models()
+        videos = [os.path.basename(path) for path in video_paths]
+        reports, timing = time_repeats(lambda: [ep.process_video(video)[1] for video in videos], args.repeats)
+    n_frames = sum(report['n_frames'] for report in reports)
+    stages = {}
+    for report in reports:
+        for stage, stage_timing in report['stages'].items():
+            stages[stage] = stages.get(stage, 0.0) + stage_timing['seconds']
+    timing.update({'frames_per_second': n_frames / timing['best_seconds'],
+                   'stage_ms_per_frame': {stage: seconds / n_frames * 1e3 for stage, seconds in stages.items()},
+                   'model_complexity': ep.pose_settings['model_complexity']})
+    return timing
+
+
+def bench_assembly(args, landmarks):
+    import create_landmark_RDM
+
+    _, timing = time_repeats(lambda: create_landmark_RDM.assemble_landmarks(*landmarks), args.repeats)
+    return timing
+
+
+def bench_crossnobis(args, landmarks, engine='blockwise', dtype=np.float64):
+    import create_landmark_RDM
+
+    create_landmark_RDM.rdm_engine = engine
+    create_landmark_RDM.rdm_dtype = dtype
+    measurements = create_landmark_RDM.assemble_landmarks(*landmarks)
+    cond_names = [f'{video + 1:02d}_synthetic.mp4' for video in range(measurements.shape[0])]
+    times = np.arange(measurements.shape[2]) / args.fps
+    channel_names = create_landmark_RDM.make_channel_names()
+    _, timing = time_repeats(lambda: create_landmark_RDM.calc_landmark_rdm(measurements, cond_names, channel_names, times),
+                             args.repeats)
+    return timing
+
+
+def bench_rdm_movie(args, landmarks):
+    import create_landmark_RDM
+
+    create_landmark_RDM.movie_window = args.window
+    create_landmark_RDM.movie_stride = args.stride
+    create_landmark_RDM.movie_n_workers = args.workers
+    measurements = create_landmark_RDM.assemble_landmarks(*landmarks)
+    cond_names = [f'{video + 1:02d}_synthetic.mp4' for video in range(measurements.shape[0])]
+    times = np.arange(measurements.shape[2]) / args.fps
+    movie, timing = time_repeats(lambda: create_landmark_RDM.calc_landmark_rdm_movie(measurements, cond_names, times),
+                                 args.repeats)
+    timing['n_windows'] = movie.n_rdm
+    return timing
+
+
+def bench_cosine_rdm(args):
+    import get_fasttext_vectors
+
+    vectors = synthetic_word_vectors(args.words, args.dims, args.seed)
+    _, timing = time_repeats(lambda: get_fasttext_vectors.cosine_dissimilarities(vectors), args.repeats)
+    return timing
+
+
+def bench_cosine_rdm_condensed(args):
+    import cosine_rdm
+
+    vectors = synthetic_word_vectors(args.words, args.dims, args.seed).astype(np.float32)
+
+    def condensed_and_top_k():
+        cosine_rdm.condensed_cosine_rdm(vectors, n_threads=args.workers)
+        return cosine_rdm.top_k(vectors, 10, n_threads=args.workers)
+
+    _, timing = time_repeats(condensed_and_top_k, args.repeats)
+    return timing
+
+
+def bench_rdm_comparison(args):
+    import get_fasttext_vectors
+    import rdm_comparison
+
+    vectors1 = rdm_comparison.condensed_vector(get_fasttext_vectors.cosine_dissimilarities(
+        synthetic_word_vectors(args.words, args.dims, args.seed)))
+    vectors2 = rdm_comparison.condensed_vector(get_fasttext_vectors.cosine_dissimilarities(
+        synthetic_word_vectors(args.words, args.dims, args.seed + 1)))
+
+    def compare():
+        for method in rdm_comparison.methods:
+            rdm_comparison.permutation_test(vectors1, vectors2, method, args.permutations, args.seed, args.workers)
+            rdm_comparison.bootstrap(vectors1, vectors2, method, args.permutations, args.seed, args.workers)
+
+    _, timing = time_repeats(compare, args.repeats)
+    return timing
+
+
+def bench_dimensionality_sweep(args):
+    import dimensionality_sweep
+    import rdm_comparison
+
+    rng = np.random.default_rng(args.seed)
+    # synthetic input matrix with decaying variance over the dimensions (as an embedding's principal components)
+    matrix = (rng.standard_normal((args.matrix_rows, args.dims)) * np.linspace(1, 0.05, args.dims)).astype(np.float32)
+    vectors = synthetic_word_vectors(args.words, args.dims, args.seed)
+    dims = np.arange(5, args.dims + 1, 5)
+
+    def sweep():
+        covariance = dimensionality_sweep.streamed_covariance(matrix, None)
+        axes = dimensionality_sweep.principal_axes(covariance)
+        rdms = dimensionality_sweep.sweep_rdms(vectors, axes, dims)
+        full = rdms[-1] if dims[-1] == args.dims else dimensionality_sweep.sweep_rdms(vectors, axes, [args.dims])[0]
+        return [rdm_comparison.compare_vectors(full, rdms, method) for method in ('corr', 'rho-a')]
+
+    _, timing = time_repeats(sweep, args.repeats)
+    timing['n_dims'] = len(dims)
+    return timing
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=script_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmark suite on synthetic data')
+    parser.add_argument('--only', default='extraction,assembly,crossnobis,crossnobis_float32,crossnobis_rsatoolbox,'
+                                          'rdm_movie,cosine_rdm,cosine_rdm_condensed,rdm_comparison,dimensionality_sweep',
+                        help='comma-separated steps to run (default: all)')
+    parser.add_argument('--videos', type=int, default=3, help='number of synthetic videos (conditions)')
+    parser.add_argument('--frames', type=int, default=100, help='number of frames per video')
+    parser.add_argument('--width', type=int, default=1920, help='width of the synthetic videos')
+    parser.add_argument('--height', type=int, default=1080, help='height of the synthetic videos')
+    parser.add_argument('--fps', type=int, default=50, help='frame rate of the synthetic videos / landmark arrays')
+    parser.add_argument('--nan-rate', type=float, default=0.1, help='share of frames without landmarks, per model')
+    parser.add_argument('--window', type=int, default=25, help='frames per window for rdm_movie')
+    parser.add_argument('--stride', type=int, default=5, help='frames between windows for rdm_movie')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes for rdm_movie and rdm_comparison, threads for cosine_rdm_condensed')
+    parser.add_argument('--words', type=int, default=40, help='number of word vectors for cosine_rdm(_condensed)')
+    parser.add_argument('--dims', type=int, default=300, help='dimensionality of the word vectors for cosine_rdm')
+    parser.add_argument('--matrix-rows', type=int, default=100000,
+                        help='rows of the synthetic input matrix for dimensionality_sweep')
+    parser.add_argument('--permutations', type=int, default=10000,
+                        help='permutations and bootstrap resamples per comparison method for rdm_comparison')
+    parser.add_argument('--model-complexity', type=int, choices=(0, 1, 2),
+                        help='pose model_complexity for extraction (default: as in estimate_pose_hands.py)')
+    parser.add_argument('--overlays', action='store_true', help='also draw & encode the overlay videos in extraction')
+    parser.add_argument('--repeats', type=int, default=3, help='number of runs per step')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--output', help='results file (default: results/<date>_<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    steps = args.only.split(',')
+    landmarks = None
+    if {'assembly', 'crossnobis', 'crossnobis_float32', 'crossnobis_rsatoolbox', 'rdm_movie'} & set(steps):
+        landmarks = synthetic_landmarks(args.videos, args.frames, args.nan_rate, args.seed)
+    benchmarks = {'extraction': lambda: bench_extraction(args),
+                  'assembly': lambda: bench_assembly(args, landmarks),
+                  'crossnobis': lambda: bench_crossnobis(args, landmarks),
+                  'crossnobis_float32': lambda: bench_crossnobis(args, landmarks, dtype=np.float32),
+                  'crossnobis_rsatoolbox': lambda: bench_crossnobis(args, landmarks, engine='rsatoolbox'),
+                  'rdm_movie': lambda: bench_rdm_movie(args, landmarks),
+                  'cosine_rdm': lambda: bench_cosine_rdm(args),
+                  'cosine_rdm_condensed': lambda: bench_cosine_rdm_condensed(args),
+                  'rdm_comparison': lambda: bench_rdm_comparison(args),
+                  'dimensionality_sweep': lambda: bench_dimensionality_sweep(args)}
+    unknown = [step for step in steps if step not in benchmarks]
+    if unknown:
+        parser.error(f'unknown steps {unknown}, choose from {list(benchmarks)}')
+
+    results = {}
+    for step in steps:
+        try:
+            results[step] = benchmarks[step]()
+        except ImportError as error:
+            # the step's conda environment is not active
+            results[step] = {'skipped': str(error)}
+        summary = results[step].get('skipped') or f'{results[step]["best_seconds"] * 1e3:10.2f} ms (best of {args.repeats})'
+        print(f'{step:<22}{summary}')
+
+    run = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+           'git_commit': git_commit(),
+           'host': {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+                    'python': platform.python_version(), 'numpy': np.__version__},
+           'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+           'results': results}
+    output = args.output or os.path.join(results_dir, time.strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(run, file, indent=1)
+    print(f'results saved to {output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            earlier = json.load(file)
+        if earlier['parameters'] != run['parameters']:
+            print('NOTE: the runs differ in their parameters')
+        for step, result in results.items():
+            before = earlier['results'].get(step, {})
+            if 'best_seconds' in result and 'best_seconds' in before:
+                print(f'{step:<22}{before["best_seconds"] / result["best_seconds"]:6.2f}x speed-up vs. {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+synthetic_data.py
+synthetic inputs for the benchmarks, generated offline (no stimuli or downloads needed)
+
+- write_synthetic_videos: mp4 videos of a moving stick figure (head, torso, arms, hands) on a noisy background,
+  with the number of videos, frames, resolution and fps as parameters
+- synthetic_landmarks: pose (33), left hand (21) and right hand (21) landmark arrays of shape
+  (video, frame, landmark, coordinate), as saved by estimate_pose_hands.py, following smooth random trajectories.
+  each model misses a frame (all its landmarks NaN, as in a failed detection) with probability nan_rate
+- synthetic_word_vectors: random (word, dimension) float32 vectors, in the value range of fastText vectors
+
+used by: run_benchmarks.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import os
+import numpy as np
+
+
+def write_synthetic_videos(out_dir, n_videos=3, n_frames=100, width=1920, height=1080, fps=50, seed=0):
+    # returns the paths of the written videos
+    # OpenCV is only imported here, so that the landmark & word vector generators also work without it (RDM_prep)
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    scale = min(width, height)
+    for video in range(n_videos):
+        path = os.path.join(out_dir, f'{video + 1:02d}_synthetic.mp4')
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        background = rng.integers(90, 140, size=(height, width, 3), dtype=np.uint8)
+        phase = rng.uniform(0, 2 * np.pi, size=2)
+        for frame in range(n_frames):
+            image = background.copy()
+            t = 2 * np.pi * frame / fps
+            centre = np.array([width / 2, height / 2])
+            shoulders = [centre + [-0.12 * scale, -0.1 * scale], centre + [0.12 * scale, -0.1 * scale]]
+            for side, shoulder in enumerate(shoulders):
+                angle = np.pi / 2 + (-1) ** side * (0.6 + 0.5 * np.sin(t * 0.7 + phase[side]))
+                elbow = shoulder + 0.18 * scale * np.array([np.cos(angle), np.sin(angle)])
+                hand = elbow + 0.16 * scale * np.array([np.cos(angle - 0.8 * (-1) ** side), np.sin(angle - 0.8 * (-1) ** side)])
+                for a, b in ((shoulder, elbow), (elbow, hand)):
+                    cv2.line(image, tuple(a.astype(int)), tuple(b.astype(int)), (60, 80, 200), max(scale // 40, 2))
+                cv2.circle(image, tuple(hand.astype(int)), max(scale // 35, 3), (150, 170, 230), -1)
+            cv2.line(image, tuple(shoulders[0].astype(int)), tuple(shoulders[1].astype(int)), (60, 80, 200),
+                     max(scale // 40, 2))
+            cv2.rectangle(image, tuple((centre + [-0.1 * scale, -0.1 * scale]).astype(int)),
+                          tuple((centre + [0.1 * scale, 0.25 * scale]).astype(int)), (60, 80, 200), -1)
+            cv2.circle(image, tuple((centre + [0, -0.2 * scale]).astype(int)), max(scale // 12, 4), (150, 170, 230), -1)
+            out.write(image)
+        out.release()
+        paths.append(path)
+    return paths
+
+
+def _trajectories(rng, n_videos, n_frames, n_landmarks):
+    # smooth random walks of normalized x, y (in [0, 1]) and z coordinates around a random rest position
+    rest = rng.uniform(0.2, 0.8, size=(n_videos, 1, n_landmarks, 3))
+    steps = rng.normal(0, 0.004, size=(n_videos, n_frames, n_landmarks, 3))
+    return rest + np.cumsum(steps, axis=1)
+
+
+def synthetic_landmarks(n_videos=40, n_frames=150, nan_rate=0.1, seed=0):
+    # returns pose (video, frame, 33, 3), lh (video, frame, 21, 3), rh (video, frame, 21, 3)
+    rng = np.random.default_rng(seed)
+    arrays = []
+    for n_landmarks in (33, 21, 21):
+        landmarks = _trajectories(rng, n_videos, n_frames, n_landmarks)
+        missing = rng.random((n_videos, n_frames)) < nan_rate
+        landmarks[missing] = np.nan
+        arrays.append(landmarks)
+    return tuple(arrays)
+
+
+def synthetic_word_vectors(n_words=40, n_dims=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 0.05, size=(n_words, n_dims)).astype(np.float32)
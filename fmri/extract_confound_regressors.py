@@ -0,0 +1,165 @@
+"""
+extract_confound_regressors.py
+Python version of matlab_helpers/extractConfoundRegressors.m, for all subjects, sessions and runs at once
+
+- finds all fmriprep confound files (derivatives/fmriprep/sub-*/[ses-*/]func/*_desc-confounds_timeseries.tsv),
+  optionally filtered by subject, session and task
+- for each run, selects the 6 motion parameters and the global signal, as extractConfoundRegressors.m does:
+  all columns containing 'trans_' or 'rot_' but neither '1' nor '2' (i.e. not their derivatives & powers), in the
+  order of the file, then global_signal
+- reads only these columns (the header first, then the selected columns via pandas' usecols)
+- saves them as SPM 'multiple regressors' file (R: volumes x regressors, names: cell array of the column names) to
+  derivatives/<pipeline>/sub-<sub>/ses-<ses>/func/sub-<sub>_ses-<ses>_task-<task>_run-<run>_desc-spmRegressors_timeseries.mat
+  (run as two digits, as in extractConfoundRegressors.m; runs without run entity are numbered in file order)
+- runs are processed concurrently in a thread pool (n_workers); runs whose output is newer than their confound file
+  are skipped (--force to re-extract), so re-running over a growing derivatives tree only processes new runs
+
+usage (in any environment with numpy, pandas & scipy, e.g. RDM_prep):
+    python extract_confound_regressors.py /path/to/BIDS --pipeline SPM_LSS --sub pilot01 --ses 02 --task english
+    python extract_confound_regressors.py /path/to/BIDS --workers 8
+
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import re
+import numpy as np
+import pandas as pd
+import scipy.io
+
+### SETTINGS
+pipeline = 'SPM_LSS'  # derivatives folder to write to (as in FLB_1stlevel_GLM.m: 'SPM_LSS' or 'SPM_univariate')
+modality = 'func'
+n_workers = 4  # number of threads (runs processed concurrently)
+motion_patterns = ('trans_', 'rot_')
+excluded_characters = ('1', '2')  # derivatives (..._derivative1) and powers (..._power2) of the motion parameters
+global_signal = 'global_signal'
+
+confounds_suffix = '_desc-confounds_timeseries.tsv'
+entity_pattern = re.compile(r'(sub|ses|task|run)-([a-zA-Z0-9]+)')
+
+
+def find_confound_files(bids_dir, subjects=None, sessions=None, tasks=None):
+    # fmriprep confound files, sorted, as (entities, path); entities: dict of sub, ses, task, run (if present)
+    fmriprep_dir = os.path.join(bids_dir, 'derivatives', 'fmriprep')
+    paths = glob.glob(os.path.join(fmriprep_dir, 'sub-*', 'ses-*', modality, '*' + confounds_suffix)) + \
+        glob.glob(os.path.join(fmriprep_dir, 'sub-*', modality, '*' + confounds_suffix))
+    files = []
+    for path in sorted(paths):
+        entities = dict(entity_pattern.findall(os.path.basename(path)))
+        if subjects and entities.get('sub') not in subjects:
+            continue
+        if sessions and entities.get('ses') not in sessions:
+            continue
+        if tasks and entities.get('task') not in tasks:
+            continue
+        files.append((entities, path))
+    return files
+
+
+def regressor_filename(entities):
+    # BIDS filename of the SPM regressors (entity order as bids.File in extractConfoundRegressors.m)
+    parts = [f'sub-{entities["sub"]}']
+    if 'ses' in entities:
+        parts.append(f'ses-{entities["ses"]}')
+    if 'task' in entities:
+        parts.append(f'task-{entities["task"]}')
+    parts.append(f'run-{int(entities["run"]):02d}')
+    return '_'.join(parts) + '_desc-spmRegressors_timeseries.mat'
+
+
+def plan_runs(bids_dir, files, pipeline_name=pipeline):
+    # (confound file, output file) of each run; runs without run entity are numbered in file order per
+    # subject/session/task (as the run loop of extractConfoundRegressors.m)
+    counts = {}
+    runs = []
+    for entities, path in files:
+        group = (entities.get('sub'), entities.get('ses'), entities.get('task'))
+        counts[group] = counts.get(group, 0) + 1
+        entities = dict(entities, run=entities.get('run', counts[group]))
+        out_dir = os.path.join(bids_dir, 'derivatives', pipeline_name, f'sub-{entities["sub"]}',
+                               *([f'ses-{entities["ses"]}'] if 'ses' in entities else []), modality)
+        runs.append((path, os.path.join(out_dir, regressor_filename(entities))))
+    return runs
+
+
+def select_columns(columns):
+    # motion parameters (in file order), then the global signal
+    selected = [column for column in columns
+                if any(pattern in column for pattern in motion_patterns)
+                and not any(character in column for character in excluded_characters)]
+    if global_signal not in columns:
+        raise ValueError(f'no {global_signal} column')
+    return selected + [global_signal]
+
+
+def read_regressors(confounds_path):
+    # selected confound columns of one run: (volumes x regressors) array & names
+    with open(confounds_path) as file:
+        columns = file.readline().rstrip('\n').split('\t')
+    names = select_columns(columns)
+    confounds = pd.read_csv(confounds_path, sep='\t', usecols=names, na_values='n/a', dtype=np.float64)
+    return confounds[names].to_numpy(), names
+
+
+def is_up_to_date(confounds_path, out_path):
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(confounds_path)
+
+
+def extract_run(confounds_path, out_path, force=False):
+    # writes the SPM regressors of one run; returns 'skipped' (up to date) or 'written'
+    if not force and is_up_to_date(confounds_path, out_path):
+        return 'skipped'
+    R, names = read_regressors(confounds_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    # write to a temporary file first, so that an interrupted run never leaves a broken (but newer) output
+    tmp_path = out_path + '.tmp.mat'
+    scipy.io.savemat(tmp_path, {'R': R, 'names': np.array(names, dtype=object)})
+    os.replace(tmp_path, out_path)
+    return 'written'
+
+
+def extract_all(bids_dir, subjects=None, sessions=None, tasks=None, pipeline_name=pipeline, workers=n_workers,
+                force=False):
+    # extract the regressors of all matching runs concurrently; returns {output file: 'written' / 'skipped' / error}
+    runs = plan_runs(bids_dir, find_confound_files(bids_dir, subjects, sessions, tasks), pipeline_name)
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as pool:
+        futures = {pool.submit(extract_run, confounds_path, out_path, force): out_path
+                   for confounds_path, out_path in runs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (OSError, ValueError) as error:
+                results[futures[future]] = f'error: {error}'
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='extract SPM motion & global signal regressors from fmriprep confounds')
+    parser.add_argument('bids_dir', help='main BIDS directory (with derivatives/fmriprep)')
+    parser.add_argument('--pipeline', default=pipeline, help='derivatives folder to write to')
+    parser.add_argument('--sub', action='append', help='subject label (repeatable; default: all)')
+    parser.add_argument('--ses', action='append', help='session label (repeatable; default: all)')
+    parser.add_argument('--task', action='append', help='task label (repeatable; default: all)')
+    parser.add_argument('--workers', type=int, default=n_workers, help='number of threads')
+    parser.add_argument('--force', action='store_true', help='also re-extract runs whose output is up to date')
+    args = parser.parse_args()
+
+    results = extract_all(args.bids_dir, args.sub, args.ses, args.task, args.pipeline, args.workers, args.force)
+    for out_path, status in sorted(results.items()):
+        if status == 'written':
+            print(f'written  {os.path.relpath(out_path, args.bids_dir)}')
+        elif status != 'skipped':
+            print(f'FAILED   {os.path.relpath(out_path, args.bids_dir)} ({status})')
+    counts = {status: sum(value == status for value in results.values()) for status in ('written', 'skipped')}
+    n_errors = len(results) - sum(counts.values())
+    print(f'{len(results)} runs: {counts["written"]} written, {counts["skipped"]} up to date, {n_errors} errors')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+remove_incomplete_fmri_runs.py
+Python version of remove_incomplete_fmri_runs.sh, for all sessions in sourcedata/ at once; run before (!) dcm2bids
+
+- finds the scan folders of all sessions (by default sourcedata/<subject>/<session>/scans, see --scans-glob) or takes
+  the given scan folders (as remove_incomplete_fmri_runs.sh)
+- in each, takes the BOLD series (folders ending in the selector, e.g. cmrr_mbep2d_bold_2.5iso) and counts their
+  elements recursively (os.scandir; files AND folders, as find -mindepth 1 in the shell script, i.e. including
+  resources/ and DICOM/, hence min_volumes = 2 + the minimum number of volumes)
+- a series with fewer elements than min_volumes is incomplete: it is removed, together with the folder right before it
+  if that is its SBRef (ends in 'SBRef'; folders are ordered by their leading scan number, e.g. 5-..._SBRef, 6-...)
+- the series of all sessions are counted concurrently (n_workers threads, for network storage)
+- verified sessions are remembered in an index (sourcedata/.incomplete_runs_index.json: per session, the
+  selector, min_volumes, the number of elements of each series and the modification times of the scan folder and of
+  each series' folders down to fingerprint_depth, i.e. including resources/DICOM/, which changes whenever DICOMs are
+  added or removed); sessions whose folders are all unchanged are not rescanned (--rescan to force)
+- without --delete, only the deletion plan is printed (dry run); with --delete, every incomplete series of the plan is
+  counted again right before deleting (counts from the index or a dry run may be outdated, e.g. if a transfer was still
+  running), series that are complete by now are kept, then the plan is printed and carried out
+
+usage (in any Python 3 environment):
+    python remove_incomplete_fmri_runs.py /path/to/BIDS/sourcedata cmrr_mbep2d_bold_2.5iso 150
+    python remove_incomplete_fmri_runs.py /path/to/BIDS/sourcedata cmrr_mbep2d_bold_2.5iso 150 --delete
+    python remove_incomplete_fmri_runs.py /path/to/BIDS/sourcedata cmrr_mbep2d_bold_2.5iso 150 --scans /path/to/BIDS/sourcedata/pilot01/26390_2/scans
+
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import re
+import shutil
+
+### SETTINGS
+scans_glob = '*/*/scans'  # scan folders of the sessions, relative to sourcedata (subject/session/scans)
+sbref_suffix = 'SBRef'
+n_workers = 8  # threads counting series concurrently
+index_filename = '.incomplete_runs_index.json'
+fingerprint_depth = 2  # folder levels below each series whose modification times are checked (resources/, resources/DICOM/)
+
+
+def natural_key(name):
+    # order folders by the numbers in their names (e.g. 9-... before 10-...)
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def count_elements(directory):
+    # number of files & folders below directory (as find "$directory" -mindepth 1 | wc -l; symlinks not followed)
+    count = 0
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                count += 1
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return count
+
+
+def list_series(scans_dir):
+    # all entries of a scan folder, in scan order
+    with os.scandir(scans_dir) as entries:
+        return sorted((entry.name for entry in entries), key=natural_key)
+
+
+def series_fingerprint(series_dir, depth=fingerprint_depth):
+    # modification times of a series folder and its subfolders down to depth levels below it (a folder's mtime
+    # changes when entries are added to or removed from it directly; only folders above depth are listed, so the
+    # DICOM files themselves are never listed here)
+    fingerprint = {}
+    stack = [(series_dir, 0)]
+    while stack:
+        directory, level = stack.pop()
+        fingerprint[os.path.relpath(directory, series_dir)] = os.stat(directory).st_mtime_ns
+        if level < depth:
+            with os.scandir(directory) as entries:
+                stack.extend((entry.path, level + 1) for entry in entries if entry.is_dir(follow_symlinks=False))
+    return fingerprint
+
+
+def session_state(scans_dir, selector):
+    # modification times of the scan folder and the folders of its BOLD series (to tell whether a session changed)
+    names = list_series(scans_dir)
+    series = [name for name in names if name.endswith(selector) and os.path.isdir(os.path.join(scans_dir, name))]
+    return names, series, {'mtime_ns': os.stat(scans_dir).st_mtime_ns,
+                           'series_fingerprints': {name: series_fingerprint(os.path.join(scans_dir, name))
+                                                   for name in series}}
+
+
+def plan_session(scans_dir, names, counts, min_volumes):
+    # folders to delete in one session: incomplete series and their preceding SBRef
+    plan = []
+    for position, name in enumerate(names):
+        if name not in counts or counts[name] >= min_volumes:
+            continue
+        if position > 0 and names[position - 1].endswith(sbref_suffix):
+            plan.append({'path': os.path.join(scans_dir, names[position - 1]), 'reason': f'SBRef of {name}'})
+        plan.append({'path': os.path.join(scans_dir, name),
+                     'reason': f'{counts[name]} elements, less than {min_volumes}'})
+    return plan
+
+
+class SessionIndex:
+    """per-session record of verified scan folders, stored as JSON in the sourcedata folder
+
+    index = SessionIndex(sourcedata_dir)
+    index.is_current(scans_dir, selector, min_volumes, state) -> True if the session need not be rescanned
+    index.update(scans_dir, selector, min_volumes, state, counts); index.save()
+    """
+
+    def __init__(self, sourcedata_dir):
+        self.sourcedata_dir = sourcedata_dir
+        self.path = os.path.join(sourcedata_dir, index_filename)
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                self.sessions = json.load(file)
+        else:
+            self.sessions = {}
+
+    def _key(self, scans_dir):
+        return os.path.relpath(os.path.abspath(scans_dir), os.path.abspath(self.sourcedata_dir))
+
+    def is_current(self, scans_dir, selector, min_volumes, state):
+        known = self.sessions.get(self._key(scans_dir))
+        return (known is not None and known['selector'] == selector and known['min_volumes'] == min_volumes
+                and known['mtime_ns'] == state['mtime_ns']
+                and known.get('series_fingerprints') == state['series_fingerprints'])
+
+    def counts(self, scans_dir):
+        return self.sessions[self._key(scans_dir)]['counts']
+
+    def update(self, scans_dir, selector, min_volumes, state, counts):
+        self.sessions[self._key(scans_dir)] = dict(state, selector=selector, min_volumes=min_volumes, counts=counts)
+
+    def forget(self, scans_dir):
+        self.sessions.pop(self._key(scans_dir), None)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(self.sessions, file, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def scan_sessions(sourcedata_dir, scans_dirs, selector, min_volumes, workers=n_workers, rescan=False):
+    # element counts of the BOLD series of all sessions, counted concurrently (unchanged sessions from the index);
+    # returns the index and {scans_dir: (names, counts)}
+    index = SessionIndex(sourcedata_dir)
+    sessions, to_count = {}, []
+    for scans_dir in scans_dirs:
+        names, series, state = session_state(scans_dir, selector)
+        if not rescan and index.is_current(scans_dir, selector, min_volumes, state):
+            sessions[scans_dir] = (names, index.counts(scans_dir))
+        else:
+            sessions[scans_dir] = (names, {})
+            to_count.append((scans_dir, series, state))
+
+    tasks = [(scans_dir, name) for scans_dir, series, _ in to_count for name in series]
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as pool:
+        counts = pool.map(lambda task: count_elements(os.path.join(*task)), tasks)
+        for (scans_dir, name), count in zip(tasks, counts):
+            sessions[scans_dir][1][name] = count
+    for scans_dir, _, state in to_count:
+        index.update(scans_dir, selector, min_volumes, state, sessions[scans_dir][1])
+    print(f'{len(scans_dirs)} sessions: {len(to_count)} scanned ({len(tasks)} series), '
+          f'{len(scans_dirs) - len(to_count)} unchanged since the last scan')
+    return index, sessions
+
+
+def recount_incomplete(sessions, min_volumes, workers=n_workers):
+    # count the incomplete series of all sessions again (in place); returns the scan folders whose counts changed
+    tasks = [(scans_dir, name) for scans_dir, (_, counts) in sessions.items()
+             for name, count in counts.items() if count < min_volumes]
+    changed = set()
+    with concurrent.futures.ThreadPoolExecutor(max(1, workers)) as pool:
+        counts = pool.map(lambda task: count_elements(os.path.join(*task)), tasks)
+        for (scans_dir, name), count in zip(tasks, counts):
+            if count != sessions[scans_dir][1][name]:
+                print(f'{os.path.join(scans_dir, name)}: now {count} elements (was {sessions[scans_dir][1][name]})')
+                sessions[scans_dir][1][name] = count
+                changed.add(scans_dir)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='remove incomplete fMRI runs (and their SBRefs) from DICOM folders')
+    parser.add_argument('sourcedata_dir', help='sourcedata folder of the BIDS directory')
+    parser.add_argument('selector', help='ending of the BOLD series folders (NOT the SBRef folders)')
+    parser.add_argument('min_volumes', type=int, help='2 + minimum number of volumes of a complete run')
+    parser.add_argument('--scans', action='append', help='scan folder(s) to check (default: all matching --scans-glob)')
+    parser.add_argument('--scans-glob', default=scans_glob, help='scan folders relative to sourcedata_dir')
+    parser.add_argument('--workers', type=int, default=n_workers, help='threads counting series concurrently')
+    parser.add_argument('--rescan', action='store_true', help='rescan sessions even if unchanged since the last scan')
+    parser.add_argument('--delete', action='store_true', help='carry out the deletion plan (default: dry run)')
+    args = parser.parse_args()
+
+    scans_dirs = args.scans or sorted(path for path in glob.glob(os.path.join(args.sourcedata_dir, args.scans_glob))
+                                      if os.path.isdir(path))
+    index, sessions = scan_sessions(args.sourcedata_dir, scans_dirs, args.selector, args.min_volumes, args.workers,
+                                    args.rescan)
+    changed = set()
+    if args.delete:
+        # never delete based on earlier counts: a series may have been completed since
+        changed = recount_incomplete(sessions, args.min_volumes, args.workers)
+    plan = [(scans_dir, step) for scans_dir, (names, counts) in sessions.items()
+            for step in plan_session(scans_dir, names, counts, args.min_volumes)]
+    if not plan:
+        print('all runs complete, nothing to delete')
+    for _, step in plan:
+        print(f'{"deleting" if args.delete else "would delete"}: {step["path"]} ({step["reason"]})')
+    if args.delete:
+        for scans_dir, step in plan:
+            shutil.rmtree(step['path'])
+            print(f'Deleted: {step["path"]}')
+        changed |= {scans_dir for scans_dir, _ in plan}
+    elif plan:
+        print('dry run: nothing deleted (use --delete to delete the folders above)')
+    # the changed sessions are rescanned next time
+    for scans_dir in changed:
+        index.forget(scans_dir)
+    index.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,8 @@ cd $BIDS_dir
 # remove incomplete fmri runs (script finds all runs with less than 150 volumes)
 "$code_dir"/remove_incomplete_fmri_runs.sh "$source_dir1" "cmrr_mbep2d_bold_2.5iso" 150  # change to 168!
 "$code_dir"/remove_incomplete_fmri_runs.sh "$source_dir2" "cmrr_mbep2d_bold_2.5iso" 150  # change to 168!
+# or, for all sessions in sourcedata/ (dry run first, then with --delete):
+# python "$code_dir"/remove_incomplete_fmri_runs.py "$BIDS_dir/sourcedata" "cmrr_mbep2d_bold_2.5iso" 150 --delete
 
 
 # to-do: make this loop (at least within participant across sessions)
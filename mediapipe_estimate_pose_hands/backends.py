@@ -0,0 +1,287 @@
+"""
+backends.py
+inference backends for estimate_pose_hands.py: run the pose & hand models on the frames of a video
+
+- every backend fills the same arrays per frame (NaN where nothing was detected), returned as FrameLandmarks:
+  pose (33, 3), pose_visibility (33,), lh (21, 3), rh (21, 3), together with the (RGB) image they belong to
+- common interface:
+    backend.reset(frame_width, frame_height, timers)  before each video (clean tracking state, new timestamps);
+                                                      timers (optional StageTimers, see stage_timers.py) receives
+                                                      the pose_inference, hand_inference and landmark_copy times
+    backend.submit(image, timestamp_ms)               -> list of FrameLandmarks that are finished (in order of submission)
+    backend.flush()                                   -> list of the remaining FrameLandmarks, at the end of each video
+    backend.report()                                  -> dict with additional per-video results (e.g. hand_roi comparison)
+- 'solutions' (default): legacy mp.solutions Pose & Hands, one blocking call per frame and model. also supports
+  ROI-guided hand landmarking (see hand_roi.py)
+- 'tasks': MediaPipe Tasks PoseLandmarker & HandLandmarker, which need the *.task model files in task_model_dir
+  (see README.md). two running modes:
+    'video':       detect_for_video with the frame's timestamp, blocking (same tracking behaviour as 'solutions')
+    'live_stream': detect_async; frames are submitted without waiting for their results, which arrive via result
+                   callbacks and are handed back in order. frames the landmarker drops while it is busy are returned
+                   without landmarks (and counted in the report)
+
+used by: estimate_pose_hands.py, benchmarks/bench_backends.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import collections
+import os
+import threading
+import time
+import mediapipe as mp
+import numpy as np
+
+from landmark_arrays import landmarks_to_array
+from hand_roi import hand_roi, RoiHandTracker, RoiComparison
+from stage_timers import StageTimers
+
+FrameLandmarks = collections.namedtuple('FrameLandmarks', ['image', 'pose', 'pose_visibility', 'lh', 'rh'])
+
+# model files of the Tasks backend: pose landmarker per model_complexity (as in pose_settings), and hand landmarker
+task_model_files = {'pose': {0: 'pose_landmarker_lite.task', 1: 'pose_landmarker_full.task', 2: 'pose_landmarker_heavy.task'},
+                    'hands': 'hand_landmarker.task'}
+
+
+def empty_frame(image):
+    # WARNING: number of landmarks (33) is hardcoded here and might be different for different models
+    return FrameLandmarks(image, np.full((33, 3), np.nan), np.full(33, np.nan),
+                          np.full((21, 3), np.nan), np.full((21, 3), np.nan))
+
+
+def assign_hands(handedness, hands, hand_idx, frame):
+    # handedness: (label, index) of each detected hand, hands: landmark list of each detected hand
+    # hand_idx ({'Left': i, 'Right': j}) is kept across the frames of a video and updated in place
+    # assumes there is one left and one right hand detected and nothing else!
+    for label, index in handedness[:2]:
+        if label in hand_idx and index >= 0:
+            hand_idx[label] = index
+    if len(hands) > hand_idx['Left']:
+        frame.lh[:] = landmarks_to_array(hands[hand_idx['Left']])
+    if len(hands) > hand_idx['Right']:
+        frame.rh[:] = landmarks_to_array(hands[hand_idx['Right']])
+
+
+def timestamp_ms(frame, fps):
+    # timestamp of a frame in ms, as required by the Tasks API (strictly increasing within a video)
+    return int(round(frame * 1000 / fps))
+
+
+class SolutionsBackend:
+    name = 'solutions'
+
+    def __init__(self, pose_settings, hands_settings, hand_roi_mode=False, hand_roi_compare=False,
+                 roi_scale=2.7, roi_min_size=64, roi_stability=0.25, roi_model_complexity=0, roi_redetect_interval=2):
+        self.pose = mp.solutions.pose.Pose(**pose_settings)
+        self.hands = None
+        self.hands_roi = None
+        self.hand_roi_mode = hand_roi_mode
+        self.roi_scale = roi_scale
+        self.roi_min_size = roi_min_size
+        self.compare = hand_roi_mode and hand_roi_compare
+        if not hand_roi_mode or hand_roi_compare:
+            self.hands = mp.solutions.hands.Hands(**hands_settings)
+        if hand_roi_mode:
+            # one (single-hand) model per side, tracking its hand through a stabilized crop (see hand_roi.py), so the
+            # palm is only detected while that hand is lost; the crops are framed around the hand, so a lighter landmark
+            # model (roi_model_complexity) suffices
+            roi_settings = dict(hands_settings, static_image_mode=False, max_num_hands=1,
+                                model_complexity=roi_model_complexity)
+            self.hands_roi = {side: RoiHandTracker(mp.solutions.hands.Hands(**roi_settings), roi_stability,
+                                                   roi_redetect_interval)
+                              for side in ('left', 'right')}
+        self.reset(0, 0)
+
+    def reset(self, frame_width, frame_height, timers=None):
+        self.timers = StageTimers() if timers is None else timers
+        self.pose.reset()
+        if self.hands is not None:
+            self.hands.reset()
+        for tracker in (self.hands_roi or {}).values():
+            tracker.reset()
+        self.hand_idx = {'Left': 0, 'Right': 1}
+        self.frame_size = (frame_width, frame_height)
+        self.comparison = RoiComparison(frame_width, frame_height) if self.compare else None
+
+    def submit(self, image, timestamp_ms):
+        frame = empty_frame(image)
+        # POSE processing
+        start = time.perf_counter()
+        results_pose = self.pose.process(image)
+        self.timers.add('pose_inference', time.perf_counter() - start)
+        # HAND processing (full frame; in hand_roi_mode only needed for the comparison)
+        if self.hands is not None:
+            start = time.perf_counter()
+            results_hands = self.hands.process(image)
+            full_frame_seconds = time.perf_counter() - start
+            self.timers.add('hand_inference', full_frame_seconds)
+
+        # store pose results (one slice assignment per frame, see landmark_arrays.py)
+        start = time.perf_counter()
+        if results_pose.pose_landmarks:
+            pose_array = landmarks_to_array(results_pose.pose_landmarks, visibility=True)
+            frame.pose[:] = pose_array[:, :3]
+            frame.pose_visibility[:] = pose_array[:, 3]
+        self.timers.add('landmark_copy', time.perf_counter() - start)
+
+        if self.hand_roi_mode:
+            # hand landmarks from crops around the pose's wrists, mapped back to full-frame coordinates
+            start = time.perf_counter()
+            roi_hands = {}
+            for side in ('left', 'right'):
+                box = hand_roi(frame.pose, frame.pose_visibility, side, *self.frame_size, self.roi_scale, self.roi_min_size)
+                if box is None:
+                    self.hands_roi[side].lose()
+                    roi_hands[side] = None
+                else:
+                    roi_hands[side] = self.hands_roi[side].process(image, box)
+            roi_seconds = time.perf_counter() - start
+            self.timers.add('hand_roi_inference', roi_seconds)
+            if roi_hands['left'] is not None:
+                frame.lh[:] = roi_hands['left']
+            if roi_hands['right'] is not None:
+                frame.rh[:] = roi_hands['right']
+            if self.comparison is not None:
+                full_frame_hands = [landmarks_to_array(hand) for hand in results_hands.multi_hand_landmarks or []]
+                self.comparison.add_frame(roi_hands, full_frame_hands, roi_seconds, full_frame_seconds)
+        else:
+            start = time.perf_counter()
+            handedness = [(hand.classification[0].label, hand.classification[0].index)
+                          for hand in results_hands.multi_handedness or []]
+            assign_hands(handedness, results_hands.multi_hand_landmarks or [], self.hand_idx, frame)
+            self.timers.add('landmark_copy', time.perf_counter() - start)
+        return [frame]
+
+    def flush(self):
+        return []
+
+    def report(self):
+        return {} if self.comparison is None else {'hand_roi': self.comparison.summary()}
+
+
+class TasksBackend:
+    name = 'tasks'
+
+    def __init__(self, pose_settings, hands_settings, task_model_dir, running_mode='video'):
+        if running_mode not in ('video', 'live_stream'):
+            raise ValueError(f"running_mode has to be 'video' or 'live_stream', got {running_mode!r}")
+        vision = mp.tasks.vision
+        self.live_stream = running_mode == 'live_stream'
+        mode = vision.RunningMode.LIVE_STREAM if self.live_stream else vision.RunningMode.VIDEO
+        model_paths = {'pose': os.path.join(task_model_dir, task_model_files['pose'][pose_settings['model_complexity']]),
+                       'hands': os.path.join(task_model_dir, task_model_files['hands'])}
+        for path in model_paths.values():
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'MediaPipe Tasks model file {path} not found (see README.md for the download)')
+        # same detection/tracking thresholds as the solutions backend
+        self.pose_options = vision.PoseLandmarkerOptions(
+            base_options=mp.tasks.BaseOptions(model_asset_path=model_paths['pose']),
+            running_mode=mode,
+            num_poses=1,
+            min_pose_detection_confidence=pose_settings['min_detection_confidence'],
+            min_tracking_confidence=pose_settings['min_tracking_confidence'],
+            output_segmentation_masks=pose_settings['enable_segmentation'],
+            result_callback=self._pose_callback if self.live_stream else None)
+        self.hands_options = vision.HandLandmarkerOptions(
+            base_options=mp.tasks.BaseOptions(model_asset_path=model_paths['hands']),
+            running_mode=mode,
+            num_hands=hands_settings['max_num_hands'],
+            min_hand_detection_confidence=hands_settings['min_detection_confidence'],
+            min_tracking_confidence=hands_settings['min_tracking_confidence'],
+            result_callback=self._hands_callback if self.live_stream else None)
+        self.pose = None
+        self.hands = None
+        self.lock = threading.Lock()
+        self.reset(0, 0)
+
+    def reset(self, frame_width, frame_height, timers=None):
+        self.timers = StageTimers() if timers is None else timers
+        # the landmarkers only accept increasing timestamps, so each video gets new ones (which also resets tracking)
+        self._close()
+        self.pose = mp.tasks.vision.PoseLandmarker.create_from_options(self.pose_options)
+        self.hands = mp.tasks.vision.HandLandmarker.create_from_options(self.hands_options)
+        self.hand_idx = {'Left': 0, 'Right': 1}
+        self.pending = collections.deque()  # (timestamp, image) of submitted frames, oldest first (live_stream)
+        self.results = {'pose': {}, 'hands': {}}  # results by timestamp, filled by the callbacks (live_stream)
+        self.last_result = {'pose': -1, 'hands': -1}  # timestamp of the latest result of each landmarker
+        self.dropped = {'pose': 0, 'hands': 0}
+
+    def submit(self, image, timestamp_ms):
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(image))
+        if self.live_stream:
+            with self.lock:
+                self.pending.append((timestamp_ms, image))
+        # in live_stream mode, only the submission is timed (inference runs in MediaPipe's own threads)
+        start = time.perf_counter()
+        results_pose = (self.pose.detect_async if self.live_stream else self.pose.detect_for_video)(mp_image, timestamp_ms)
+        self.timers.add('pose_inference', time.perf_counter() - start)
+        start = time.perf_counter()
+        results_hands = (self.hands.detect_async if self.live_stream else self.hands.detect_for_video)(mp_image, timestamp_ms)
+        self.timers.add('hand_inference', time.perf_counter() - start)
+        if self.live_stream:
+            return self._collect(final=False)
+        return [self._frame(image, results_pose, results_hands)]
+
+    def flush(self):
+        if not self.live_stream:
+            return []
+        # closing waits until the landmarkers have finished (and called back for) all frames they accepted
+        self._close()
+        return self._collect(final=True)
+
+    def report(self):
+        return {'dropped_frames': dict(self.dropped)} if self.live_stream else {}
+
+    def _pose_callback(self, result, output_image, timestamp_ms):
+        with self.lock:
+            self.results['pose'][timestamp_ms] = result
+            self.last_result['pose'] = max(self.last_result['pose'], timestamp_ms)
+
+    def _hands_callback(self, result, output_image, timestamp_ms):
+        with self.lock:
+            self.results['hands'][timestamp_ms] = result
+            self.last_result['hands'] = max(self.last_result['hands'], timestamp_ms)
+
+    def _collect(self, final):
+        # hand back the oldest pending frames as long as both landmarkers are done with them. a frame is done when its
+        # result arrived, or when a later frame's result arrived (results come in order, so it was dropped);
+        # after flush (final=True), every frame without a result was dropped
+        start = time.perf_counter()
+        finished = []
+        with self.lock:
+            while self.pending:
+                timestamp, image = self.pending[0]
+                done = {kind: timestamp in self.results[kind] or timestamp < self.last_result[kind] or final
+                        for kind in self.results}
+                if not all(done.values()):
+                    break
+                self.pending.popleft()
+                results = {}
+                for kind in self.results:
+                    results[kind] = self.results[kind].pop(timestamp, None)
+                    self.dropped[kind] += results[kind] is None
+                finished.append((image, results['pose'], results['hands']))
+        frames = [self._frame(image, pose, hands) for image, pose, hands in finished]
+        self.timers.add('landmark_copy', time.perf_counter() - start)
+        return frames
+
+    def _frame(self, image, results_pose, results_hands):
+        start = time.perf_counter()
+        frame = empty_frame(image)
+        if results_pose is not None and results_pose.pose_landmarks:
+            pose_array = landmarks_to_array(results_pose.pose_landmarks[0], visibility=True)
+            frame.pose[:] = pose_array[:, :3]
+            frame.pose_visibility[:] = pose_array[:, 3]
+        if results_hands is not None:
+            handedness = [(hand[0].category_name, hand[0].index) for hand in results_hands.handedness]
+            assign_hands(handedness, results_hands.hand_landmarks, self.hand_idx, frame)
+        if not self.live_stream:
+            self.timers.add('landmark_copy', time.perf_counter() - start)
+        return frame
+
+    def _close(self):
+        for landmarker in (self.pose, self.hands):
+            if landmarker is not None:
+                landmarker.close()
+        self.pose = None
+        self.hands = None
@@ -7,8 +7,25 @@ script to obtain pose & hand landmark vectors from video via Google's MediaPipe
     - apply pose model
     - apply left & right hand models
     - remove vectors irrelevant to current study (mainly the not-shown legs)
-    - save npy array of each model over time (i.e. frames)
-    - save video with vectors overlaid to mediapipe_outdir
+    - append the landmarks of each model over time (i.e. frames) to a ragged landmark store (see landmark_store.py),
+      frame by frame; videos can have any number of frames
+    - save npy array of each model over time (i.e. frames), cut to the shortest video
+    - save a compact copy of all landmarks (landmarks_compact.npz: int16/float16 coordinates, bit mask of missing
+      frames & hands, uint8 visibility; see landmark_codec.py), unless write_compact_landmarks = False
+    - save video with vectors overlaid to mediapipe_outdir (unless write_overlay_videos = False; overlays can also be
+      re-created later from the landmark store via render_overlays.py)
+- videos can be processed in parallel (see n_workers below): each worker process gets its own
+  Pose/Hands instances and a share of the videos; results are merged back in the order of landmark_inputs.csv
+- videos that were processed before with the same settings are served from a content-addressed cache (see
+  landmark_cache.py), so only new or modified videos go through MediaPipe
+- within each video, decoding, inference and drawing/encoding run as a threaded pipeline (see frame_pipeline.py);
+  runs headless unless display = True
+- the models are run through an inference backend (see backends.py): the legacy mp.solutions API (default) or the
+  MediaPipe Tasks API (inference_backend = 'tasks'), both yielding the same landmark arrays
+- live-stream mode (live_source, see live_stream.py): instead of the videos in mediapipe_indir, process a camera or a
+  video file that is still being recorded as the frames arrive, under a latency budget (frames that cannot be processed
+  in time are dropped, oldest first); the landmarks are appended to live_landmark_store as they are produced, and the
+  end-to-end latencies are written to live_report.json
 
 required conda environment: mediapipe (on Linux office workstation)
 current version: 2024-03
@@ -21,6 +38,19 @@ import cv2
 import mediapipe as mp
 import numpy as np
 import csv
+import multiprocessing
+import platform
+import json
+import time
+
+from landmark_store import LandmarkStoreWriter, LandmarkBuffer, LandmarkStore
+from frame_pipeline import run_staged
+from render_overlays import draw_landmark_overlay
+from landmark_cache import LandmarkCache
+from landmark_codec import encode_landmarks
+from backends import SolutionsBackend, TasksBackend, timestamp_ms
+from stage_timers import StageTimers, profile_video
+from live_stream import LiveStream, open_source
 
 # relevant description of the results_pose format:
 # https://developers.google.com/mediapipe/solutions/vision/pose_landmarker/python#handle_and_display_results
@@ -28,6 +58,74 @@ import csv
 # WARNING: At the very bottom of this script, several landmark locations (everything below the hips) get REMOVED!
 # this is because for these specific videos, they are not displayed in the videos. Change this as desired!
 
+### SETTINGS
+# number of worker processes used to process the videos. 1 processes all videos one after another in this process;
+# >1 distributes the videos across a process pool (each worker holds its own Pose & Hands models, so expect
+# roughly (n_workers x model memory) of RAM). the output is identical to a serial run either way.
+n_workers = 1
+# within each video, decoding, model inference, and drawing & encoding of the overlay video run as separate threads,
+# connected by queues holding at most queue_size frames. set threaded_pipeline = False to run them one after another.
+threaded_pipeline = True
+queue_size = 8
+# show the annotated video while processing ('q' skips to the next video). False runs fully headless,
+# i.e. without any GUI event polling (cv2.waitKey) at all
+display = False
+# draw the landmarks onto the videos and save them to mediapipe_outdir. False only extracts the landmarks (faster);
+# the overlay videos can then be rendered later, e.g. for selected videos only, via render_overlays.py
+write_overlay_videos = True
+# serve videos that were processed before (same video content, same model settings & MediaPipe version) from the
+# landmark cache instead of running MediaPipe again. NOTE: overlay videos are only written for videos that are
+# actually processed; use render_overlays.py for the others. manage the cache via landmark_cache.py
+use_cache = True
+# ROI-guided hand landmarking: instead of searching the full frame for hands, crop a region of interest around each
+# wrist found by the pose model (landmarks 15-22) and run the hand model on these crops only. left/right are then
+# taken from the pose side (lh = around the pose's left wrist), rather than from the hand model's handedness
+hand_roi_mode = False
+roi_scale = 2.7  # side length of each (square) ROI, relative to the wrist-to-knuckles distance
+roi_min_size = 64  # minimum side length of each ROI in pixels
+# each hand is tracked through its ROI (palm detection only while it is lost, and then only every
+# roi_redetect_interval frames); the ROI is only moved once the wrist has moved by more than roi_stability x the ROI
+# size (or the size changed by more than that). the ROIs are framed around the hands, so the hand landmark model can be
+# lighter than for the full frame (roi_model_complexity 0 = lite, 1 = full)
+roi_stability = 0.25
+roi_redetect_interval = 2
+roi_model_complexity = 0
+# only for hand_roi_mode = True: additionally run the full-frame hand model and write an accuracy & latency
+# comparison of both paths to hand_roi_comparison.json
+hand_roi_compare = False
+# inference backend (see backends.py): 'solutions' (legacy mp.solutions API) or 'tasks' (MediaPipe Tasks API, needs the
+# *.task model files in models/, see README.md). with 'tasks', tasks_running_mode 'video' processes one frame after
+# another, 'live_stream' submits frames without waiting for their results (frames dropped while busy stay empty)
+inference_backend = 'solutions'
+tasks_running_mode = 'video'
+# the time spent in each stage (decoding, color conversion, pose & hand inference, landmark copying, drawing, encoding),
+# frames/second and missing detections of each video are always written to run_report.json (next to landmark_desc.txt).
+# profile_videos = True additionally profiles the inference stage of each video with cProfile (profiles/<video>.prof)
+profile_videos = False
+# compact copy of the landmark store (see landmark_codec.py): coordinates as 'int16' (scaled to the range of the data,
+# error <= range / 131068) or 'float16' (relative error <= 2^-11), missing frames & hands as bit mask
+write_compact_landmarks = True
+compact_encoding = 'int16'
+# live-stream mode (see live_stream.py): a camera device number (e.g. 0) or the path of a video file that is still being
+# recorded; its frames are processed as they arrive, instead of the videos in mediapipe_indir. None: batch mode
+live_source = None
+live_replay = False  # replay the (finished) video file live_source at real-time pace, as if it came from a camera
+live_latency_budget_ms = 100  # frames that would be finished later than this after their capture are dropped
+live_max_pending = 2  # frames waiting for inference; when full, the oldest is dropped
+
+# MediaPipe model settings
+pose_settings = dict(static_image_mode=False,
+                     model_complexity=2,
+                     smooth_landmarks=True,
+                     enable_segmentation=False,
+                     min_detection_confidence=0.5,
+                     min_tracking_confidence=0.5)
+hands_settings = dict(static_image_mode=False,
+                      max_num_hands=2,
+                      model_complexity=1,
+                      min_detection_confidence=0.5,
+                      min_tracking_confidence=0.5)
+
 # get location of this script:
 script_path = os.path.abspath(__file__)
 script_dir = os.path.abspath(os.path.dirname(script_path))
@@ -37,44 +135,40 @@ main_dir = os.path.normpath(os.path.join(script_dir, relative_path))
 
 mediapipe_indir = os.path.join(main_dir, 'gestures')
 mediapipe_outdir = os.path.join(main_dir, 'gestures_pose')
-
-# select all files that are *.mp4 files in mediapipe_indir
-input_video_path = [f for f in sorted(os.listdir(mediapipe_indir)) if f.endswith('.mp4')]
-
-if not os.path.exists(mediapipe_outdir):
-    os.makedirs(mediapipe_outdir)
-
-# Initialize MediaPipe Pose.
-mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(static_image_mode=False,
-                    model_complexity=2,
-                    smooth_landmarks=True,
-                    enable_segmentation=False,
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5)
-
-# Initialize MediaPipe Hands
-mp_hands = mp.solutions.hands
-hands = mp_hands.Hands(static_image_mode=False,
-                       max_num_hands=2,
-                       model_complexity=1,
-                       min_detection_confidence=0.5,
-                       min_tracking_confidence=0.5)
-
-# Initialize MediaPipe drawing module for annotations.
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
-
-# Define landmark ndarray to store result. Dimensions is (videoid, frame, landmark, coordinate-dimensions (x,y,z))
-# WARNING: max. number of frames (150) is hard-coded here and might be different for each video!
-# WARNING: number of landmarks (33) is hardcoded here and might be different for different models
-landmarks = np.full((len(input_video_path), 200, 33, 3), np.nan)
-lh_marks = np.full((len(input_video_path), 200, 21, 3), np.nan) # same structure as landmarks
-rh_marks = np.full((len(input_video_path), 200, 21, 3), np.nan) # same structure as landmarks
-cntr_frame = np.zeros(len(input_video_path), dtype=int)
-
-# loop over videos
-for cntr_video, video in enumerate(input_video_path):
+landmark_store_dir = os.path.join(mediapipe_outdir, 'landmark_store')
+landmark_cache_dir = os.path.join(mediapipe_outdir, 'landmark_cache')
+live_store_dir = os.path.join(mediapipe_outdir, 'live_landmark_store')  # separate from the stimulus videos' store
+profile_dir = os.path.join(mediapipe_outdir, 'profiles')
+
+task_model_dir = os.path.join(script_dir, 'models')  # *.task model files of the Tasks backend
+
+# inference backend of the current process; created by init_models()
+backend = None
+
+
+def init_models():
+    # Initialize the inference backend (MediaPipe Pose & Hands) for the current process.
+    # used directly for serial runs and as the initializer of each worker in the process pool
+    global backend
+    if inference_backend == 'solutions':
+        backend = SolutionsBackend(pose_settings, hands_settings, hand_roi_mode, hand_roi_compare, roi_scale, roi_min_size,
+                                   roi_stability, roi_model_complexity, roi_redetect_interval)
+    elif inference_backend == 'tasks':
+        if hand_roi_mode:
+            raise ValueError('hand_roi_mode is only available with the solutions backend')
+        backend = TasksBackend(pose_settings, hands_settings, task_model_dir, tasks_running_mode)
+    else:
+        raise ValueError(f"inference_backend has to be 'solutions' or 'tasks', got {inference_backend!r}")
+
+
+def process_video(video, store=None):
+    # apply pose & hand models to each frame of one video, write the annotated video to mediapipe_outdir
+    # the landmarks of each frame are appended to store (a LandmarkStoreWriter) as they arrive; without a store
+    # (i.e. in a worker process), they are collected in a LandmarkBuffer, which is returned to the main process
+    # the work is split into 3 stages (see frame_pipeline.py): decoding, model inference, drawing & encoding
+    # returns (LandmarkBuffer or None, report), report being a dict with the per-video timings, missing detections
+    # and additional results of the backend
+    sink = LandmarkBuffer() if store is None else store
     video_path = os.path.join(mediapipe_indir, video)
     # add '_pose' to video (before '.mp4'!) for output
     idx = video.find('.') # only look for '.' to work with other file types
@@ -82,6 +176,11 @@ for cntr_video, video in enumerate(input_video_path):
         video = video[:idx] + '_pose' + video[idx:]
     output_video_path = os.path.join(mediapipe_outdir, video)
 
+    report = {'video': os.path.basename(video_path)}
+    timers = StageTimers()
+    # number of frames, frames without a pose, and frames with fewer than two hands
+    counts = {'frames': 0, 'no_pose': 0, 'fewer_than_two_hands': 0}
+
     # Open the local video file.
     cap = cv2.VideoCapture(video_path)
 
@@ -91,134 +190,317 @@ for cntr_video, video in enumerate(input_video_path):
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
+    # start every video from a clean tracking state, so that results do not depend on which video was processed
+    # before (in the same process) and serial & parallel runs give identical output
+    backend.reset(frame_width, frame_height, timers)
+
     # Define the codec and create VideoWriter object to save the output video.
-    out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
-
-    cntr_frame[cntr_video] = -1
-    while cap.isOpened():
-        success, image = cap.read()
-        if not success:
-            break
-
-        cntr_frame[cntr_video] = cntr_frame[cntr_video] + 1
-        cntr_frame_loc = cntr_frame[cntr_video]
-        # Convert the BGR image to RGB and process it with MediaPipe Pose.
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        # POSE processing
-        results_pose = pose.process(image)
-        # HAND processing
-        results_hands = hands.process(image)
-
-        # loop through landmarks in results_pose objects and store in landmarks object
-        for lm in range(len(results_pose.pose_landmarks.landmark._values)):
-            landmarks[cntr_video, cntr_frame_loc, lm, 0] = results_pose.pose_landmarks.landmark._values[lm].x
-            landmarks[cntr_video, cntr_frame_loc, lm, 1] = results_pose.pose_landmarks.landmark._values[lm].y
-            landmarks[cntr_video, cntr_frame_loc, lm, 2] = results_pose.pose_landmarks.landmark._values[lm].z
-           # landmarks[cntr_video, cntr_frame_loc, lm, 3] = results_pose.pose_landmarks.landmark._values[lm].visibility # not saving visibility for now, might re-include later
-
-        # obtain results for hand model
-        # get index for left and right hands, respectively. assumes there is one left and one right hand detected and nothing else!
-        if results_hands.multi_handedness:
-            if results_hands.multi_handedness[0].classification._values[0].label == 'Left':
-                left_hand_idx = results_hands.multi_handedness[0].classification._values[0].index
-            elif results_hands.multi_handedness[0].classification._values[0].label == 'Right':
-                right_hand_idx = results_hands.multi_handedness[0].classification._values[0].index
-            if len(results_hands.multi_handedness) > 1:
-                if results_hands.multi_handedness[1].classification._values[0].label == 'Left':
-                    left_hand_idx = results_hands.multi_handedness[1].classification._values[0].index
-                elif results_hands.multi_handedness[1].classification._values[0].label == 'Right':
-                    right_hand_idx = results_hands.multi_handedness[1].classification._values[0].index
-
-        # store left hand results
-        if results_hands.multi_hand_landmarks:
-            if len(results_hands.multi_hand_landmarks) > left_hand_idx:
-                for lm in range(len(results_hands.multi_hand_landmarks[left_hand_idx].landmark._values)):
-                    lh_marks[cntr_video, cntr_frame_loc, lm, 0] = results_hands.multi_hand_landmarks[left_hand_idx].landmark._values[lm].x
-                    lh_marks[cntr_video, cntr_frame_loc, lm, 1] = results_hands.multi_hand_landmarks[left_hand_idx].landmark._values[lm].y
-                    lh_marks[cntr_video, cntr_frame_loc, lm, 2] = results_hands.multi_hand_landmarks[left_hand_idx].landmark._values[lm].z
-            if len(results_hands.multi_hand_landmarks) > right_hand_idx:
-                for lm in range(len(results_hands.multi_hand_landmarks[right_hand_idx].landmark._values)):
-                    rh_marks[cntr_video, cntr_frame_loc, lm, 0] = results_hands.multi_hand_landmarks[right_hand_idx].landmark._values[lm].x
-                    rh_marks[cntr_video, cntr_frame_loc, lm, 1] = results_hands.multi_hand_landmarks[right_hand_idx].landmark._values[lm].y
-                    rh_marks[cntr_video, cntr_frame_loc, lm, 2] = results_hands.multi_hand_landmarks[right_hand_idx].landmark._values[lm].z
-
-        # remove hand landmarks and connections from results_pose for visualization
-        # apparently mp_drawing doesn't draw connections to out-of-frame landmarks, so just moving them out of frame [-1:1] suffices
-        landmarks_to_remove = np.arange(17, 23)
-        for lm in landmarks_to_remove:
-            results_pose.pose_landmarks.landmark._values[lm].x = -2
-            results_pose.pose_landmarks.landmark._values[lm].y = -2
-            results_pose.pose_landmarks.landmark._values[lm].z = -2
-
-        # Draw the pose annotations on the image (ideally, I would remove the hand landmarks and connections first)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        if results_pose.pose_landmarks:
-            mp_drawing.draw_landmarks(image, results_pose.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-        # Draw the hand annotations on top of the pose annotations
-        if results_hands.multi_hand_landmarks:
-            for hand_landmarks in results_hands.multi_hand_landmarks:
-                mp_drawing.draw_landmarks(
-                    image,
-                    hand_landmarks,
-                    mp_hands.HAND_CONNECTIONS,
-                    mp_drawing_styles.get_default_hand_landmarks_style(),
-                    mp_drawing_styles.get_default_hand_connections_style())
-
-        # Write the frame into the output file.
-        out.write(image)
-
-        # # Display the annotated image (optional, can be commented out).
-        # cv2.imshow('MediaPipe Pose', image)
-
-
-
-        # # Break the loop when 'q' is pressed.
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    if write_overlay_videos:
+        out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
+
+    def decode_frames():
+        # DECODING stage; yields (RGB image, timestamp in ms), then None to mark the end of the video
+        frame = 0
+        while cap.isOpened():
+            start = time.perf_counter()
+            success, image = cap.read()
+            timers.add('decode', time.perf_counter() - start)
+            if not success:
+                break
+            # Convert the BGR image to RGB for MediaPipe.
+            start = time.perf_counter()
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            timers.add('color_conversion', time.perf_counter() - start)
+            yield image, timestamp_ms(frame, fps)
+            frame += 1
+        yield None
+
+    def infer_frame(item):
+        # INFERENCE stage: submit the frame to the backend, which hands back the frames whose landmarks are finished
+        # (the frame itself; or, asynchronously, earlier ones). at the end of the video, collect the frames still in flight
+        finished = backend.flush() if item is None else backend.submit(*item)
+        # append the finished frames to the landmark store (or buffer)
+        start = time.perf_counter()
+        for result in finished:
+            sink.append_frame(pose=result.pose, lh=result.lh, rh=result.rh, pose_visibility=result.pose_visibility)
+            counts['frames'] += 1
+            counts['no_pose'] += bool(np.isnan(result.pose[0, 0]))
+            counts['fewer_than_two_hands'] += bool(np.isnan(result.lh[0, 0]) or np.isnan(result.rh[0, 0]))
+        timers.add('landmark_copy', time.perf_counter() - start)
+        return finished
+
+    def annotate_frame(finished):
+        # DRAWING & ENCODING stage; returns True to stop processing this video
+        if not write_overlay_videos and not display:
+            return False
+        for result in finished:
+            # Draw the pose annotations on the image, then the hand annotations on top of them
+            # (the finger landmarks of the pose model are left out, as they are included in greater detail in the hand model)
+            start = time.perf_counter()
+            image = cv2.cvtColor(result.image, cv2.COLOR_RGB2BGR)
+            timers.add('color_conversion', time.perf_counter() - start)
+            start = time.perf_counter()
+            draw_landmark_overlay(image, result.pose, result.lh, result.rh, result.pose_visibility)
+            timers.add('drawing', time.perf_counter() - start)
+
+            # Write the frame into the output file.
+            if write_overlay_videos:
+                start = time.perf_counter()
+                out.write(image)
+                timers.add('encoding', time.perf_counter() - start)
+
+            if display:
+                # Display the annotated image, break the loop when 'q' is pressed.
+                start = time.perf_counter()
+                cv2.imshow('MediaPipe Pose', image)
+                key = cv2.waitKey(1)
+                timers.add('display', time.perf_counter() - start)
+                if key & 0xFF == ord('q'):
+                    return True
+        return False
+
+    sink.begin_video(os.path.basename(video_path), fps)
+    # GUI calls have to stay on the main thread, so displaying the video runs all stages one after another
+    start = time.perf_counter()
+    stages = (decode_frames(), infer_frame, annotate_frame)
+    pipeline_options = dict(queue_size=queue_size, threaded=threaded_pipeline and not display)
+    if profile_videos:
+        os.makedirs(profile_dir, exist_ok=True)
+        profile_path = os.path.join(profile_dir, os.path.splitext(report['video'])[0] + '.prof')
+        profile_video(profile_path, run_staged, *stages, **pipeline_options)
+    else:
+        run_staged(*stages, **pipeline_options)
+    seconds = time.perf_counter() - start
 
     # Release resources.
     cap.release()
-    out.release()
-    cv2.destroyAllWindows()
-
-# CLEAN UP THE DATA
-# delete all rows of landmarks > min(cntr_frame)
-# this (for all videos) removes all frames that go beyond the number of frames in the SHORTEST of all input videos
-
-
-def del_excess_frames(landmarks, cntr_frame):
-    landmarks = landmarks[:,:min(cntr_frame)+1,:,:]
-    return landmarks
-
-
-landmarks = del_excess_frames(landmarks, cntr_frame)
-lh_marks = del_excess_frames(lh_marks, cntr_frame)
-rh_marks = del_excess_frames(rh_marks, cntr_frame)
-
-# SAVE THE DATA
-np.save(os.path.join(mediapipe_outdir, 'pose_landmarks.npy'), landmarks)
-np.save(os.path.join(mediapipe_outdir, 'lh_landmarks.npy'), lh_marks)
-np.save(os.path.join(mediapipe_outdir, 'rh_landmarks.npy'), rh_marks)
-with open(os.path.join(mediapipe_outdir, "landmark_inputs.csv"), "w", newline='') as file:
-    writer = csv.writer(file)
-    writer.writerow(input_video_path)
-
-# create and save txt legend describing the data output
-legend = ["description of landmark creation process for videos in this folder",
-          "both mediapipe_estimate_pose_hands Pose and Hand landmarks were created for each frame of each video and saved to 3 separate npy arrays (see below).",
-          "additionally they were drawn onto the input videos and saved to this folder for visualization purposes only.",
-          "in the visualizations, the finger landmarks were removed from the pose model (as they are included in greater detail in the hand model).",
-          "they are nevertheless still included in pose_landmarks.npy",
-          "",
-          "",
-          "landmark_inputs.csv contains a list (in order) of all videos put into mediapipe_estimate_pose_hands",
-          "pose_landmarks.npy, lh_landmarks.npy, rh_landmarks.npy are all organised in the same fashion:",
-          "(input_video, landmark, frame, landmark_position)",
-          "input_video:     each row of each ndarray corresponds to each row in landmark_inputs.csv",
-          "landmark:        each row corresponds to the 33 landmarks (pose) or 21 handmarks for the left (lh_landmarks) & right (rh_landmarks) hands",
-          "frame:           progresses through all frames of video one-by-one, with frames exceeding the number of frames in the shortest video removed from all videos",
-          "landmark_position: 3-dimensional array. x, y, z coordinates (in that order) of each landmark at each frame"]
-with open(os.path.join(mediapipe_outdir, "landmark_desc.txt"), "w") as file:
-    for string in legend:
-        file.write(f"{string}\n")
\ No newline at end of file
+    if write_overlay_videos:
+        out.release()
+    if display:
+        cv2.destroyAllWindows()
+    sink.end_video()
+
+    report.update({'n_frames': counts['frames'],
+                   'seconds': seconds,
+                   'frames_per_second': counts['frames'] / seconds if seconds else None,
+                   'missing_detections': {'no_pose': counts['no_pose'],
+                                          'fewer_than_two_hands': counts['fewer_than_two_hands']},
+                   'stages': timers.summary(counts['frames'])})
+    report.update(backend.report())
+    return (sink if store is None else None), report
+
+
+def process_videos(videos):
+    # process videos, either in this process or spread across a pool of worker processes
+    # yields (LandmarkBuffer, report) per video, in the order of videos
+    # (imap hands back the results in that order, regardless of which worker finishes first)
+    workers = min(n_workers, len(videos))
+    if workers > 1:
+        # 'spawn' so that workers start without copies of this process' threads (MediaPipe/OpenCV are not fork-safe)
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=init_models) as pool:
+            yield from pool.imap(process_video, videos)
+    elif videos:
+        init_models()
+        for video in videos:
+            yield process_video(video)
+
+
+def cache_settings():
+    # everything that affects the landmarks of a video; part of the key of each landmark cache entry
+    settings = {'pose': pose_settings, 'hands': hands_settings, 'mediapipe': mp.__version__}
+    if inference_backend != 'solutions':
+        settings['backend'] = {'name': inference_backend, 'running_mode': tasks_running_mode}
+    if hand_roi_mode:
+        settings['hand_roi'] = {'roi_scale': roi_scale, 'roi_min_size': roi_min_size, 'roi_stability': roi_stability,
+                                'roi_model_complexity': roi_model_complexity, 'roi_redetect_interval': roi_redetect_interval}
+    return settings
+
+
+def run_live():
+    # live-stream mode: landmarks of live_source as the frames arrive, appended to the live landmark store
+    # (one entry per stream); shows them if display = True ('q' ends the stream)
+    init_models()
+    source = open_source(live_source, live_replay)
+    source_name = f'camera{live_source}' if str(live_source).isdigit() else os.path.splitext(os.path.basename(live_source))[0]
+    name = f'{source_name}_{time.strftime("%Y%m%d_%H%M%S")}'
+    os.makedirs(mediapipe_outdir, exist_ok=True)
+    with LandmarkStoreWriter(live_store_dir, append=True) as store:
+        stream = LiveStream(source, backend, live_latency_budget_ms, live_max_pending, store, name)
+        print(f'live stream from {source.description} ({source.fps:.0f} fps), press Ctrl+C' +
+              (" or 'q'" if display else '') + ' to stop')
+        frames = stream.frames()
+        try:
+            for frame in frames:
+                if display:
+                    image = cv2.cvtColor(frame.image, cv2.COLOR_RGB2BGR)
+                    draw_landmark_overlay(image, frame.pose, frame.lh, frame.rh, frame.pose_visibility)
+                    cv2.imshow('MediaPipe Pose', image)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        stream.stop()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            frames.close()  # ends the stream and closes its video in the store
+    if display:
+        cv2.destroyAllWindows()
+
+    report = dict(stream.report(), name=name, created=time.strftime('%Y-%m-%d %H:%M:%S'), settings=cache_settings())
+    with open(os.path.join(mediapipe_outdir, 'live_report.json'), 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f'{report["n_processed"]} of {report["n_captured"]} frames processed, dropped: {report["dropped_frames"]}')
+    if report['latency_ms']:
+        print('end-to-end latency (ms): ' + ', '.join(f'{key} {value:.1f}' for key, value in report['latency_ms'].items()) +
+              f' ({report["within_budget"]:.0%} within {live_latency_budget_ms} ms; details in live_report.json)')
+
+
+def main():
+    if live_source is not None:
+        run_live()
+        return
+    run_start = time.perf_counter()
+    # select all files that are *.mp4 files in mediapipe_indir
+    input_video_path = [f for f in sorted(os.listdir(mediapipe_indir)) if f.endswith('.mp4')]
+
+    if not os.path.exists(mediapipe_outdir):
+        os.makedirs(mediapipe_outdir)
+
+    # loop over videos and write the landmarks to the landmark store in the order of input_video_path
+    reports = []  # additional per-video results of the videos that were processed in this run
+    if use_cache:
+        # only videos that are new or modified (or were processed with other settings) go through MediaPipe,
+        # all others are served from the cache; the landmark store is then rebuilt from the cache
+        cache = LandmarkCache(landmark_cache_dir)
+        settings = cache_settings()
+        keys = {video: cache.key(os.path.join(mediapipe_indir, video), settings) for video in input_video_path}
+        to_process = [video for video in input_video_path if keys[video] not in cache]
+        print(f'{len(input_video_path) - len(to_process)} videos served from the landmark cache, {len(to_process)} to process')
+        for buffer, report in process_videos(to_process):
+            reports.append(report)
+            cache.put(keys[buffer.name], os.path.join(mediapipe_indir, buffer.name), settings, buffer.fps, buffer.arrays())
+        with LandmarkStoreWriter(landmark_store_dir) as store:
+            for video in input_video_path:
+                fps, arrays = cache.get(keys[video])
+                store.add_video(video, fps, **arrays)
+        cache.save_manifest()
+    elif min(n_workers, len(input_video_path)) > 1:
+        with LandmarkStoreWriter(landmark_store_dir) as store:
+            for buffer, report in process_videos(input_video_path):
+                reports.append(report)
+                buffer.write_to(store)
+    else:
+        # serial run without cache: frames go straight into the landmark store
+        with LandmarkStoreWriter(landmark_store_dir) as store:
+            init_models()
+            for video in input_video_path:
+                _, report = process_video(video, store)
+                reports.append(report)
+
+    # CLEAN UP THE DATA
+    # for the npy arrays (fixed number of frames), remove all frames that go beyond the number of frames in the
+    # SHORTEST of all input videos. the landmark store keeps all frames of all videos.
+    store = LandmarkStore(landmark_store_dir)
+    landmarks = store.padded('pose', 'truncate')
+    lh_marks = store.padded('lh', 'truncate')
+    rh_marks = store.padded('rh', 'truncate')
+
+    # SAVE THE DATA
+    np.save(os.path.join(mediapipe_outdir, 'pose_landmarks.npy'), landmarks)
+    np.save(os.path.join(mediapipe_outdir, 'lh_landmarks.npy'), lh_marks)
+    np.save(os.path.join(mediapipe_outdir, 'rh_landmarks.npy'), rh_marks)
+    if write_compact_landmarks:
+        # all frames of all videos (padded to the longest video; the padding is part of the missing-frame mask)
+        bounds = encode_landmarks(os.path.join(mediapipe_outdir, 'landmarks_compact.npz'), store.names, store.fps,
+                                  store.lengths, {stream: store.padded(stream, 'pad') for stream in ('pose', 'lh', 'rh')},
+                                  store.padded('pose_visibility', 'pad'), compact_encoding)
+        print('compact landmarks written, max. coordinate error: ' +
+              ', '.join(f'{stream} {bound.max():.2g}' for stream, bound in bounds.items()))
+    with open(os.path.join(mediapipe_outdir, "landmark_inputs.csv"), "w", newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(input_video_path)
+
+    write_legend()
+    write_run_report(input_video_path, reports, time.perf_counter() - run_start)
+
+    # frames dropped by the Tasks backend in live_stream mode (their landmarks are left empty)
+    dropped = {report['video']: report['dropped_frames'] for report in reports if 'dropped_frames' in report}
+    if any(any(counts.values()) for counts in dropped.values()):
+        print(f'frames dropped by the landmarkers (left empty): {dropped}')
+
+    # accuracy & latency comparison of ROI-guided vs. full-frame hand landmarking
+    roi_reports = {report['video']: report['hand_roi'] for report in reports if 'hand_roi' in report}
+    if roi_reports:
+        with open(os.path.join(mediapipe_outdir, 'hand_roi_comparison.json'), 'w') as file:
+            json.dump(roi_reports, file, indent=1)
+
+
+def write_run_report(videos, reports, run_seconds):
+    # machine-readable report of this run (timings per stage, frames/second, missing detections), to compare runs
+    # e.g. across model settings or hardware. videos served from the landmark cache are listed without timings
+    processed = {report['video']: report for report in reports}
+    n_frames = sum(report['n_frames'] for report in reports)
+    video_seconds = sum(report['seconds'] for report in reports)
+    totals = {}
+    for report in reports:
+        for stage, timing in report['stages'].items():
+            totals[stage] = totals.get(stage, 0.0) + timing['seconds']
+    run_report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'host': {'platform': platform.platform(), 'processor': platform.processor(),
+                           'cpu_count': os.cpu_count()},
+                  'settings': dict(cache_settings(), n_workers=n_workers, threaded_pipeline=threaded_pipeline,
+                                   queue_size=queue_size, write_overlay_videos=write_overlay_videos),
+                  'run_seconds': run_seconds,
+                  'n_frames_processed': n_frames,
+                  # summed over videos; with n_workers > 1, videos overlap in time
+                  'frames_per_second': n_frames / video_seconds if video_seconds else None,
+                  'missing_detections': {kind: sum(report['missing_detections'][kind] for report in reports)
+                                         for kind in ('no_pose', 'fewer_than_two_hands')},
+                  'stage_seconds': totals,
+                  'videos': [processed.get(video, {'video': video, 'cached': True}) for video in videos]}
+    with open(os.path.join(mediapipe_outdir, 'run_report.json'), 'w') as file:
+        json.dump(run_report, file, indent=1)
+    if n_frames:
+        print(f'{n_frames} frames processed at {run_report["frames_per_second"]:.1f} frames/s '
+              f'(details in run_report.json)')
+
+
+def write_legend():
+    # create and save txt legend describing the data output
+    legend = ["description of landmark creation process for videos in this folder",
+              "both mediapipe_estimate_pose_hands Pose and Hand landmarks were created for each frame of each video and saved to 3 separate npy arrays (see below).",
+              "additionally they were drawn onto the input videos and saved to this folder for visualization purposes only (re-create them from landmark_store/ via render_overlays.py).",
+              "in the visualizations, the finger landmarks were removed from the pose model (as they are included in greater detail in the hand model).",
+              "they are nevertheless still included in pose_landmarks.npy",
+              "",
+              "",
+              "landmark_inputs.csv contains a list (in order) of all videos put into mediapipe_estimate_pose_hands",
+              "pose_landmarks.npy, lh_landmarks.npy, rh_landmarks.npy are all organised in the same fashion:",
+              "(input_video, landmark, frame, landmark_position)",
+              "input_video:     each row of each ndarray corresponds to each row in landmark_inputs.csv",
+              "landmark:        each row corresponds to the 33 landmarks (pose) or 21 handmarks for the left (lh_landmarks) & right (rh_landmarks) hands",
+              "                 (with hand_roi_mode, left/right follow the pose model's sides; otherwise the first/second hand found by the hand model)",
+              "frame:           progresses through all frames of video one-by-one, with frames exceeding the number of frames in the shortest video removed from all videos",
+              "landmark_position: 3-dimensional array. x, y, z coordinates (in that order) of each landmark at each frame",
+              "",
+              "",
+              "landmark_store/ contains the same landmarks WITHOUT removing any frames (videos can differ in length):",
+              "pose.bin, lh.bin, rh.bin: float64 frames of all videos one after another, each of shape (frame, landmark, landmark_position)",
+              "pose_visibility.bin: visibility of each pose landmark, of shape (frame, landmark)",
+              "index.json:      order, name, offset (first frame in the *.bin files), number of frames and fps of each video",
+              "read it via landmark_store.LandmarkStore (memory-mapped), e.g. LandmarkStore(path).padded('pose', 'pad')",
+              "",
+              "",
+              "landmarks_compact.npz contains the same landmarks as landmark_store/ in compact form (see landmark_codec.py):",
+              f"coordinates as {compact_encoding} (error bound per stream & coordinate stored in the file), frames without pose / left hand / right hand",
+              "and the padding beyond each video's frames as packed bit masks, pose visibility as uint8 (visibility * 255)",
+              "read it via landmark_codec.decode_landmarks(path), e.g. decode_landmarks(path).padded('pose', 'pad') (float64, NaN for missing frames)",
+              "",
+              "",
+              "run_report.json: timings of the last run, per video and processing stage (decode, color_conversion, pose_inference, hand_inference,",
+              "                 landmark_copy, drawing, encoding), frames per second, and frames without pose / with fewer than two hands"]
+    with open(os.path.join(mediapipe_outdir, "landmark_desc.txt"), "w") as file:
+        for string in legend:
+            file.write(f"{string}\n")
+
+
+if __name__ == '__main__':
+    main()
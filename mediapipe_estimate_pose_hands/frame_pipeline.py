@@ -0,0 +1,101 @@
+"""
+frame_pipeline.py
+staged decode -> process -> finish pipeline for per-frame video work
+
+- run_staged(source, process, finish) runs three stages:
+    - source:  iterable that produces the frames (e.g. decoding a video), iterated in its own thread
+    - process: function applied to each frame in the calling thread (e.g. MediaPipe inference, which keeps tracking
+      state and therefore has to see the frames one after another in a single thread)
+    - finish:  function applied to each result of process in its own thread (e.g. drawing overlays & video encoding);
+      returning True stops the pipeline early
+- stages are connected by bounded FIFO queues (queue_size), so frames stay in order and memory use stays bounded,
+  while decoding and encoding overlap with inference (OpenCV and MediaPipe release the GIL while they work)
+- an exception in any stage stops all stages and is re-raised in the calling thread
+- with threaded=False, the same stages run one after another in the calling thread (e.g. when finish needs to
+  call GUI functions such as cv2.imshow, which have to stay on the main thread)
+
+used by: estimate_pose_hands.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import queue
+import threading
+
+_done = object()  # end-of-stream marker passed through the queues
+_poll_interval = 0.1  # seconds; how often blocked stages check whether the pipeline was stopped
+
+
+def _put(q, item, stop):
+    # put item into a bounded queue, giving up once the pipeline is stopped (otherwise a stage whose consumer died
+    # would block forever on a full queue)
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_poll_interval)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def run_staged(source, process, finish, queue_size=8, threaded=True):
+    if not threaded:
+        for item in source:
+            if finish(process(item)):
+                break
+        return
+
+    frames_in = queue.Queue(maxsize=queue_size)
+    frames_out = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for item in source:
+                if not _put(frames_in, item, stop):
+                    return
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            _put(frames_in, _done, stop)
+
+    def consume():
+        while True:
+            item = frames_out.get()
+            if item is _done:
+                return
+            if stop.is_set():
+                continue  # keep draining so that the processing stage never blocks on a full queue
+            try:
+                if finish(item):
+                    stop.set()
+            except BaseException as error:
+                errors.append(error)
+                stop.set()
+
+    producer = threading.Thread(target=produce, name='pipeline-decode', daemon=True)
+    consumer = threading.Thread(target=consume, name='pipeline-finish', daemon=True)
+    producer.start()
+    consumer.start()
+    try:
+        while not stop.is_set():
+            try:
+                item = frames_in.get(timeout=_poll_interval)
+            except queue.Empty:
+                continue
+            if item is _done:
+                break
+            frames_out.put(process(item))
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+    finally:
+        # the finishing stage drains its queue until it sees the end-of-stream marker, so this put cannot block forever
+        frames_out.put(_done)
+        consumer.join()
+        stop.set()
+        producer.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,163 @@
+"""
+hand_roi.py
+hand landmarking on regions of interest (ROIs) around the wrists found by the pose model
+
+- hand_roi: square pixel box around one hand, derived from the pose model's wrist, pinky, index and thumb landmarks
+  (15-22), or None if the wrist is not visible/inside the frame
+- detect_hand_in_roi: runs a Hands model on the crop and maps the landmarks back to full-frame normalized coordinates
+- RoiHandTracker: tracks one hand through its crop from frame to frame (Hands model with static_image_mode=False and
+  max_num_hands=1): the palm is only detected while the hand is lost, otherwise only the landmark model runs, on the
+  crop. the box is stabilized (only moved once the wrist's box has shifted by more than roi_stability x its size, or
+  changed its size by more than that), so the tracked hand stays put within the crop. while a hand is lost, detection
+  is only retried every redetect_interval frames
+- left/right is taken from the pose side of the wrist the ROI is built around (pose landmark 15 = left wrist,
+  16 = right wrist), instead of from the Hands model's handedness classification
+- RoiComparison: collects per-frame differences & hand-inference latencies between the ROI path and the
+  full-frame path, for the accuracy report written by estimate_pose_hands.py (hand_roi_compare = True)
+
+used by: estimate_pose_hands.py (hand_roi_mode = True)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import numpy as np
+
+from landmark_arrays import landmarks_to_array
+
+# pose landmarks of each hand: wrist, pinky, index, thumb
+pose_hand_landmarks = {'left': (15, 17, 19, 21), 'right': (16, 18, 20, 22)}
+visibility_threshold = 0.5  # same threshold as used by mp_drawing
+
+
+def hand_roi(pose, visibility, side, image_width, image_height, roi_scale=2.7, roi_min_size=64):
+    # pose: (33, 3) normalized landmarks, visibility: (33,) or None; returns (x0, y0, x1, y1) in pixels or None
+    wrist, pinky, index, thumb = pose_hand_landmarks[side]
+    if np.isnan(pose[wrist]).any():
+        return None
+    if visibility is not None and visibility[wrist] < visibility_threshold:
+        return None
+    scale = np.array([image_width, image_height])
+    points = pose[[wrist, pinky, index, thumb], :2] * scale
+    # the hand extends from the wrist past the pinky/index landmarks; centre the box on the middle of the palm
+    knuckles = points[1:3].mean(axis=0)
+    centre = (points[0] + knuckles) / 2
+    size = max(roi_scale * np.linalg.norm(knuckles - points[0]), roi_min_size)
+    if not (0 <= centre[0] < image_width and 0 <= centre[1] < image_height):
+        return None
+    x0, y0 = np.floor(centre - size / 2).astype(int)
+    x1, y1 = np.ceil(centre + size / 2).astype(int)
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, image_width), min(y1, image_height)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    return x0, y0, x1, y1
+
+
+def detect_hand_in_roi(hands_model, image, box):
+    # run hands_model (max_num_hands=1) on the crop of image inside box;
+    # returns (21, 3) landmarks in full-frame normalized coordinates, or None if no hand was found
+    x0, y0, x1, y1 = box
+    crop = np.ascontiguousarray(image[y0:y1, x0:x1])
+    results = hands_model.process(crop)
+    if not results.multi_hand_landmarks:
+        return None
+    hand = landmarks_to_array(results.multi_hand_landmarks[0])
+    image_height, image_width = image.shape[:2]
+    crop_width, crop_height = x1 - x0, y1 - y0
+    hand[:, 0] = (x0 + hand[:, 0] * crop_width) / image_width
+    hand[:, 1] = (y0 + hand[:, 1] * crop_height) / image_height
+    # z is given in roughly the same scale as x
+    hand[:, 2] = hand[:, 2] * crop_width / image_width
+    return hand
+
+
+def stable_box(previous, box, tolerance):
+    # previous box if box is within tolerance of it (shift of the centre and change of the size, relative to the size
+    # of previous), otherwise box
+    if previous is None or box is None:
+        return box
+    previous_size = np.array([previous[2] - previous[0], previous[3] - previous[1]], dtype=float)
+    size = np.array([box[2] - box[0], box[3] - box[1]], dtype=float)
+    shift = (np.array([box[0] + box[2], box[1] + box[3]]) - np.array([previous[0] + previous[2], previous[1] + previous[3]])) / 2
+    if (np.abs(shift) <= tolerance * previous_size).all() and (np.abs(size - previous_size) <= tolerance * previous_size).all():
+        return previous
+    return box
+
+
+class RoiHandTracker:
+    """one hand, tracked through a stabilized crop around its wrist
+
+    tracker = RoiHandTracker(hands_model, roi_stability, redetect_interval)
+        (hands_model: Hands with static_image_mode=False, max_num_hands=1)
+    tracker.process(image, box) -> (21, 3) landmarks in full-frame normalized coordinates, or None
+    tracker.lose()              -> when there is no box (wrist not visible)
+    """
+
+    def __init__(self, hands_model, stability=0.25, redetect_interval=1):
+        self.hands_model = hands_model
+        self.stability = stability
+        self.redetect_interval = redetect_interval
+        self.box = None
+        self.n_lost = 0  # frames since the hand was lost
+
+    def process(self, image, box):
+        # a moved crop needs no reset: the model follows the hand within the new crop, or detects it anew if it lost it
+        self.box = stable_box(self.box, box, self.stability)
+        if self.n_lost % self.redetect_interval:
+            # lost hand, and no detection due in this frame
+            self.n_lost += 1
+            return None
+        hand = detect_hand_in_roi(self.hands_model, image, self.box)
+        self.n_lost = 0 if hand is not None else self.n_lost + 1
+        return hand
+
+    def lose(self):
+        self.box = None
+
+    def reset(self):
+        self.hands_model.reset()
+        self.box = None
+        self.n_lost = 0
+
+
+class RoiComparison:
+    """accuracy & latency of ROI-guided vs. full-frame hand landmarking for one video
+
+    for each ROI hand, the full-frame hand with the closest wrist is taken as its counterpart (the full-frame path's
+    left/right assignment is not reliable enough to compare against); differences are given in pixels
+    """
+
+    def __init__(self, image_width, image_height):
+        self.scale = np.array([image_width, image_height])
+        self.n_frames = 0
+        self.detected = {'roi': {'left': 0, 'right': 0}, 'full_frame': 0}
+        self.errors = []  # mean per-landmark distance (pixels) of each matched hand
+        self.latency = {'roi': [], 'full_frame': []}
+
+    def add_frame(self, roi_hands, full_frame_hands, roi_seconds, full_frame_seconds):
+        # roi_hands: {'left': (21, 3) or None, 'right': ...}; full_frame_hands: list of (21, 3) arrays
+        self.n_frames += 1
+        self.latency['roi'].append(roi_seconds)
+        self.latency['full_frame'].append(full_frame_seconds)
+        self.detected['full_frame'] += len(full_frame_hands)
+        for side, hand in roi_hands.items():
+            if hand is None:
+                continue
+            self.detected['roi'][side] += 1
+            if not full_frame_hands:
+                continue
+            wrist_distances = [np.linalg.norm((hand[0, :2] - other[0, :2]) * self.scale) for other in full_frame_hands]
+            match = full_frame_hands[int(np.argmin(wrist_distances))]
+            self.errors.append(float(np.linalg.norm((hand[:, :2] - match[:, :2]) * self.scale, axis=1).mean()))
+
+    def summary(self):
+        errors = np.array(self.errors)
+        return {'n_frames': self.n_frames,
+                'hands_detected': self.detected,
+                'n_matched_hands': len(errors),
+                'landmark_error_px': {'mean': float(errors.mean()) if len(errors) else None,
+                                      'median': float(np.median(errors)) if len(errors) else None,
+                                      'p95': float(np.percentile(errors, 95)) if len(errors) else None},
+                'hand_latency_ms': {path: {'mean': float(np.mean(times)) * 1e3 if times else None,
+                                           'median': float(np.median(times)) * 1e3 if times else None}
+                                    for path, times in self.latency.items()}}
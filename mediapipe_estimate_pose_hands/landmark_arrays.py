@@ -0,0 +1,30 @@
+"""
+landmark_arrays.py
+helpers to turn MediaPipe landmark results into numpy arrays in one step
+
+- landmarks_to_array: converts one pose or hand result (a NormalizedLandmarkList of the legacy mp.solutions API,
+  or a plain list of landmarks as returned by the MediaPipe Tasks API) into a (N, 3) array of x, y, z coordinates,
+  or (N, 4) if visibility is requested
+- only the public fields of the landmark messages are used (no reaching into protobuf's private _values)
+- the resulting array is meant to be written into the output buffer with a single slice assignment, e.g.
+  landmarks[frame] = landmarks_to_array(results_pose.pose_landmarks)
+
+used by: estimate_pose_hands.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import itertools
+import numpy as np
+
+
+def landmarks_to_array(landmark_list, visibility=False, dtype=np.float64):
+    # accept both NormalizedLandmarkList (has a repeated 'landmark' field) and plain sequences of landmarks
+    landmarks = getattr(landmark_list, 'landmark', landmark_list)
+    n_coords = 4 if visibility else 3
+    if visibility:
+        values = itertools.chain.from_iterable((lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks)
+    else:
+        values = itertools.chain.from_iterable((lm.x, lm.y, lm.z) for lm in landmarks)
+    # fromiter with a known count fills the array directly, without building intermediate python lists
+    return np.fromiter(values, dtype=dtype, count=len(landmarks) * n_coords).reshape(-1, n_coords)
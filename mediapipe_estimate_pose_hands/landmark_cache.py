@@ -0,0 +1,165 @@
+"""
+landmark_cache.py
+content-addressed cache for the landmarks of single videos, so that only new or modified videos go through MediaPipe
+
+- each entry holds the landmark arrays (pose, lh, rh, pose_visibility; see landmark_store.py) and fps of one video
+- the key of an entry is a hash of the video's CONTENT (sha256, so renaming or moving a video still hits the cache)
+  and of the settings that affect the landmarks (model_complexity, confidence thresholds, smooth_landmarks,
+  MediaPipe version, ...; see estimate_pose_hands.cache_settings())
+- content hashes are remembered per file (path, size, modification time), so unchanged videos are not re-read
+- manifest.json lists all entries (video name, content hash, settings, number of frames, size, creation & last use)
+
+directory layout:
+    landmark_cache/manifest.json
+    landmark_cache/<key>.npz
+
+used by: estimate_pose_hands.py (use_cache = True)
+
+command line (in the mediapipe conda environment), to inspect and evict/invalidate entries:
+    python landmark_cache.py list
+    python landmark_cache.py evict --video 02_anstreichen.mp4   # force re-processing of this video
+    python landmark_cache.py evict --stale                      # entries made with settings other than the current ones
+    python landmark_cache.py evict --missing                    # entries of videos no longer in mediapipe_indir
+    python landmark_cache.py evict --older-than 30              # entries not used in the last 30 days
+    python landmark_cache.py clear
+
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+manifest_filename = 'manifest.json'
+_hash_chunk_size = 1 << 20  # read videos in 1 MiB chunks for hashing
+
+
+def settings_hash(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+class LandmarkCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest_path = os.path.join(cache_dir, manifest_filename)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {'entries': {}, 'files': {}}
+
+    def content_hash(self, video_path):
+        # sha256 of the video file, re-used as long as path, size and modification time are unchanged
+        stat = os.stat(video_path)
+        path = os.path.abspath(video_path)
+        known = self.manifest['files'].get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        digest = hashlib.sha256()
+        with open(video_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_hash_chunk_size), b''):
+                digest.update(chunk)
+        self.manifest['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def key(self, video_path, settings):
+        return settings_hash({'video': self.content_hash(video_path), 'settings': settings})
+
+    def __contains__(self, key):
+        return key in self.manifest['entries'] and os.path.exists(self._entry_path(key))
+
+    def get(self, key):
+        # returns (fps, dict of landmark arrays) of a cached video
+        with np.load(self._entry_path(key)) as entry:
+            arrays = {name: entry[name] for name in entry.files if name != 'fps'}
+            fps = entry['fps'].item()
+        self.manifest['entries'][key]['last_used'] = time.time()
+        return fps, arrays
+
+    def put(self, key, video_path, settings, fps, arrays):
+        # write to a temporary file first, so that an interrupted run never leaves a broken entry
+        tmp_path = self._entry_path(key) + '.tmp.npz'
+        np.savez(tmp_path, fps=fps, **arrays)
+        os.replace(tmp_path, self._entry_path(key))
+        now = time.time()
+        self.manifest['entries'][key] = {'video': os.path.basename(video_path),
+                                         'content_sha256': self.content_hash(video_path),
+                                         'settings': settings,
+                                         'n_frames': int(len(next(iter(arrays.values())))) if arrays else 0,
+                                         'fps': fps,
+                                         'bytes': os.path.getsize(self._entry_path(key)),
+                                         'created': now,
+                                         'last_used': now}
+        self.save_manifest()
+
+    def evict(self, keys):
+        for key in keys:
+            self.manifest['entries'].pop(key, None)
+            if os.path.exists(self._entry_path(key)):
+                os.remove(self._entry_path(key))
+        self.save_manifest()
+
+    def save_manifest(self):
+        manifest_path = os.path.join(self.cache_dir, manifest_filename)
+        with open(manifest_path + '.tmp', 'w') as file:
+            json.dump(self.manifest, file, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+
+def main():
+    # settings and paths are those of estimate_pose_hands.py (imported here only, as they require MediaPipe)
+    from estimate_pose_hands import cache_settings, landmark_cache_dir, mediapipe_indir
+
+    parser = argparse.ArgumentParser(description='inspect and evict entries of the landmark cache')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list all cache entries')
+    evict = commands.add_parser('evict', help='remove selected cache entries')
+    evict.add_argument('--video', action='append', default=[], help='entries of this video name (repeatable)')
+    evict.add_argument('--stale', action='store_true', help='entries made with settings other than the current ones')
+    evict.add_argument('--missing', action='store_true', help='entries whose video content is no longer in mediapipe_indir')
+    evict.add_argument('--older-than', type=float, metavar='DAYS', help='entries not used within this many days')
+    commands.add_parser('clear', help='remove all cache entries')
+    args = parser.parse_args()
+
+    cache = LandmarkCache(landmark_cache_dir)
+    entries = cache.manifest['entries']
+    if args.command == 'list':
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['video']):
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+            print(f"{key[:12]}  {entry['video']:<40} {entry['n_frames']:>6} frames  {entry['bytes'] / 1e6:8.2f} MB  "
+                  f"last used {last_used}")
+        print(f'{len(entries)} entries, {sum(entry["bytes"] for entry in entries.values()) / 1e6:.2f} MB')
+        return
+
+    if args.command == 'clear':
+        to_evict = list(entries)
+    else:
+        to_evict = set()
+        to_evict.update(key for key, entry in entries.items() if entry['video'] in args.video)
+        if args.stale:
+            current = cache_settings()
+            to_evict.update(key for key, entry in entries.items() if entry['settings'] != current)
+        if args.missing:
+            present = {cache.content_hash(os.path.join(mediapipe_indir, f))
+                       for f in os.listdir(mediapipe_indir) if f.endswith('.mp4')}
+            to_evict.update(key for key, entry in entries.items() if entry['content_sha256'] not in present)
+        if args.older_than is not None:
+            cutoff = time.time() - args.older_than * 24 * 3600
+            to_evict.update(key for key, entry in entries.items() if entry['last_used'] < cutoff)
+    for key in to_evict:
+        print(f"evicting {key[:12]}  {entries[key]['video']}")
+    cache.evict(to_evict)
+    print(f'{len(to_evict)} entries evicted, {len(cache.manifest["entries"])} left')
+
+
+if __name__ == '__main__':
+    main()
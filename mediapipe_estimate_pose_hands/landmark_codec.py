@@ -0,0 +1,176 @@
+"""
+landmark_codec.py
+compact encoding of the landmark arrays (instead of float64 with NaN padding)
+
+- coordinates are stored either as scaled int16 ('int16', default) or as float16 ('float16'):
+    - int16:   per stream and coordinate (x, y, z), the range [min, max] of the data is mapped to 65535 levels;
+               error bound: half a level, i.e. (max - min) / 65534 / 2 (for MediaPipe's normalized coordinates,
+               spanning about 1-2 units, ~1e-5, far below the models' precision)
+    - float16: error bound 2^-11 relative to the value (half a float16 ulp), i.e. 2^-11 * max(|value|), at most 2^-25
+               for values close to 0 (subnormals)
+  the bound of each stream & coordinate is stored in the file, and encode_landmarks checks it on the encoded data
+- missing data is not stored as NaN but as a bit mask, packed with np.packbits (1 bit per video & frame & stream):
+  frames without pose / without left or right hand, and the padding beyond each video's number of frames
+- the pose landmarks' visibility is stored as uint8 (visibility * 255, error bound 1/510)
+- everything goes into one compressed .npz file (np.savez_compressed), about 4.8x smaller than the float64 landmark
+  store (sample gestures, int16: 0.77 MB -> 0.16 MB; 4.2x smaller than the npy arrays cut to the shortest video);
+  decode_landmarks / CompactLandmarks give back float64 arrays with NaN for missing data, like the landmark store
+  (LandmarkStore)
+
+written by: estimate_pose_hands.py (write_compact_landmarks = True)
+read by: create_landmark_RDM.py (RDM_prep, landmark_source = 'compact')
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import numpy as np
+
+format_version = 1
+encodings = ('int16', 'float16')
+coordinate_streams = ('pose', 'lh', 'rh')
+int16_levels = 65534  # number of steps between the lowest and highest int16 value used (-32767 .. 32767)
+
+
+def _encode_coordinates(frames, missing, encoding):
+    # frames: (video, frame, landmark, coordinate), missing: (video, frame)
+    # returns the encoded values, offset & scale per coordinate (int16) and the error bound per coordinate
+    present = frames[~missing]
+    n_coords = frames.shape[-1]
+    if encoding == 'int16':
+        low = np.nanmin(present.reshape(-1, n_coords), axis=0) if present.size else np.zeros(n_coords)
+        high = np.nanmax(present.reshape(-1, n_coords), axis=0) if present.size else np.zeros(n_coords)
+        scale = np.where(high > low, (high - low) / int16_levels, 1.0)
+        values = np.where(missing[..., np.newaxis, np.newaxis], 0,
+                          np.rint((np.nan_to_num(frames) - low) / scale) - int16_levels // 2).astype(np.int16)
+        bound = scale / 2
+        return values, low, scale, bound
+    elif encoding == 'float16':
+        if present.size and np.nanmax(np.abs(present)) > np.finfo(np.float16).max:
+            raise ValueError('coordinates exceed the float16 range, use the int16 encoding')
+        values = np.where(missing[..., np.newaxis, np.newaxis], 0, np.nan_to_num(frames)).astype(np.float16)
+        max_abs = np.nanmax(np.abs(present.reshape(-1, n_coords)), axis=0) if present.size else np.zeros(n_coords)
+        bound = np.maximum(2.0 ** -11 * max_abs, 2.0 ** -25)
+        return values, np.zeros(n_coords), np.ones(n_coords), bound
+    raise ValueError(f'unknown encoding {encoding!r}, use one of {encodings}')
+
+
+def _decode_coordinates(values, missing, offset, scale, encoding):
+    if encoding == 'int16':
+        frames = (values.astype(np.float64) + int16_levels // 2) * scale + offset
+    else:
+        frames = values.astype(np.float64)
+    frames[missing] = np.nan
+    return frames
+
+
+def encode_landmarks(path, names, fps, n_frames, streams, visibility=None, encoding='int16'):
+    # names, fps, n_frames: per video (e.g. LandmarkStore.names, .fps, .lengths); streams: pose/lh/rh as (video, frame, landmark, coordinate) float arrays,
+    # padded to the longest video (e.g. LandmarkStore.padded(stream, 'pad')); visibility: (video, frame, landmark)
+    # writes path (.npz) and returns the error bound of each stream (per coordinate)
+    n_frames = np.asarray(n_frames, dtype=np.int64)
+    padding = np.arange(max(n_frames, default=0))[np.newaxis, :] >= n_frames[:, np.newaxis]
+    contents = {'format_version': format_version, 'encoding': encoding, 'names': np.array(names, dtype=str),
+                'fps': np.asarray(fps, dtype=np.float64), 'n_frames': n_frames}
+    bounds = {}
+    for stream in coordinate_streams:
+        frames = np.asarray(streams[stream], dtype=np.float64)
+        if frames.shape[:2] != padding.shape:
+            raise ValueError(f'stream {stream} has shape {frames.shape}, expected (videos, frames) = {padding.shape}')
+        nan = np.isnan(frames).reshape(*frames.shape[:2], -1)
+        missing = nan.all(axis=2)
+        if (nan.any(axis=2) & ~missing).any():
+            raise ValueError(f'stream {stream} has frames with only some landmarks missing, which the frame mask cannot hold')
+        missing |= padding
+        values, offset, scale, bound = _encode_coordinates(frames, missing, encoding)
+        # check the error bound on the actual data (with a little slack for floating-point rounding)
+        error = np.abs(_decode_coordinates(values, missing, offset, scale, encoding) - frames)[~missing]
+        if error.size and (error.reshape(-1, frames.shape[-1]).max(axis=0) > bound * (1 + 1e-6) + 1e-12).any():
+            raise AssertionError(f'encoding error of stream {stream} exceeds its bound {bound}')
+        contents.update({stream: values, f'{stream}_missing': np.packbits(missing, axis=1),
+                         f'{stream}_offset': offset, f'{stream}_scale': scale, f'{stream}_error_bound': bound})
+        bounds[stream] = bound
+    if visibility is not None:
+        missing = np.unpackbits(contents['pose_missing'], axis=1, count=padding.shape[1]).astype(bool)
+        visibility = np.where(missing[..., np.newaxis], 0, np.clip(np.nan_to_num(visibility), 0, 1))
+        contents['pose_visibility'] = np.rint(visibility * 255).astype(np.uint8)
+        bounds['pose_visibility'] = np.array([1 / 510])
+    np.savez_compressed(path, **contents)
+    return bounds
+
+
+class CompactLandmarks:
+    """decoded view of a compact landmark file (see encode_landmarks), used like landmark_store.LandmarkStore
+
+    landmarks = CompactLandmarks(path)
+    landmarks.names, landmarks.lengths, landmarks.fps: per-video index
+    landmarks.padded(stream, frames): (video, frame, landmark, coordinate) float64 array, NaN for missing frames
+    landmarks.stream_videos(stream): list of the (frame, landmark, coordinate) arrays of the videos (no padding)
+    landmarks.missing(stream): (video, frame) bool mask; landmarks.error_bound(stream): per coordinate
+    streams: 'pose', 'lh', 'rh' and, if stored, 'pose_visibility'
+    """
+
+    def __init__(self, path):
+        with np.load(path) as contents:
+            self._contents = {key: contents[key] for key in contents.files}
+        if int(self._contents['format_version']) != format_version:
+            raise ValueError(f'{path} has format version {self._contents["format_version"]}, expected {format_version}')
+        self.encoding = str(self._contents['encoding'])
+        self.names = [str(name) for name in self._contents['names']]
+        self.lengths = self._contents['n_frames']
+        self.fps = self._contents['fps']
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def missing(self, stream):
+        if stream == 'pose_visibility':
+            stream = 'pose'
+        return np.unpackbits(self._contents[f'{stream}_missing'], axis=1,
+                             count=int(max(self.lengths, default=0))).astype(bool)
+
+    def error_bound(self, stream):
+        if stream == 'pose_visibility':
+            return np.array([1 / 510])
+        return self._contents[f'{stream}_error_bound']
+
+    def _decode(self, stream):
+        # all videos padded to the longest one, decoded once per stream
+        if stream not in self._decoded:
+            if stream == 'pose_visibility':
+                decoded = self._contents['pose_visibility'] / 255
+                decoded[self.missing(stream)] = np.nan
+            else:
+                decoded = _decode_coordinates(self._contents[stream], self.missing(stream),
+                                              self._contents[f'{stream}_offset'], self._contents[f'{stream}_scale'],
+                                              self.encoding)
+            self._decoded[stream] = decoded
+        return self._decoded[stream]
+
+    def aligned_length(self, frames='truncate'):
+        # as LandmarkStore.aligned_length: 'truncate' (shortest video), 'pad' (longest video) or a number of frames
+        if frames == 'truncate':
+            return int(self.lengths.min()) if len(self) else 0
+        elif frames == 'pad':
+            return int(self.lengths.max()) if len(self) else 0
+        elif isinstance(frames, (int, np.integer)):
+            return int(frames)
+        raise ValueError(f"frames has to be 'truncate', 'pad' or a number of frames, got {frames!r}")
+
+    def padded(self, stream, frames='truncate'):
+        # all videos cut or padded with NaN to the same number of frames (see aligned_length)
+        n_frames = self.aligned_length(frames)
+        decoded = self._decode(stream)
+        if n_frames <= decoded.shape[1]:
+            return decoded[:, :n_frames]
+        out = np.full((len(self), n_frames, *decoded.shape[2:]), np.nan)
+        out[:, :decoded.shape[1]] = decoded
+        return out
+
+    def stream_videos(self, stream):
+        decoded = self._decode(stream)
+        return [decoded[i, :n] for i, n in enumerate(self.lengths)]
+
+
+def decode_landmarks(path):
+    return CompactLandmarks(path)
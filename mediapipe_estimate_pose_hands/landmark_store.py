@@ -0,0 +1,236 @@
+"""
+landmark_store.py
+ragged on-disk store for per-frame landmark arrays of many videos
+
+- one contiguous frames buffer per landmark model ('stream': pose, lh, rh, pose_visibility), i.e. a raw binary file
+  of shape (total_frames, landmark, coordinate), to which the frames of each video are appended as they arrive
+- index.json holds the layout of the streams and, for each video (in order), its name, offset (first frame in the
+  frames buffers), number of frames and fps
+- videos can have any number of frames: nothing is preallocated and nothing is thrown away when writing;
+  truncation to the shortest video (or NaN-padding to the longest) is chosen when reading (see LandmarkStore.padded)
+- the index is only updated (atomically) once a video is complete, so an interrupted run leaves a consistent store;
+  frames of an unfinished video are discarded when the store is opened again for appending
+- reading is memory-mapped, so only the frames that are actually accessed are loaded from disk
+
+directory layout:
+    landmark_store/index.json
+    landmark_store/pose.bin, lh.bin, rh.bin, pose_visibility.bin
+
+written by: estimate_pose_hands.py
+read by: create_landmark_RDM.py (RDM_prep)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import json
+import os
+import numpy as np
+
+# default streams as written by estimate_pose_hands.py: (landmarks, coordinate-dimensions (x,y,z)),
+# plus the visibility of each pose landmark (landmarks,)
+default_streams = {'pose': (33, 3), 'lh': (21, 3), 'rh': (21, 3), 'pose_visibility': (33,)}
+index_filename = 'index.json'
+
+
+def _stream_path(store_dir, stream):
+    return os.path.join(store_dir, f'{stream}.bin')
+
+
+class LandmarkStoreWriter:
+    """appends the frames of one video after another to a landmark store
+
+    usage:
+        with LandmarkStoreWriter(store_dir) as store:
+            store.begin_video('01_anschnallen.mp4', fps=50)
+            for each frame: store.append_frame(pose=pose_row, lh=lh_row, rh=rh_row, pose_visibility=visibility_row)
+            store.end_video()
+
+    by default, an existing store in store_dir is replaced; with append=True, new videos are added to it
+    """
+
+    def __init__(self, store_dir, streams=None, dtype=np.float64, append=False):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        index_path = os.path.join(store_dir, index_filename)
+        if append and os.path.exists(index_path):
+            with open(index_path) as file:
+                self.index = json.load(file)
+            if streams is not None and {k: list(v) for k, v in streams.items()} != self.index['streams']:
+                raise ValueError(f'streams {streams} do not match the existing store in {store_dir}')
+        else:
+            streams = default_streams if streams is None else streams
+            self.index = {'dtype': np.dtype(dtype).str,
+                          'streams': {name: list(shape) for name, shape in streams.items()},
+                          'videos': []}
+        self.dtype = np.dtype(self.index['dtype'])
+        self.n_frames = sum(video['n_frames'] for video in self.index['videos'])
+        self.files = {}
+        for name, shape in self.index['streams'].items():
+            path = _stream_path(store_dir, name)
+            file = open(path, 'r+b' if append and os.path.exists(path) else 'w+b')
+            # drop frames beyond the index (left over from an interrupted run)
+            file.truncate(self.n_frames * int(np.prod(shape)) * self.dtype.itemsize)
+            file.seek(0, os.SEEK_END)
+            self.files[name] = file
+        self.current = None
+        self._write_index()
+
+    def begin_video(self, name, fps):
+        if self.current is not None:
+            raise RuntimeError(f'video {self.current["name"]} has not been ended yet')
+        self.current = {'name': name, 'offset': self.n_frames, 'n_frames': 0, 'fps': fps}
+
+    def append_frame(self, **rows):
+        # one row (landmark, coordinate) per stream; all streams have to be given for each frame
+        self.append_frames(**{name: row[np.newaxis] for name, row in rows.items()})
+
+    def append_frames(self, **arrays):
+        # a block of frames (frame, landmark, coordinate) per stream
+        if self.current is None:
+            raise RuntimeError('begin_video() has to be called before appending frames')
+        if arrays.keys() != self.files.keys():
+            raise ValueError(f'expected frames for streams {list(self.files)}, got {list(arrays)}')
+        n_new = None
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=self.dtype)
+            if array.shape[1:] != tuple(self.index['streams'][name]):
+                raise ValueError(f'frames of stream {name} have shape {array.shape[1:]}, '
+                                 f'expected {tuple(self.index["streams"][name])}')
+            if n_new is not None and array.shape[0] != n_new:
+                raise ValueError('all streams need the same number of frames')
+            n_new = array.shape[0]
+            self.files[name].write(array.tobytes())
+        self.current['n_frames'] += n_new
+        self.n_frames += n_new
+
+    def end_video(self):
+        for file in self.files.values():
+            file.flush()
+        self.index['videos'].append(self.current)
+        self.current = None
+        self._write_index()
+
+    def add_video(self, name, fps, **arrays):
+        # write a complete video at once, e.g. as collected by a LandmarkBuffer in a worker process
+        self.begin_video(name, fps)
+        self.append_frames(**arrays)
+        self.end_video()
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_index(self):
+        # write to a temporary file first, so that the index on disk is never half-written
+        index_path = os.path.join(self.store_dir, index_filename)
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(index_path + '.tmp', index_path)
+
+
+class LandmarkBuffer:
+    """collects the frames of one video in memory, with the same begin/append/end interface as LandmarkStoreWriter
+
+    used where frames cannot be written to the store directly (e.g. in worker processes); the collected video is
+    added to the store afterwards via write_to(store)
+    """
+
+    def __init__(self):
+        self.name = None
+        self.fps = None
+        self.frames = None
+
+    def begin_video(self, name, fps):
+        self.name = name
+        self.fps = fps
+        self.frames = {}
+
+    def append_frame(self, **rows):
+        for name, row in rows.items():
+            self.frames.setdefault(name, []).append(np.array(row))
+
+    def end_video(self):
+        pass
+
+    def arrays(self, streams=None):
+        streams = default_streams if streams is None else streams
+        return {name: np.stack(self.frames[name]) if self.frames.get(name) else np.empty((0, *streams[name]))
+                for name in streams}
+
+    def write_to(self, store):
+        store.add_video(self.name, self.fps, **self.arrays({name: tuple(shape)
+                                                             for name, shape in store.index['streams'].items()}))
+
+
+class LandmarkStore:
+    """read access to a landmark store, memory-mapped
+
+    store.names, store.offsets, store.lengths, store.fps: per-video index (in order of writing)
+    store.frames[stream]: the complete frames buffer of a stream (total_frames, landmark, coordinate)
+    store.video(i or name): dict of (frame, landmark, coordinate) arrays of one video
+    store.stream_videos(stream): list of the (frame, landmark, coordinate) arrays of all videos of one stream
+    store.padded(stream, frames): (video, frame, landmark, coordinate) array of all videos, truncated or padded
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, index_filename)) as file:
+            self.index = json.load(file)
+        self.dtype = np.dtype(self.index['dtype'])
+        videos = self.index['videos']
+        self.names = [video['name'] for video in videos]
+        self.offsets = np.array([video['offset'] for video in videos], dtype=np.int64)
+        self.lengths = np.array([video['n_frames'] for video in videos], dtype=np.int64)
+        self.fps = np.array([video['fps'] for video in videos])
+        n_frames = int(self.lengths.sum())
+        self.frames = {}
+        for name, shape in self.index['streams'].items():
+            if n_frames == 0:
+                # np.memmap cannot map empty files
+                self.frames[name] = np.empty((0, *shape), dtype=self.dtype)
+            else:
+                self.frames[name] = np.memmap(_stream_path(store_dir, name), dtype=self.dtype, mode='r',
+                                              shape=(n_frames, *shape))
+
+    def __len__(self):
+        return len(self.names)
+
+    def video(self, key):
+        i = self.names.index(key) if isinstance(key, str) else key
+        start, stop = self.offsets[i], self.offsets[i] + self.lengths[i]
+        return {name: frames[start:stop] for name, frames in self.frames.items()}
+
+    def stream_videos(self, stream):
+        # the frames of each video of one stream, as list of memory-mapped (frame, landmark, coordinate) arrays
+        return [self.frames[stream][offset:offset + length] for offset, length in zip(self.offsets, self.lengths)]
+
+    def aligned_length(self, frames='truncate'):
+        # frames: 'truncate' - cut all videos to the shortest one (as the former fixed-size npy arrays)
+        #         'pad'      - pad all videos to the longest one
+        #         int        - cut or pad all videos to exactly this many frames
+        if frames == 'truncate':
+            n_frames = int(self.lengths.min()) if len(self) else 0
+        elif frames == 'pad':
+            n_frames = int(self.lengths.max()) if len(self) else 0
+        elif isinstance(frames, (int, np.integer)):
+            n_frames = int(frames)
+        else:
+            raise ValueError(f"frames has to be 'truncate', 'pad' or a number of frames, got {frames!r}")
+        return n_frames
+
+    def padded(self, stream, frames='truncate', fill_value=np.nan):
+        # all videos cut or padded with fill_value to the same number of frames (see aligned_length)
+        n_frames = self.aligned_length(frames)
+        source = self.frames[stream]
+        out = np.full((len(self), n_frames, *source.shape[1:]), fill_value, dtype=self.dtype)
+        for i, (offset, length) in enumerate(zip(self.offsets, self.lengths)):
+            n = min(length, n_frames)
+            out[i, :n] = source[offset:offset + n]
+        return out
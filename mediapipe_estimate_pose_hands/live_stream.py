@@ -0,0 +1,316 @@
+"""
+live_stream.py
+low-latency live-stream mode of estimate_pose_hands.py: pose & hand landmarks of a camera or a growing video file, as
+the frames arrive
+
+- sources (all with .fps, .frame_size, read() -> BGR image or None at the end, interrupt(), close()):
+    - CameraSource(device):        a camera (cv2.VideoCapture device number)
+    - GrowingFileSource(path):     a video file that is still being recorded; when the end is reached, the file is
+                                   re-opened and read on from the last frame, until no new frames arrived for
+                                   idle_timeout seconds (use a container that is written progressively, e.g. .mkv/.avi)
+    - ReplaySource(path, speed):   a finished video, replayed at real-time pace (speed = 1), standing in for a camera,
+                                   e.g. for piloting or to check the latencies reached on a machine
+  open_source(source, replay) picks one: device number -> camera, path -> growing file (or replay)
+- LiveStream(source, backend, ...) reads the frames in a capture thread into a queue of at most max_pending frames;
+  when it is full, the OLDEST frame is dropped (drop-oldest), so inference always works on recent frames. a frame that
+  waited so long that it would not be finished within latency_budget_ms (waiting time + the recent inference time) is
+  dropped as well, as long as a newer frame is waiting
+- the landmarks are emitted as they are produced: stream.frames() is a generator of LiveFrame (frame index, timestamp,
+  RGB image, pose, pose_visibility, lh, rh, latency), and callback(frame) is called for each of them
+- with store (a LandmarkStoreWriter, see landmark_store.py), every captured frame is appended to the store in order as
+  the stream goes on; dropped frames are appended without landmarks (NaN), so frame i of the stored video is still
+  captured frame i (as the frames dropped by the Tasks backend in live_stream mode)
+- stream.report(): number of captured / processed / dropped frames, end-to-end latency percentiles (capture to
+  emission, in ms), frames/second and the time spent per stage (see stage_timers.py)
+
+usage:
+    stream = LiveStream(ReplaySource(video_path), backend, latency_budget_ms=100, store=store)
+    for frame in stream.frames():
+        ...  # frame.pose, frame.lh, frame.rh; stream.stop() ends the stream
+    print(stream.report()['latency_ms'])
+
+used by: estimate_pose_hands.py (live_source), benchmarks/check_live_stream.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import collections
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+from stage_timers import StageTimers
+
+LiveFrame = collections.namedtuple('LiveFrame', ['index', 'timestamp_ms', 'image', 'pose', 'pose_visibility',
+                                                 'lh', 'rh', 'latency'])
+
+default_fps = 30  # for sources that do not report their frame rate (some cameras)
+latency_percentiles = (50, 90, 95, 99)
+
+
+class _CaptureSource:
+    # common part of the sources: an open cv2.VideoCapture and its properties
+
+    def __init__(self, capture):
+        self.cap = capture
+        if not self.cap.isOpened():
+            raise OSError(f'could not open video source {self.description}')
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or default_fps
+        self.frame_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        success, image = self.cap.read()
+        return image if success else None
+
+    def interrupt(self):
+        # called (from another thread) when the stream is stopped
+        pass
+
+    def close(self):
+        self.cap.release()
+
+
+class CameraSource(_CaptureSource):
+
+    def __init__(self, device=0):
+        self.description = f'camera {device}'
+        super().__init__(cv2.VideoCapture(device))
+
+
+class GrowingFileSource(_CaptureSource):
+
+    def __init__(self, path, poll_interval=0.2, idle_timeout=5.0):
+        self.path = path
+        self.description = path
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.n_read = 0
+        self.stopped = threading.Event()
+        # a recording that just started may not be readable yet (header not written): wait for it up to idle_timeout
+        capture = cv2.VideoCapture(path)
+        waited = 0.0
+        while not capture.isOpened() and waited < idle_timeout:
+            time.sleep(poll_interval)
+            waited += poll_interval
+            capture = cv2.VideoCapture(path)
+        super().__init__(capture)
+
+    def read(self):
+        idle_since = None
+        while not self.stopped.is_set():
+            image = super().read()
+            if image is not None:
+                self.n_read += 1
+                return image
+            # reached the end of what was written so far: wait, then re-open the file and continue after the last frame
+            idle_since = time.perf_counter() if idle_since is None else idle_since
+            if time.perf_counter() - idle_since > self.idle_timeout:
+                return None
+            time.sleep(self.poll_interval)
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.path)
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.n_read)
+        return None
+
+    def interrupt(self):
+        # stop waiting for new frames
+        self.stopped.set()
+
+
+class ReplaySource(_CaptureSource):
+
+    def __init__(self, path, speed=1.0):
+        self.description = path
+        self.speed = speed
+        self.n_read = 0
+        self.start = None
+        super().__init__(cv2.VideoCapture(path))
+
+    def read(self):
+        # frame i becomes available i / (fps * speed) seconds after the first one, as from a camera
+        if self.start is None:
+            self.start = time.perf_counter()
+        image = super().read()
+        if image is not None:
+            delay = self.start + self.n_read / (self.fps * self.speed) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.n_read += 1
+        return image
+
+
+def open_source(source, replay=False):
+    # camera for a device number (int or digit string), otherwise a (growing, or with replay: finished) video file
+    if isinstance(source, int) or str(source).isdigit():
+        return CameraSource(int(source))
+    if not os.path.exists(source):
+        raise FileNotFoundError(f'video file {source} not found')
+    return ReplaySource(source) if replay else GrowingFileSource(source)
+
+
+class LiveStream:
+    """pose & hand landmarks of a live source, under a latency budget with drop-oldest frame scheduling
+
+    stream = LiveStream(source, backend, latency_budget_ms=100, max_pending=2, store=None, name='live', callback=None)
+    for frame in stream.frames(): ...   (or stream.run() to only call callback / fill store)
+    stream.report()
+    """
+
+    def __init__(self, source, backend, latency_budget_ms=100, max_pending=2, store=None, name='live', callback=None):
+        if max_pending < 1:
+            raise ValueError(f'max_pending has to be at least 1, got {max_pending}')
+        self.source = source
+        self.backend = backend
+        self.latency_budget = latency_budget_ms / 1e3
+        self.max_pending = max_pending
+        self.store = store
+        self.name = name
+        self.callback = callback
+        self.timers = StageTimers()
+        self.pending = collections.deque()  # (index, capture time, BGR image) of captured frames, oldest first
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.capture_ended = False
+        self.n_captured = 0
+        self.dropped = {'queue_full': 0, 'over_budget': 0}
+        self.latencies = []
+        self.inference_seconds = 0.0  # recent time from submitting a frame to its landmarks (moving average)
+        self.seconds = None
+
+    def stop(self):
+        self.stopped.set()
+        self.source.interrupt()
+        with self.condition:
+            self.condition.notify_all()
+
+    def run(self):
+        for _ in self.frames():
+            pass
+        return self.report()
+
+    def _capture(self):
+        # CAPTURE thread: read frames as they arrive; when max_pending frames are waiting, drop the oldest
+        try:
+            while not self.stopped.is_set():
+                start = time.perf_counter()
+                image = self.source.read()
+                # waiting for the frame & decoding it
+                self.timers.add('capture', time.perf_counter() - start)
+                if image is None:
+                    break
+                with self.condition:
+                    if len(self.pending) >= self.max_pending:
+                        self.pending.popleft()
+                        self.dropped['queue_full'] += 1
+                    self.pending.append((self.n_captured, time.perf_counter(), image))
+                    self.n_captured += 1
+                    self.condition.notify()
+        finally:
+            with self.condition:
+                self.capture_ended = True
+                self.condition.notify()
+
+    def _next_frame(self):
+        # oldest waiting frame that can still be finished within the latency budget (the newest one in any case);
+        # None once the capture has ended and all frames are taken
+        with self.condition:
+            while not self.pending and not self.capture_ended and not self.stopped.is_set():
+                self.condition.wait()
+            if self.stopped.is_set() or not self.pending:
+                return None
+            now = time.perf_counter()
+            while len(self.pending) > 1 and now - self.pending[0][1] + self.inference_seconds > self.latency_budget:
+                self.pending.popleft()
+                self.dropped['over_budget'] += 1
+            return self.pending.popleft()
+
+    def frames(self):
+        # generator of the LiveFrames of the stream, in order of capture, as they are finished
+        self.backend.reset(*self.source.frame_size, self.timers)
+        if self.store is not None:
+            self.store.begin_video(self.name, self.source.fps)
+        capture = threading.Thread(target=self._capture, name='live-capture', daemon=True)
+        submitted = collections.deque()  # (index, capture time, timestamp) of frames in the backend, oldest first
+        stored = 0  # number of frames appended to the store
+        last_timestamp = -1
+        stream_start = time.perf_counter()
+        capture.start()
+        try:
+            while True:
+                item = self._next_frame()
+                if item is None:
+                    finished = self.backend.flush()
+                else:
+                    index, captured, image = item
+                    start = time.perf_counter()
+                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                    self.timers.add('color_conversion', time.perf_counter() - start)
+                    # the backends need strictly increasing timestamps; taken from the capture time, as frames are dropped
+                    timestamp = max(last_timestamp + 1, int(round((captured - stream_start) * 1e3)))
+                    last_timestamp = timestamp
+                    submitted.append((index, captured, timestamp))
+                    start = time.perf_counter()
+                    finished = self.backend.submit(image, timestamp)
+                    seconds = time.perf_counter() - start
+                    self.inference_seconds = seconds if not self.latencies else 0.8 * self.inference_seconds + 0.2 * seconds
+                for result in finished:
+                    index, captured, timestamp = submitted.popleft()
+                    frame = LiveFrame(index, timestamp, result.image, result.pose, result.pose_visibility, result.lh,
+                                      result.rh, time.perf_counter() - captured)
+                    self.latencies.append(frame.latency)
+                    if self.store is not None:
+                        stored = self._store_frames(stored, frame)
+                    if self.callback is not None:
+                        self.callback(frame)
+                    yield frame
+                if item is None:
+                    break
+        finally:
+            self.stop()
+            capture.join()
+            self.source.close()
+            self.seconds = time.perf_counter() - stream_start
+            if self.store is not None:
+                # frames dropped after the last processed one, then close the video in the store
+                self._store_frames(stored, None)
+                self.store.end_video()
+
+    def _store_frames(self, stored, frame):
+        # append the dropped frames before frame (all remaining captured frames for frame = None), then frame itself;
+        # returns the number of stored frames
+        start = time.perf_counter()
+        n_empty = (self.n_captured if frame is None else frame.index) - stored
+        if n_empty > 0:
+            streams = {name: tuple(shape) for name, shape in self.store.index['streams'].items()}
+            self.store.append_frames(**{name: np.full((n_empty, *shape), np.nan) for name, shape in streams.items()})
+            stored += n_empty
+        if frame is not None:
+            self.store.append_frame(pose=frame.pose, lh=frame.lh, rh=frame.rh, pose_visibility=frame.pose_visibility)
+            stored += 1
+        self.timers.add('landmark_copy', time.perf_counter() - start)
+        return stored
+
+    def report(self):
+        # frame counts, end-to-end latencies (capture to emission) and time per stage of the stream so far
+        latencies = np.array(self.latencies) * 1e3
+        n_processed = len(latencies)
+        report = {'source': getattr(self.source, 'description', str(self.source)),
+                  'fps': self.source.fps,
+                  'latency_budget_ms': self.latency_budget * 1e3,
+                  'max_pending': self.max_pending,
+                  'n_captured': self.n_captured,
+                  'n_processed': n_processed,
+                  'dropped_frames': dict(self.dropped),
+                  'seconds': self.seconds,
+                  'frames_per_second': n_processed / self.seconds if self.seconds else None,
+                  'latency_ms': None,
+                  'within_budget': None,
+                  'stages': self.timers.summary(n_processed)}
+        if n_processed:
+            report['latency_ms'] = dict({f'p{p}': float(np.percentile(latencies, p)) for p in latency_percentiles},
+                                        mean=float(latencies.mean()), max=float(latencies.max()))
+            report['within_budget'] = float(np.mean(latencies <= self.latency_budget * 1e3))
+        report.update(self.backend.report())
+        return report
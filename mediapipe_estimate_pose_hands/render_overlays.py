@@ -0,0 +1,208 @@
+"""
+render_overlays.py
+script to (re-)create videos with pose & hand landmarks overlaid, from saved landmarks instead of running MediaPipe
+
+- reads the landmarks from the landmark store written by estimate_pose_hands.py (gestures_pose/landmark_store)
+  and the source videos from mediapipe_indir
+- draws the landmarks onto each frame exactly as estimate_pose_hands.py does (draw_landmark_overlay is shared)
+- can render:
+    - selected videos only (default: all videos in the landmark store)
+    - a frame range of each video (--frames START:STOP)
+    - a thumbnail contact sheet per video instead of a video (--contact-sheet)
+- videos are rendered in parallel across a process pool (--n-workers)
+
+usage (in the mediapipe conda environment):
+    python render_overlays.py                                   # all videos, all frames
+    python render_overlays.py 02_anstreichen.mp4 --frames 20:80
+    python render_overlays.py --contact-sheet --thumbnails 16 --n-workers 4
+
+outputs (in mediapipe_outdir):
+    <video>_pose.mp4, <video>_pose_f<start>-<stop>.mp4 (frame range) or <video>_pose_sheet.png (contact sheet)
+
+required conda environment: mediapipe (on Linux office workstation)
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import argparse
+import multiprocessing
+import os
+import cv2
+import mediapipe as mp
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from landmark_store import LandmarkStore
+
+# get location of this script:
+script_path = os.path.abspath(__file__)
+script_dir = os.path.abspath(os.path.dirname(script_path))
+# path to stimulus directory, relative to this script's location
+relative_path = '../sample_stimuli'
+main_dir = os.path.normpath(os.path.join(script_dir, relative_path))
+
+mediapipe_indir = os.path.join(main_dir, 'gestures')
+mediapipe_outdir = os.path.join(main_dir, 'gestures_pose')
+landmark_store_dir = os.path.join(mediapipe_outdir, 'landmark_store')
+
+mp_pose = mp.solutions.pose
+mp_hands = mp.solutions.hands
+mp_drawing = mp.solutions.drawing_utils
+mp_drawing_styles = mp.solutions.drawing_styles
+
+# pose landmarks that are not drawn: pinkies, index fingers and thumbs (17-22), as they are included in greater detail
+# in the hand model. they are nevertheless still included in the saved landmarks
+hidden_pose_landmarks = np.arange(17, 23)
+
+
+def _landmark_list(array, visibility=None):
+    # build a NormalizedLandmarkList (as expected by mp_drawing) from a (landmark, x/y/z) array
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for lm, (x, y, z) in enumerate(array):
+        landmark = landmark_list.landmark.add(x=x, y=y, z=z)
+        if visibility is not None:
+            landmark.visibility = visibility[lm]
+    return landmark_list
+
+
+def draw_landmark_overlay(image, pose, lh, rh, pose_visibility=None):
+    # draw pose, left hand and right hand landmarks (arrays of shape (landmark, x/y/z), all-NaN if not detected)
+    # onto a BGR image (in place). low-visibility pose landmarks are skipped by mp_drawing if pose_visibility is given
+    if not np.isnan(pose).all():
+        visibility = np.ones(len(pose)) if pose_visibility is None else np.array(pose_visibility, dtype=float)
+        # mp_drawing skips landmarks with visibility < 0.5, and all connections to them
+        visibility[hidden_pose_landmarks] = 0
+        mp_drawing.draw_landmarks(image, _landmark_list(pose, visibility), mp_pose.POSE_CONNECTIONS)
+    # Draw the hand annotations on top of the pose annotations
+    for hand in (lh, rh):
+        if not np.isnan(hand).all():
+            mp_drawing.draw_landmarks(
+                image,
+                _landmark_list(hand),
+                mp_hands.HAND_CONNECTIONS,
+                mp_drawing_styles.get_default_hand_landmarks_style(),
+                mp_drawing_styles.get_default_hand_connections_style())
+    return image
+
+
+def output_name(video, suffix, extension):
+    # add '_pose' (and suffix) to video (before the extension!) for output
+    stem = os.path.splitext(video)[0]
+    return f'{stem}_pose{suffix}{extension}'
+
+
+def _overlay_frames(store, video, frame_idx):
+    # yields (frame index, annotated BGR image) for the requested frames of one video (in ascending order)
+    landmarks = store.video(video)
+    visibility = landmarks.get('pose_visibility')
+    cap = cv2.VideoCapture(os.path.join(mediapipe_indir, video))
+    position = None
+    try:
+        for frame in frame_idx:
+            if position != frame:
+                # only seek when frames are skipped; sequential reading is much faster
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            success, image = cap.read()
+            if not success:
+                break
+            position = frame + 1
+            draw_landmark_overlay(image, landmarks['pose'][frame], landmarks['lh'][frame], landmarks['rh'][frame],
+                                  None if visibility is None else visibility[frame])
+            yield frame, image
+    finally:
+        cap.release()
+
+
+def render_video(video, frame_range=None):
+    # render the overlay video of one video (optionally only frames start:stop)
+    store = LandmarkStore(landmark_store_dir)
+    n_frames = int(store.lengths[store.names.index(video)])
+    start, stop = (0, n_frames) if frame_range is None else frame_range
+    stop = n_frames if stop is None else min(stop, n_frames)
+    suffix = '' if frame_range is None else f'_f{start}-{stop}'
+    output_path = os.path.join(mediapipe_outdir, output_name(video, suffix, '.mp4'))
+
+    cap = cv2.VideoCapture(os.path.join(mediapipe_indir, video))
+    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    fps = store.fps[store.names.index(video)]
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+    for _, image in _overlay_frames(store, video, range(start, stop)):
+        out.write(image)
+    out.release()
+    return output_path
+
+
+def render_contact_sheet(video, n_thumbnails=12, columns=4, thumbnail_width=320, frame_range=None):
+    # render a grid of evenly spaced, annotated frames of one video to a png
+    store = LandmarkStore(landmark_store_dir)
+    n_frames = int(store.lengths[store.names.index(video)])
+    start, stop = (0, n_frames) if frame_range is None else frame_range
+    stop = n_frames if stop is None else min(stop, n_frames)
+    frame_idx = np.unique(np.linspace(start, stop - 1, n_thumbnails).round().astype(int))
+    suffix = '_sheet' if frame_range is None else f'_f{start}-{stop}_sheet'
+    output_path = os.path.join(mediapipe_outdir, output_name(video, suffix, '.png'))
+
+    thumbnails = []
+    for frame, image in _overlay_frames(store, video, frame_idx):
+        height = int(round(image.shape[0] * thumbnail_width / image.shape[1]))
+        thumbnail = cv2.resize(image, (thumbnail_width, height), interpolation=cv2.INTER_AREA)
+        cv2.putText(thumbnail, f'frame {frame}', (8, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        thumbnails.append(thumbnail)
+    if not thumbnails:
+        return None
+    # fill up the last row with black thumbnails
+    rows = -(-len(thumbnails) // columns)
+    thumbnails += [np.zeros_like(thumbnails[0])] * (rows * columns - len(thumbnails))
+    sheet = np.vstack([np.hstack(thumbnails[row * columns:(row + 1) * columns]) for row in range(rows)])
+    cv2.imwrite(output_path, sheet)
+    return output_path
+
+
+def _render_job(job):
+    video, args = job
+    frame_range = _parse_frame_range(args.frames)
+    if args.contact_sheet:
+        return render_contact_sheet(video, args.thumbnails, args.columns, args.thumbnail_width, frame_range)
+    return render_video(video, frame_range)
+
+
+def _parse_frame_range(frames):
+    # 'START:STOP', 'START:' or ':STOP' -> (start, stop); None -> None
+    if frames is None:
+        return None
+    start, _, stop = frames.partition(':')
+    return int(start or 0), int(stop) if stop else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='render landmark overlays from the saved landmark store')
+    parser.add_argument('videos', nargs='*', help='names of the videos to render (default: all in the landmark store)')
+    parser.add_argument('--frames', help='frame range START:STOP (0-based, STOP exclusive)')
+    parser.add_argument('--contact-sheet', action='store_true', help='render a thumbnail contact sheet instead of a video')
+    parser.add_argument('--thumbnails', type=int, default=12, help='number of thumbnails on the contact sheet')
+    parser.add_argument('--columns', type=int, default=4, help='number of thumbnail columns on the contact sheet')
+    parser.add_argument('--thumbnail-width', type=int, default=320, help='width of each thumbnail in pixels')
+    parser.add_argument('--n-workers', type=int, default=1, help='number of videos rendered in parallel')
+    args = parser.parse_args()
+
+    store = LandmarkStore(landmark_store_dir)
+    videos = args.videos if args.videos else store.names
+    missing = [video for video in videos if video not in store.names]
+    if missing:
+        parser.error(f'not in the landmark store: {", ".join(missing)}')
+
+    jobs = [(video, args) for video in videos]
+    workers = min(args.n_workers, len(jobs))
+    if workers > 1:
+        # 'spawn' for the same reason as in estimate_pose_hands.py (MediaPipe/OpenCV are not fork-safe)
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            outputs = pool.map(_render_job, jobs)
+    else:
+        outputs = [_render_job(job) for job in jobs]
+    for output in outputs:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+stage_timers.py
+low-overhead timing of the per-frame stages of estimate_pose_hands.py
+
+- StageTimers accumulates the time spent in each named stage (decode, color_conversion, pose_inference,
+  hand_inference, landmark_copy, drawing, encoding, ...) of one video, plus how often each stage ran
+- stages are timed with plain time.perf_counter() differences and added via timers.add(stage, seconds), so the
+  overhead is well below a microsecond per call; add() is thread-safe, as the pipeline stages run in separate threads
+  (see frame_pipeline.py)
+- profile_video wraps one call in cProfile and dumps the stats to a .prof file (view e.g. with snakeviz or
+  python -m pstats). note that cProfile only sees the calling (inference) thread; to see the decoding and
+  drawing/encoding threads as well, sample the running script with py-spy instead, e.g.
+  py-spy record --threads --idle -o profile.svg -- python estimate_pose_hands.py
+  (the stage functions decode_frames/infer_frame/annotate_frame and the threads pipeline-decode/pipeline-finish
+  show up under their own names)
+
+used by: estimate_pose_hands.py, backends.py
+current version: 2024-03
+written by: Jonathan Wehnert
+"""
+
+import cProfile
+import threading
+
+# order of the stages in the run report
+stage_order = ['decode', 'color_conversion', 'pose_inference', 'hand_inference', 'landmark_copy', 'drawing',
+               'encoding', 'display']
+
+
+class StageTimers:
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def summary(self, n_frames):
+        # total seconds, ms per frame and number of calls of each stage
+        stages = [stage for stage in stage_order if stage in self.seconds]
+        stages += sorted(stage for stage in self.seconds if stage not in stage_order)
+        return {stage: {'seconds': self.seconds[stage],
+                        'ms_per_frame': self.seconds[stage] / n_frames * 1e3 if n_frames else None,
+                        'calls': self.calls[stage]}
+                for stage in stages}
+
+
+def profile_video(profile_path, function, *args, **kwargs):
+    # call function(*args, **kwargs) under cProfile and write the stats to profile_path
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)